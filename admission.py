@@ -0,0 +1,246 @@
+import asyncio
+import logging
+import math
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+from db import DEFAULT_INDEXED_COLUMNS, FILTER_PARAM
+
+'''
+Admission control for the songs API, set up in the "admission" section of config.json.
+Every request is put in a cost class before it runs: "write" for ratings, "expensive" for requests that read a lot of
+the catalog (large pages, deep offsets, sorts and range filters on columns without an index, exports, short or
+wildcard title searches, exact similarity searches) and "read" for everything else. Two limits are then applied:
+- a token bucket per client, refilled at 'rate' tokens a second up to 'burst', from which each request takes the
+  tokens its class costs. A client that runs out gets 429 Too Many Requests, with Retry-After set to when it will
+  have enough tokens again.
+- a cap on how many requests of each class run at once, with a bounded queue of requests waiting for a slot. A request
+  that finds the queue full, or waits longer than 'queue_timeout', gets 503 Service Unavailable with Retry-After.
+The classes have separate slots, so a spike of expensive requests fills its own queue and is shed, while ratings and
+cheap reads keep going through their own slots and keep a low tail latency.
+'''
+
+'''
+The comments are in greater detail to explain each step of the code
+'''
+
+logger = logging.getLogger("api_logger")
+
+DEFAULT_SETTINGS = {
+    "enabled": False,
+    # Token bucket per client: tokens added per second, and the most a client can save up
+    "rate": 50,
+    "burst": 100,
+    # Most clients whose buckets are kept; the least recently seen ones are dropped first (and start full again)
+    "max_clients": 10000,
+    # Request header naming the client (like X-Forwarded-For behind a proxy); the remote address by default
+    "client_header": None,
+    # Tokens taken by a request of each class
+    "costs": {"read": 1, "expensive": 10, "write": 1},
+    # Requests running at once and waiting for a slot, per class
+    "concurrency": {
+        "read": {"limit": 16, "queue": 64},
+        "expensive": {"limit": 2, "queue": 4},
+        "write": {"limit": 4, "queue": 64},
+    },
+    # Seconds a request waits in a queue before it is turned away
+    "queue_timeout": 1.0,
+    # Retry-After of a 503, in seconds
+    "retry_after": 1,
+    # GET /songs pages with more rows than this, or starting past this offset, are expensive
+    "cheap_limit": 100,
+    "cheap_offset": 10000,
+    # Title searches with a word shorter than this match too many titles, and are expensive
+    "min_search_chars": 3,
+    # Endpoints that are never limited, so the API can still be watched while it sheds load
+    "exempt": ["/metrics", "/cache/stats"],
+}
+
+
+# The "admission" section of config.json, filled in with the defaults
+def admission_settings(config):
+    section = config.get('admission', {})
+    settings = {**DEFAULT_SETTINGS, **section}
+    settings["costs"] = {**DEFAULT_SETTINGS["costs"], **section.get('costs', {})}
+    settings["concurrency"] = {**DEFAULT_SETTINGS["concurrency"], **section.get('concurrency', {})}
+    # The columns ingestion builds an index on (see db.build_indexes); a sort or filter on any other column scans
+    settings["indexed_columns"] = frozenset(config.get('indexed_columns', DEFAULT_INDEXED_COLUMNS))
+    return settings
+
+
+# Raised when a request is turned away: 'status' is 429 or 503, and 'retry_after' the whole seconds to wait
+class Rejected(Exception):
+    def __init__(self, message, status, retry_after):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+        self.retry_after = retry_after
+
+
+# Read an integer query parameter the way the request parsers will, falling back to the default if it isn't one
+# (the request then fails its own validation, which is cheap)
+def _integer(args, name, default):
+    try:
+        return int(args.get(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+# The cost class of a request from its URL rule, method, query parameters and URL values
+def request_class(settings, endpoint, method, args, values):
+    if method == "POST":
+        return "write"
+    if endpoint == "/export/songs":
+        return "expensive"
+    if endpoint == "/songs":
+        limit = _integer(args, 'limit', 10)
+        page = _integer(args, 'page', 1)
+        if limit > settings["cheap_limit"]:
+            return "expensive"
+        # An offset page reads every row before it; a cursor seeks straight to its position
+        if args.get('after') is None and (page - 1) * limit > settings["cheap_offset"]:
+            return "expensive"
+        # Without an index on the column, a sort orders every matching row and a range filter reads the whole table
+        sorts = [key.strip().lstrip("-") for key in args.get('sort', '').split(",") if key.strip()]
+        filters = [match.group(1) for match in map(FILTER_PARAM.fullmatch, args) if match is not None]
+        if any(column not in settings["indexed_columns"] for column in sorts + filters):
+            return "expensive"
+    elif endpoint == "/songs/<string:song_name>":
+        # A title search matches every title with a word starting with each search word (see db.fts_query), and one
+        # without any word scans the table
+        if args.get('match') != 'exact':
+            words = re.findall(r"\w+", values.get('song_name', ''))
+            if not words or min(len(word) for word in words) < settings["min_search_chars"]:
+                return "expensive"
+    elif endpoint == "/songs/<song_id>/similar":
+        if args.get('exact', 'false').lower() in ('1', 'true', 'yes'):
+            return "expensive"
+    return "read"
+
+
+# A token bucket per client, kept in least-recently-seen order and bounded by 'max_clients'
+class RateLimiter:
+    def __init__(self, rate, burst, max_clients=10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    # Take 'cost' tokens from the client's bucket, returning 0 if it had them, or else the seconds until it will
+    def take(self, client, cost):
+        now = time.monotonic()
+        with self._lock:
+            tokens, last = self._buckets.pop(client, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+            wait = 0.0
+            if tokens >= cost:
+                tokens -= cost
+            else:
+                wait = (min(cost, self.burst) - tokens) / self.rate if self.rate > 0 else math.inf
+            self._buckets[client] = (tokens, now)
+            while len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+            return wait
+
+
+# Wakes an asyncio task waiting in a ConcurrencyLimit queue; the slot may be handed over from any thread
+class _LoopWaiter:
+    def __init__(self):
+        self.loop = asyncio.get_running_loop()
+        self.future = self.loop.create_future()
+
+    def set(self):
+        self.loop.call_soon_threadsafe(self._wake)
+
+    def _wake(self):
+        if not self.future.done():
+            self.future.set_result(None)
+
+
+# At most 'limit' requests at once, with up to 'queue' more waiting in arrival order for up to 'timeout' seconds
+# A finished request hands its slot straight to the first waiter, so a newcomer can't overtake the queue
+# Requests on Flask threads wait with acquire(), and ASGI requests with acquire_async() without blocking the event loop
+class ConcurrencyLimit:
+    def __init__(self, limit, queue, timeout, retry_after=1):
+        self.limit = limit
+        self.queue = queue
+        self.timeout = timeout
+        self.retry_after = retry_after
+        self.active = 0
+        self._waiters = deque()
+        self._lock = threading.Lock()
+
+    # Take a free slot, or join the queue; returns whether a slot was taken
+    def _enter(self, waiter):
+        with self._lock:
+            if self.active < self.limit and not self._waiters:
+                self.active += 1
+                return True
+            if len(self._waiters) >= self.queue:
+                raise Rejected("Server is busy, try again later", 503, self.retry_after)
+            self._waiters.append(waiter)
+            return False
+
+    # Leave the queue; returns False if a slot was handed over in the meantime, which the caller then holds
+    def _withdraw(self, waiter):
+        with self._lock:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+                return True
+            return False
+
+    def acquire(self):
+        waiter = threading.Event()
+        if self._enter(waiter):
+            return
+        if not waiter.wait(self.timeout) and self._withdraw(waiter):
+            raise Rejected("Server is busy, try again later", 503, self.retry_after)
+
+    async def acquire_async(self):
+        waiter = _LoopWaiter()
+        if self._enter(waiter):
+            return
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), self.timeout)
+        except asyncio.TimeoutError:
+            if self._withdraw(waiter):
+                raise Rejected("Server is busy, try again later", 503, self.retry_after)
+        except asyncio.CancelledError:
+            # The client went away while waiting: give back the slot if it had already been handed over
+            if not self._withdraw(waiter):
+                self.release()
+            raise
+
+    def release(self):
+        with self._lock:
+            if self._waiters:
+                self._waiters.popleft().set()
+            else:
+                self.active -= 1
+
+    # Requests running and waiting
+    def stats(self):
+        with self._lock:
+            return {"active": self.active, "waiting": len(self._waiters), "limit": self.limit, "queue": self.queue}
+
+
+# The limits of one configuration: the client buckets and a ConcurrencyLimit per class
+class AdmissionControl:
+    def __init__(self, settings):
+        self.settings = settings
+        self.buckets = RateLimiter(settings["rate"], settings["burst"], settings["max_clients"])
+        self.limits = {name: ConcurrencyLimit(limit["limit"], limit["queue"], settings["queue_timeout"],
+                                              settings["retry_after"])
+                       for name, limit in settings["concurrency"].items()}
+
+    # Charge a request of class 'cost_class' to the client's bucket, raising Rejected (429) if it can't pay
+    def charge(self, client, cost_class):
+        wait = self.buckets.take(client, self.settings["costs"].get(cost_class, 1))
+        if wait > 0:
+            raise Rejected("Too many requests, slow down", 429, max(1, math.ceil(wait)) if math.isfinite(wait) else 60)
+
+    # The concurrency limit of a class, or None for a class without one
+    def limit(self, cost_class):
+        return self.limits.get(cost_class)
@@ -1,7 +1,32 @@
-from flask import Flask, jsonify, request
-from db import fetch_all_songs, fetch_song_by_id, update_rating
+from flask import Flask, Response, g, jsonify, request
+from werkzeug.http import parse_accept_header
+from db import (fetch_songs, count_songs, fetch_song_by_id, fetch_songs_by_rowid, fetch_ratings_between, rowid_at,
+                update_rating, update_ratings, get_data_version, get_catalog_version, get_config, RATING_BUCKETS,
+                fetch_rating_summary, fetch_rowid_by_id, FILTER_PARAM)
+from cache import ResponseCache, CachedResponse
+from writer import RatingWriter, WriterBusy
+from schema import SONG_COLUMNS, NUMERIC_COLUMNS
+from similarity import IndexManager, similarity_settings
+from snapshot import SnapshotManager, snapshot_enabled, snapshot_root
+from stats import StatsManager, stats_settings, rating_column, ratings_log
+from shards import shard_count, shard_paths
+from export import export_chunks, EXPORT_FORMATS
+from encoding import dumps, encode_list, encode_page, get_encoder, song_json
+from logsetup import configure_logging
+from metrics import metrics, SamplingProfiler
+from admission import AdmissionControl, Rejected, admission_settings, request_class
+import atexit
+import base64
+import binascii
+import hashlib
+import json
 import logging
+import math
 import os
+import re
+import threading
+import time
+import zlib
 
 '''
 The comments are in greater detail to explain each step of the code
@@ -12,85 +37,727 @@ The comments are in greater detail to explain each step of the code
 #                     handlers=[logging.FileHandler('logs/api.log'),
 #                               logging.StreamHandler()])
 
-# Ensure the logs directory exists
-os.makedirs('logs', exist_ok=True)
-
-# Configure named logger
+# Named logger
+# Once configure_logging() has run, records go through a queue to a background thread that writes logs/api.log and the
+# console (see logsetup.py)
 logger = logging.getLogger("api_logger")
-logger.setLevel(logging.INFO)
 
-file_handler = logging.FileHandler('logs/api.log')
-stream_handler = logging.StreamHandler()
+app = Flask(__name__)
 
-formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-file_handler.setFormatter(formatter)
-stream_handler.setFormatter(formatter)
 
-logger.addHandler(file_handler)
-logger.addHandler(stream_handler)
+# Record one finished request in the metrics: its count by status, its latency and the size of its body
+# 'endpoint' is the URL rule, like /songs/<song_name>, so all requests to one endpoint share a series.
+# For a streamed response the latency is the time to the first byte and the size is only known once it has been sent
+def record_request(endpoint, method, status, seconds, size=None):
+    metrics.inc("http_requests", endpoint=endpoint, method=method, status=status)
+    metrics.observe("http_request_seconds", seconds, endpoint=endpoint)
+    if size is not None:
+        metrics.inc("http_response_bytes", size, endpoint=endpoint)
 
-app = Flask(__name__)
 
+# Whether to profile this request: profiling has to be allowed in the "metrics" section of config.json,
+# and the request has to ask for it with ?profile=1 or an "X-Profile: 1" header
+def profiling_requested(args, headers):
+    if not get_config().get('metrics', {}).get('profiling', False):
+        return False
+    return args.get('profile') == '1' or headers.get('X-Profile') == '1'
 
-# Fetch all songs from the database
-@app.route('/songs', methods=['GET'])
-def get_all():
-    logger.info("API call: GET /songs")
+
+# Write the stacks sampled during a request to the profile directory, returning the file name
+def save_profile(profiler, endpoint):
+    directory = get_config().get('metrics', {}).get('profile_dir', 'logs/profiles')
+    os.makedirs(directory, exist_ok=True)
+    name = f"{time.strftime('%Y%m%d-%H%M%S')}-{threading.get_ident()}-{re.sub(r'[^A-Za-z0-9]+', '_', endpoint).strip('_')}.folded"
+    with open(os.path.join(directory, name), 'w') as file:
+        file.write(profiler.collapsed())
+    logger.info(f"Profiled {endpoint}: {profiler.samples} samples written to {name}")
+    return name
+
+
+# Start timing every request, and the sampling profiler when the request asks for it
+@app.before_request
+def start_request():
+    g.start_time = time.perf_counter()
+    if profiling_requested(request.args, request.headers):
+        interval = get_config().get('metrics', {}).get('profile_interval', 0.001)
+        g.profiler = SamplingProfiler(interval=interval).start()
+
+
+# Admission control (see admission.py), built on first use and again whenever the "admission" section of config.json
+# changes; None while it is disabled
+_admission = None
+_admission_lock = threading.Lock()
+
+def get_admission():
+    global _admission
+    settings = admission_settings(get_config())
+    if not settings["enabled"]:
+        return None
+    with _admission_lock:
+        if _admission is None or _admission.settings != settings:
+            _admission = AdmissionControl(settings)
+        return _admission
+
+
+# Classify a request by its cost and charge it to its client's token bucket
+# 'header' looks up a request header, for the client_header setting. Returns the concurrency limit the request has to
+# take a slot of, or None when it isn't limited (admission control is off, the URL is unknown or the endpoint is
+# exempt). Raises Rejected when the client is over its rate
+def admission_check(rule, method, args, values, header, remote_addr):
+    admission = get_admission()
+    if admission is None or rule is None or rule in admission.settings["exempt"]:
+        return None
+    name = admission.settings["client_header"]
+    forwarded = header(name) if name else None
+    client = forwarded.split(",")[0].strip() if forwarded else remote_addr or "unknown"
+    cost_class = request_class(admission.settings, rule, method, args, values)
+    try:
+        admission.charge(client, cost_class)
+    except Rejected:
+        logger.warning(f"Rate limited {client}: {method} {rule} ({cost_class})")
+        raise
+    return admission.limit(cost_class)
+
+
+# The response to a request turned away by admission control
+def rejected_response(e):
+    response = jsonify({"error": e.message})
+    response.status_code = e.status
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response
+
+
+# Admit the request, or answer it straight away with 429 or 503 (see admission.py)
+# The slot it takes is given back in release_slot, or once a streamed body has been closed
+@app.before_request
+def admit_request():
+    rule = request.url_rule.rule if request.url_rule is not None else None
+    try:
+        limit = admission_check(rule, request.method, request.args, request.view_args or {}, request.headers.get,
+                                request.remote_addr)
+        if limit is not None:
+            try:
+                limit.acquire()
+            except Rejected:
+                logger.warning(f"Shed {request.method} {rule}: {limit.stats()}")
+                raise
+            g.admission_slot = limit
+    except Rejected as e:
+        return rejected_response(e)
+
+
+# Give back the admission slot of a request once it has finished
+@app.teardown_request
+def release_slot(error=None):
+    limit = g.pop('admission_slot', None)
+    if limit is not None:
+        limit.release()
+
+
+# Record the finished request, and save its profile (named in the X-Profile response header)
+@app.after_request
+def finish_request(response):
+    endpoint = request.url_rule.rule if request.url_rule is not None else "unmatched"
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        response.headers['X-Profile'] = save_profile(profiler.stop(), endpoint)
+    if response.is_streamed:
+        response.response = counted_body(response.response, endpoint)
+        # A streamed export keeps its admission slot until its body is closed, after the last chunk or when the
+        # client goes away
+        slot = g.pop('admission_slot', None)
+        if slot is not None:
+            response.call_on_close(slot.release)
+    size = None if response.is_streamed else response.content_length
+    record_request(endpoint, request.method, response.status_code, time.perf_counter() - g.start_time, size)
+    return response
+
+
+# Pass a streamed body through, adding its size to the response bytes of the endpoint once it has been sent
+def counted_body(chunks, endpoint):
+    size = 0
+    try:
+        for chunk in chunks:
+            size += len(chunk)
+            yield chunk
+    finally:
+        # Closing the original body releases what it holds (like a database connection) if the client went away
+        if hasattr(chunks, 'close'):
+            chunks.close()
+        metrics.inc("http_response_bytes", size, endpoint=endpoint)
+
+# A resume request of GET /export/songs: skip the first N rows of the export
+ROWS_RANGE = re.compile(r"rows=(\d+)-")
+
+
+# Pagination cursors are opaque to clients - they wrap the position of the last song on a page:
+# its rowid, or for a sorted listing a JSON list of its sort values followed by the rowid
+def encode_cursor(position):
+    text = json.dumps(position, separators=(",", ":")) if isinstance(position, list) else str(position)
+    return base64.urlsafe_b64encode(text.encode()).decode().rstrip("=")
+
+# Decode a cursor back to a position, raising ValueError if it was not produced by encode_cursor
+def decode_cursor(cursor):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        text = base64.urlsafe_b64decode(padded.encode()).decode()
+        position = json.loads(text) if text.startswith("[") else int(text)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise ValueError("Invalid cursor")
+    rowid = position[-1] if isinstance(position, list) and position else position
+    if type(rowid) is not int or rowid < 0:
+        raise ValueError("Invalid cursor")
+    if isinstance(position, list) and not all(value is None or isinstance(value, (int, float, str)) for value in position):
+        raise ValueError("Invalid cursor")
+    return position
+
+
+# Raised by the request handlers below for a client error
+# Both the Flask views and the ASGI app in asgi.py turn it into {"error": message} with the status code
+class ApiError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+@app.errorhandler(ApiError)
+def handle_api_error(e):
+    return jsonify({"error": e.message}), e.status
+
+
+# Cache of GET responses, sized by the "response_cache" section of config.json
+response_cache = ResponseCache(**get_config().get('response_cache', {}))
+
+
+# Encode a response payload with the encoder named by "json_encoder" in config.json (see encoding.py)
+# The default one gives exactly the bytes jsonify does, so every serving mode returns the same bytes
+def encode_json(payload):
+    return get_encoder(get_config().get('json_encoder', 'json'))(payload)
+
+
+# Content encodings GET responses can be compressed with, and the zlib window bits that produce each format
+COMPRESSORS = {"gzip": 31, "deflate": 15}
+
+
+# Whether GET responses are compressed for clients that accept it, from the "compression" section of config.json
+def compression_enabled():
+    return get_config().get('compression', {}).get('enabled', True)
+
+
+# Pick the content encoding of a response from the request's Accept-Encoding header: gzip or deflate, whichever the
+# client prefers (gzip on a tie), or None to send the body as it is
+def negotiate_encoding(accept_encoding):
+    if not compression_enabled():
+        return None
+    accepted = parse_accept_header(accept_encoding or '')
+    encoding = max(COMPRESSORS, key=accepted.quality)
+    return encoding if accepted.quality(encoding) > 0 else None
+
+
+# Compress a response body with the given encoding, or return None if the body is below the "min_size" threshold
+# of the "compression" section of config.json, where compressing wouldn't pay for itself
+def compress_body(body, encoding):
+    settings = get_config().get('compression', {})
+    if len(body) < settings.get('min_size', 1024):
+        return None
+    compressor = zlib.compressobj(settings.get('level', 6), zlib.DEFLATED, COMPRESSORS[encoding])
+    return compressor.compress(body) + compressor.flush()
+
+
+# Look a GET request up in the response cache, building and storing it on a miss
+# 'key' holds the normalized request parameters, and 'build' returns the (payload, status) for the request,
+# where the payload may also be the encoded body
+# The current data version is part of the key, so a rating update or re-ingest invalidates every older entry
+# With an 'encoding' (from negotiate_encoding) the compressed body is cached too, under the key and the encoding,
+# with its own ETag; bodies below the size threshold are cached under that key uncompressed
+# Returns the cache entry and whether it was a hit
+def cached_payload(key, build, encoding=None):
+    key = (get_data_version(),) + key
+    if encoding is not None:
+        entry = response_cache.get(key + (encoding,))
+        if entry is not None:
+            return entry, True
+    entry = response_cache.get(key, count=encoding is None)
+    hit = entry is not None
+    if entry is None:
+        payload, status = build()
+        # Listings and searches built from the stored song JSON come back already encoded
+        body = payload if isinstance(payload, bytes) else encode_json(payload)
+        etag = hashlib.sha1(body).hexdigest()
+        response_cache.put(key, status, body, etag)
+        entry = CachedResponse(status, body, etag, None)
+    if encoding is None:
+        return entry, hit
+    compressed = compress_body(entry.body, encoding)
+    if compressed is None:
+        response_cache.put(key + (encoding,), entry.status, entry.body, entry.etag)
+        return entry, hit
+    etag = f"{entry.etag}-{encoding}"
+    response_cache.put(key + (encoding,), entry.status, compressed, etag, encoding)
+    return CachedResponse(entry.status, compressed, etag, None, encoding), hit
+
+
+# Serve a GET request through the response cache
+# Successful responses carry an ETag, and a matching If-None-Match header gets an empty 304 instead of the body
+# The body is compressed when the client accepts gzip or deflate and it is big enough
+def cached_response(key, build):
+    encoding = negotiate_encoding(request.headers.get('Accept-Encoding'))
+    entry, hit = cached_payload(key, build, encoding)
+    response = app.response_class(entry.body, status=entry.status, mimetype=app.json.mimetype)
+    response.headers['X-Cache'] = 'HIT' if hit else 'MISS'
+    if compression_enabled():
+        response.vary.add('Accept-Encoding')
+    if entry.encoding is not None:
+        response.headers['Content-Encoding'] = entry.encoding
+    if response.status_code == 200:
+        response.set_etag(entry.etag)
+        response.make_conditional(request)
+    return response
+
+
+# Read and check the GET /songs query parameters, returning page, limit and the decoded 'after' cursor
+def parse_songs_args(args):
     # Taking pagination parameters from the request
     # Default values are set to page 1 and limit 10
-    page = request.args.get('page', default=1, type=int)
-    limit = request.args.get('limit', default=10, type=int)
+    page = args.get('page', default=1, type=int)
+    limit = args.get('limit', default=10, type=int)
     # Making sure that the parameters are not less than 1
     if page < 1 or limit < 1:
         logger.warning("Invalid pagination parameters")
-        return jsonify({"error": "Page and limit must be positive integers"}), 400
-    logger.info(f"Pagination parameters: page={page}, limit={limit}")
-    # Fetching all songs and converting them to a list of dictionaries
-    all_songs = [dict(row) for row in fetch_all_songs()]
-    # Setting our pagination start - page-1 for 0-based index, and multiplying by limit to get the start index of this segment
-    start = (page - 1) * limit
-    # Setting the end index as the start + limit
-    end = start + limit
-    # Slicing the list to get the paginated data
-    paginated = all_songs[start:end]
-    return jsonify(
-        {"page": page, "limit": limit, "total": len(all_songs), "data": paginated}
-    )
+        raise ApiError("Page and limit must be positive integers")
+    filters = parse_filters(args)
+    sort = parse_sort(args.get('sort'))
+    # Optional keyset cursor from a previous response, which takes precedence over 'page'
+    cursor = args.get('after')
+    after = None
+    if cursor is not None:
+        try:
+            after = decode_cursor(cursor)
+            # The cursor has to come from a listing with the same number of sort keys
+            if isinstance(after, list) != bool(sort) or (sort and len(after) != len(sort) + 1):
+                raise ValueError("Cursor does not match the sort order")
+        except ValueError as e:
+            logger.warning(f"Invalid pagination cursor: {cursor}")
+            raise ApiError(str(e))
+        if sort:
+            after = tuple(after)
+    logger.info(f"Pagination parameters: page={page}, limit={limit}, after={after}, filters={filters}, sort={sort}")
+    return page, limit, after, filters, sort
+
+
+# Read the range filters of GET /songs, like ?energy_gte=0.7&tempo_lt=120
+# Any numeric column of the Song model can be filtered with the _gt, _gte, _lt and _lte suffixes
+# Returns a sorted tuple of (column, operator, value), so the same filters always make the same cache key
+def parse_filters(args):
+    filters = []
+    for name in args:
+        match = FILTER_PARAM.fullmatch(name)
+        if match is None:
+            continue
+        column, operator = match.groups()
+        if column not in NUMERIC_COLUMNS:
+            logger.warning(f"Invalid filter: {name}")
+            raise ApiError(f"Cannot filter on '{column}'")
+        for text in args.getlist(name):
+            try:
+                value = float(text)
+            except ValueError:
+                value = None
+            if value is None or not math.isfinite(value):
+                logger.warning(f"Invalid filter value: {name}={text}")
+                raise ApiError(f"'{name}' must be a number")
+            filters.append((column, operator, value))
+    return tuple(sorted(filters))
+
+
+# Read the sort order of GET /songs, a comma-separated list of columns with '-' in front for descending order,
+# like ?sort=-tempo,title. Returns a tuple of (column, descending)
+def parse_sort(text):
+    if not text:
+        return ()
+    sort = []
+    for key in text.split(","):
+        key = key.strip()
+        column = key[1:] if key.startswith("-") else key
+        if column not in SONG_COLUMNS:
+            logger.warning(f"Invalid sort key: {key}")
+            raise ApiError(f"Cannot sort on '{column}'")
+        if any(column == existing for existing, _ in sort):
+            raise ApiError(f"'{column}' appears more than once in sort")
+        sort.append((column, key.startswith("-")))
+    limit = get_config().get('max_sort_keys', 3)
+    if len(sort) > limit:
+        raise ApiError(f"At most {limit} sort keys are allowed")
+    return tuple(sort)
+
+
+# Fields a ?fields= projection can name: the columns of the Song model, and in listings the "ratings" summary
+SEARCH_FIELDS = frozenset(SONG_COLUMNS)
+LISTING_FIELDS = SEARCH_FIELDS | {"ratings"}
+
+
+# Read the ?fields= projection of GET /songs and GET /songs/<song_name>, a comma-separated list like
+# ?fields=id,title,rating, checked against 'allowed'. Returns a sorted tuple of the fields (so the same projection
+# always makes the same cache key), or None when the parameter is absent and every field is returned
+def parse_fields(args, allowed):
+    text = args.get('fields')
+    if text is None:
+        return None
+    fields = set()
+    for name in text.split(","):
+        name = name.strip()
+        if not name:
+            continue
+        if name not in allowed:
+            logger.warning(f"Invalid field: {name}")
+            raise ApiError(f"Cannot select '{name}'")
+        fields.add(name)
+    if not fields:
+        raise ApiError("fields must name at least one field")
+    return tuple(sorted(fields))
+
+
+# The fields of a projection from a song row or dictionary, with "ratings" built from the joined rating stats
+def project(song, fields):
+    projected = {field: song[field] for field in fields if field != "ratings"}
+    if "ratings" in fields:
+        projected["ratings"] = rating_summary(dict(song))
+    return projected
+
+
+# Move the rating stats columns joined onto a song row into one "ratings" object
+# Songs that have never been rated get a zero count and an empty histogram
+def rating_summary(song):
+    count = song.pop("rating_count", None) or 0
+    mean = song.pop("rating_mean", None)
+    histogram = [song.pop(f"rating_hist_{bucket}", None) or 0 for bucket in range(RATING_BUCKETS)]
+    return {"count": count, "mean": mean, "histogram": histogram}
+
+
+# The encoded "ratings" summary of songs that have never been rated
+UNRATED_JSON = dumps(rating_summary({}))
+
+
+# The JSON of songs read with their stored JSON (by fetch_songs or fetch_song_by_id with fragments=True), as a list
+# of bytes. With ratings=True every song gets its "ratings" summary, as in listings
+# Songs whose JSON isn't stored (yet) are read in full and encoded on the spot
+def songs_json(rows, ratings=False):
+    missing = fetch_songs_by_rowid([row["rowid"] for row in rows if row["head"] is None])
+    songs = []
+    for row in rows:
+        summary = None
+        if ratings:
+            summary = UNRATED_JSON if row["rating_count"] is None else dumps(rating_summary(dict(row)))
+        if row["head"] is not None:
+            songs.append(song_json(row["head"], row["tail"], row["rating"], summary))
+            continue
+        full = missing.get(row["rowid"])
+        if full is None:
+            # Deleted by an ingestion between the two queries
+            continue
+        song = dict(full)
+        song.pop("rowid", None)
+        song["rating"] = row["rating"]
+        if ratings:
+            song["ratings"] = rating_summary(dict(row))
+        songs.append(dumps(song))
+    return songs
+
+
+# The columnar snapshot of the current catalog version, memory-mapped from the files written at ingestion
+catalog_snapshot = SnapshotManager()
+
+
+# The snapshot to serve the catalog from, or None to read SQLite instead: when snapshots are turned off, the catalog is
+# sharded (shards have no snapshot), none has been written for this database, or the newest one was taken before the
+# last ingestion
+def current_snapshot():
+    config = get_config()
+    db_path = config.get('db_path', 'data/playlist.db')
+    if not snapshot_enabled(config) or shard_count(config) or not os.path.isdir(snapshot_root(db_path)):
+        return None
+    return catalog_snapshot.current(db_path, get_catalog_version())
+
+
+# One page of unfiltered, unsorted GET /songs read from the columnar snapshot, or None to fall back to SQLite
+# The snapshot finds the rowids of the page by position, without SQLite walking past the earlier rows. The songs'
+# stored JSON and the ratings, which change between ingestions, are then read with one range query over those rowids;
+# without stored JSON, or for a ?fields= projection, the page is a slice of the snapshot's arrays (of just the
+# projected columns)
+def snapshot_page(snapshot, page, limit, after, fields=None):
+    start = snapshot.position_after(after) if after is not None else (page - 1) * limit
+    rowids = snapshot.rowids[start:start + limit].tolist()
+    if rowids:
+        ratings = fetch_ratings_between(rowids[0], rowids[-1], fragments=fields is None)
+        # Every song of the page must still be in the table, otherwise the snapshot doesn't match it
+        if len(ratings) != len(rowids) or any(rowid not in ratings for rowid in rowids):
+            logger.warning(f"Catalog snapshot v{snapshot.version} doesn't match the songs table, reading from SQLite")
+            return None
+    # Like fetch_songs, a full page continues from its last rowid and a short page is the last one
+    next_after = rowids[-1] if rowids and len(rowids) == limit else None
+    payload = {
+        "page": page,
+        "limit": limit,
+        "total": snapshot.rows,
+        "next": encode_cursor(next_after) if next_after is not None else None,
+    }
+    if fields is not None:
+        songs = snapshot.rows_between(start, start + limit, fields)
+        payload["data"] = [project({**song, **dict(ratings[song["rowid"]])}, fields) for song in songs]
+        return payload
+    if rowids and "head" in ratings[rowids[0]].keys():
+        return encode_page(payload, songs_json([ratings[rowid] for rowid in rowids], ratings=True))
+    songs = snapshot.rows_between(start, start + limit)
+    for song in songs:
+        song.update(ratings[song.pop("rowid")])
+        song.pop("rowid", None)
+        song["ratings"] = rating_summary(song)
+    payload["data"] = songs
+    return payload
+
+
+# Build one page of GET /songs, with only the given fields of each song if there is a ?fields= projection
+def songs_page(page, limit, after, filters=(), sort=(), fields=None):
+    # Plain listings in insertion order are sliced from the columnar snapshot when there is a current one
+    if not filters and not sort:
+        snapshot = current_snapshot()
+        payload = snapshot_page(snapshot, page, limit, after, fields) if snapshot is not None else None
+        if payload is not None:
+            return payload, 200
+    # Setting our pagination offset - page-1 for 0-based index, and multiplying by limit to get the start index of this segment
+    # The filtering, sorting and LIMIT/OFFSET are done in SQL, so only this page of songs is read from the database
+    # A projection is pushed into the SELECT, and the rating stats are only joined on when "ratings" is asked for
+    offset = (page - 1) * limit
+    if fields is None:
+        rows, next_after = fetch_songs(limit, offset=offset, after=after, filters=filters, sort=sort, fragments=True)
+    else:
+        rows, next_after = fetch_songs(limit, offset=offset, after=after, filters=filters, sort=sort,
+                                       columns=[field for field in fields if field != "ratings"],
+                                       stats="ratings" in fields)
+    payload = {
+        "page": page,
+        "limit": limit,
+        "total": count_songs(filters),
+        "next": encode_cursor(next_after) if next_after is not None else None,
+    }
+    if fields is not None:
+        payload["data"] = [project(row, fields) for row in rows]
+        return payload, 200
+    # Songs stored as JSON are joined into the body as they are
+    if rows and "head" in rows[0].keys():
+        return encode_page(payload, songs_json(rows, ratings=True)), 200
+    # Otherwise (databases ingested before the song_json table existed) the rows are converted to dictionaries,
+    # dropping the internal rowid used for the cursor
+    paginated = []
+    for row in rows:
+        song = dict(row)
+        song.pop("rowid", None)
+        song["ratings"] = rating_summary(song)
+        paginated.append(song)
+    payload["data"] = paginated
+    return payload, 200
+
+
+# Fetch all songs from the database
+@app.route('/songs', methods=['GET'])
+def get_all():
+    logger.info("API call: GET /songs")
+    page, limit, after, filters, sort = parse_songs_args(request.args)
+    fields = parse_fields(request.args, LISTING_FIELDS)
+    return cached_response(('songs', page, limit, after, filters, sort, fields),
+                           lambda: songs_page(page, limit, after, filters, sort, fields))
+
+
+# Read and check the GET /export/songs query parameters and headers
+# Returns the format, the filters, the rowid to start after (from an 'after' cursor), the number of rows to skip
+# (from a "Range: rows=N-" header) and whether to gzip the export
+def parse_export_args(args, headers):
+    format = args.get('format', default='ndjson')
+    if format not in EXPORT_FORMATS:
+        logger.warning(f"Invalid export format: {format}")
+        raise ApiError(f"format must be one of: {', '.join(EXPORT_FORMATS)}")
+    filters = parse_filters(args)
+    # A cursor from GET /songs (unsorted) or from the client's own bookkeeping resumes after that song
+    after = None
+    cursor = args.get('after')
+    if cursor is not None:
+        try:
+            after = decode_cursor(cursor)
+            if isinstance(after, list):
+                raise ValueError("Cursor does not match the sort order")
+        except ValueError as e:
+            logger.warning(f"Invalid export cursor: {cursor}")
+            raise ApiError(str(e))
+    # A client that lost the connection resumes with the number of complete lines it has received;
+    # other range units (like bytes) are ignored and the whole export is sent
+    skip = 0
+    match = ROWS_RANGE.fullmatch(headers.get('Range', '').strip())
+    if match is not None:
+        skip = int(match.group(1))
+    compress = parse_accept_header(headers.get('Accept-Encoding', '')).quality('gzip') > 0
+    logger.info(f"Export parameters: format={format}, filters={filters}, after={after}, skip={skip}, gzip={compress}")
+    return format, filters, after, skip, compress
+
+
+# Start a bulk export, returning the status, the headers and the iterator of body chunks
+# Skipped rows are turned into a starting rowid up front (straight from the snapshot's rowids when the export is
+# unfiltered), so resuming never re-reads the rows already sent
+def songs_export(format, filters, after, skip, compress):
+    if skip:
+        snapshot = current_snapshot() if not filters and after is None else None
+        if snapshot is not None:
+            after = int(snapshot.rowids[skip - 1]) if skip <= snapshot.rows else None
+        else:
+            after = rowid_at(skip - 1, filters, after)
+        if after is None:
+            raise ApiError("Range not satisfiable", 416)
+    headers = {
+        "Content-Type": EXPORT_FORMATS[format],
+        "Content-Disposition": f'attachment; filename="songs.{format}"',
+        "Accept-Ranges": "rows",
+        "Vary": "Accept-Encoding",
+        "Cache-Control": "no-store",
+    }
+    if compress:
+        headers["Content-Encoding"] = "gzip"
+    if skip:
+        headers["Content-Range"] = f"rows {skip}-*/*"
+    chunks = export_chunks(format, filters, after, header=after is None, compress=compress,
+                           batch_size=get_config().get('export_batch_size', 1000))
+    return (206 if skip else 200), headers, chunks
+
+
+# Stream the whole catalog, or the songs matching range filters, as NDJSON or CSV
+@app.route('/export/songs', methods=['GET'])
+def export_songs():
+    logger.info("API call: GET /export/songs")
+    status, headers, chunks = songs_export(*parse_export_args(request.args, request.headers))
+    return Response(chunks, status=status, headers=headers)
+
+
+# Read and check the GET /songs/<song_name> query parameters
+def parse_search_args(args):
+    # ?match=exact asks for an exact (case-insensitive) title match instead of the default ranked search
+    match = args.get('match', default='search')
+    if match not in ('search', 'exact'):
+        logger.warning(f"Invalid match mode: {match}")
+        raise ApiError("match must be 'search' or 'exact'")
+    return match
+
+
+# Build the response of GET /songs/<song_name>, with only the given fields of each song if there is a projection
+def search_songs(song_name, match, fields=None):
+    # Fetching the song by ID from the database
+    if fields is None:
+        songs = fetch_song_by_id(song_name, exact=(match == 'exact'), fragments=True)
+    else:
+        songs = fetch_song_by_id(song_name, exact=(match == 'exact'), columns=fields)
+    # If the song is not found
+    if not songs:
+        return {"error": "Song not found"}, 404 # Return 404 if song not found
+    if fields is not None:
+        return [project(song, fields) for song in songs], 200
+    if "head" in songs[0].keys():
+        return encode_list(songs_json(songs)), 200
+    return [dict(song) for song in songs], 200
 
 
 # Fetch a song by its ID
 @app.route('/songs/<string:song_name>', methods=['GET'])
 def get_by_id(song_name):
     logger.info(f"API call: GET /songs/{song_name}")
-    # Fetching the song by ID from the database
-    songs = fetch_song_by_id(song_name)
-    # If the song is not found
-    if not songs:
-        return jsonify({"error": "Song not found"}), 404 # Return 404 if song not found
-    return jsonify([dict(song) for song in songs])
+    match = parse_search_args(request.args)
+    fields = parse_fields(request.args, SEARCH_FIELDS)
+    return cached_response(('search', song_name, match, fields), lambda: search_songs(song_name, match, fields))
 
 
-# Update the rating of a song
-@app.route('/songs/<song_id>/rate', methods=['POST'])
-def rate_song(song_id):
-    logger.info(f"API call: POST /songs/{song_id}/rate")
-    #Error handling for JSON content-type
-    if not request.is_json:
-        logger.warning("Request content-type not JSON")
-        return jsonify({"error": "Request must be JSON"}), 400 # Return 400 if content-type is not JSON
-    # Extracting the rating from the request body
-    data = request.get_json()
-    rating = data.get("rating")
-    
+# The column summaries of the current catalog version, read from the file written at ingestion
+column_stats = StatsManager()
+
+
+# Build the response of GET /stats/songs: the summary of every numeric column, in model order, and of the ratings log
+# The features come from the stats file and the ratings from the running totals in the database, so the response
+# costs the same however large the catalog is
+def catalog_stats():
+    config = get_config()
+    settings = stats_settings(config)
+    db_path = config.get('db_path', 'data/playlist.db')
+    sources = shard_paths(db_path, shard_count(config)) or None
+    stats = column_stats.current(db_path, get_catalog_version(), settings, sources)
+    summary = fetch_rating_summary()
+    columns = dict(stats["columns"], rating=rating_column(summary, stats["rows"], settings["percentiles"]))
+    return {
+        "songs": stats["rows"],
+        "columns": {column: columns[column] for column in NUMERIC_COLUMNS if column in columns},
+        "ratings": ratings_log(summary),
+    }, 200
+
+
+# Fetch the summary statistics of the catalog
+@app.route('/stats/songs', methods=['GET'])
+def get_stats():
+    logger.info("API call: GET /stats/songs")
+    return cached_response(('stats',), catalog_stats)
+
+
+# The similar-songs index of the current catalog version, memory-mapped from the files written at ingestion
+similarity_index = IndexManager()
+
+
+# Read and check the GET /songs/<song_id>/similar query parameters, returning k and whether to skip the partitions
+def parse_similar_args(args):
+    k = args.get('k', default=10, type=int)
+    max_k = similarity_settings(get_config())["max_k"]
+    if not (1 <= k <= max_k):
+        logger.warning(f"Invalid k: {args.get('k')}")
+        raise ApiError(f"k must be an integer between 1 and {max_k}")
+    exact = args.get('exact', default='false').lower() in ('1', 'true', 'yes')
+    return k, exact
+
+
+# Build the response of GET /songs/<song_id>/similar
+# The neighbours come from the in-memory index, and their rows are then read with a single query
+def similar_songs(song_id, k, exact):
+    config = get_config()
+    settings = similarity_settings(config)
+    db_path = config.get('db_path', 'data/playlist.db')
+    sources = shard_paths(db_path, shard_count(config)) or None
+    index = similarity_index.current(db_path, get_catalog_version(), settings, sources)
+    rowid = fetch_rowid_by_id(song_id)
+    matches = None if rowid is None else index.nearest(rowid, k, probe=settings["probe"], exact=exact)
+    if matches is None:
+        return {"error": "Song not found"}, 404
+    rows = fetch_songs_by_rowid([rowid for rowid, _ in matches])
+    similar = []
+    for rowid, distance in matches:
+        if rowid in rows:
+            song = dict(rows[rowid])
+            song.pop("rowid", None)
+            song["distance"] = round(distance, 6)
+            similar.append(song)
+    return {"id": song_id, "k": k, "similar": similar}, 200
+
+
+# Fetch the songs whose audio features are closest to a song's
+@app.route('/songs/<song_id>/similar', methods=['GET'])
+def get_similar(song_id):
+    logger.info(f"API call: GET /songs/{song_id}/similar")
+    k, exact = parse_similar_args(request.args)
+    return cached_response(('similar', song_id, k, exact), lambda: similar_songs(song_id, k, exact))
+
+
+# Check a rating value from a request body, returning it as a float or raising ApiError
+def check_rating(rating):
     # Error handling for missing or invalid rating
     if rating is None:
         logger.warning("Missing 'rating' in request JSON")
-        return jsonify({"error": "Missing 'rating' in request body"}), 400 # Return 400 if rating is missing
+        raise ApiError("Missing 'rating' in request body") # Return 400 if rating is missing
     
     # Error handling for invalid rating datatype
     if not isinstance(rating, (int, float)):
         logger.warning(f"Invalid rating type: {type(rating)}")
-        return jsonify({"error": "Rating must be a number"}), 400 # Return 400 if rating is not a number
+        raise ApiError("Rating must be a number") # Return 400 if rating is not a number
     # Error handling for rating value
     try:
         rating = float(rating)
@@ -98,17 +765,127 @@ def rate_song(song_id):
             raise ValueError("Rating must be between 0 and 5")
     except ValueError as e:
         logger.warning(f"Invalid rating value: {rating}")
-        return jsonify({"error": str(e)}), 400 # Return 400 if rating is invalid
+        raise ApiError(str(e)) # Return 400 if rating is invalid
+    return rating
+
+
+# The background writer for single ratings, started on first use when "rating_writer" is enabled in config.json
+_rating_writer = None
+_rating_writer_lock = threading.Lock()
+
+def get_rating_writer():
+    global _rating_writer
+    settings = dict(get_config().get('rating_writer', {}))
+    if not settings.pop('enabled', False):
+        return None
+    with _rating_writer_lock:
+        if _rating_writer is None:
+            _rating_writer = RatingWriter(**settings)
+            atexit.register(_rating_writer.close)
+        return _rating_writer
+
+
+# Store one rating, through the background writer if it is enabled and directly otherwise
+# Returns the number of rows updated either way
+def store_rating(song_id, rating):
+    writer = get_rating_writer()
+    if writer is None:
+        return update_rating(song_id, rating)
+    try:
+        return writer.update_rating(song_id, rating)
+    except WriterBusy:
+        logger.warning("Rating writer queue is full")
+        raise ApiError("Too many pending ratings, try again later", 503)
+
+
+# Check the rating in a POST /songs/<song_id>/rate body and store it
+def rate(song_id, data):
+    # Extracting the rating from the request body
+    rating = check_rating(data.get("rating"))
 
     # Update the rating in the database
-    updated = update_rating(song_id, rating)
+    updated = store_rating(song_id, rating)
     if updated == 0:
         logger.warning(f"No song found with ID {song_id}")
-        return jsonify({"error": "Song not found"}), 404 # Return 404 if song not found
+        raise ApiError("Song not found", 404) # Return 404 if song not found
 
     logger.info(f"Rating updated successfully for song ID {song_id}")
-    return jsonify({"message": "Rating updated successfully"}), 200 # Return 200 if rating updated successfully
+    return {"message": "Rating updated successfully"}, 200 # Return 200 if rating updated successfully
+
+
+# Check and store a POST /songs/rate body - a list of {"id": ..., "rating": ...} objects
+# Valid items are written in one transaction, and every item gets its own status in the results,
+# with the same codes and messages the single-item endpoint would have returned for it
+def rate_many(data):
+    if not isinstance(data, list):
+        raise ApiError("Request body must be a list of {id, rating} objects")
+    limit = get_config().get('max_bulk_ratings', 1000)
+    if len(data) > limit:
+        raise ApiError(f"At most {limit} ratings can be sent at once")
+
+    results = [None] * len(data)
+    valid = []
+    for index, item in enumerate(data):
+        song_id = item.get("id") if isinstance(item, dict) else None
+        try:
+            if not isinstance(song_id, str):
+                raise ApiError("Each item needs a string 'id'")
+            valid.append((index, song_id, check_rating(item.get("rating"))))
+        except ApiError as e:
+            results[index] = {"id": song_id, "status": e.status, "error": e.message}
+
+    # Write all the valid ratings in a single transaction
+    counts = update_ratings([(song_id, rating) for _, song_id, rating in valid]) if valid else []
+    for (index, song_id, _), count in zip(valid, counts):
+        if count == 0:
+            results[index] = {"id": song_id, "status": 404, "error": "Song not found"}
+        else:
+            results[index] = {"id": song_id, "status": 200, "message": "Rating updated successfully"}
+
+    updated = sum(1 for result in results if result["status"] == 200)
+    logger.info(f"Bulk rating: {updated} of {len(data)} ratings updated")
+    return {"updated": updated, "results": results}, 200
+
+
+# Update the ratings of many songs in one request
+@app.route('/songs/rate', methods=['POST'])
+def rate_songs():
+    logger.info("API call: POST /songs/rate")
+    if not request.is_json:
+        logger.warning("Request content-type not JSON")
+        return jsonify({"error": "Request must be JSON"}), 400
+    payload, status = rate_many(request.get_json())
+    return jsonify(payload), status
+
+
+# Update the rating of a song
+@app.route('/songs/<song_id>/rate', methods=['POST'])
+def rate_song(song_id):
+    logger.info(f"API call: POST /songs/{song_id}/rate")
+    #Error handling for JSON content-type
+    if not request.is_json:
+        logger.warning("Request content-type not JSON")
+        return jsonify({"error": "Request must be JSON"}), 400 # Return 400 if content-type is not JSON
+    payload, status = rate(song_id, request.get_json())
+    return jsonify(payload), status
+
+
+# Response cache counters
+@app.route('/cache/stats', methods=['GET'])
+def cache_stats():
+    return jsonify(response_cache.stats())
+
+
+# Content type of the Prometheus text format
+METRICS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+# Request, database and connection metrics of this process, for Prometheus to scrape
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    return Response(metrics.render(), content_type=METRICS_CONTENT_TYPE)
 
 
 if __name__ == '__main__':
+    configure_logging()
     app.run(debug=True)
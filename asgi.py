@@ -0,0 +1,317 @@
+import asyncio
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl
+
+from werkzeug.datastructures import MultiDict
+from werkzeug.exceptions import BadRequest, HTTPException, InternalServerError, NotFound
+
+from api import (app, logger, response_cache, ApiError, encode_json, cached_payload, negotiate_encoding,
+                 compression_enabled, parse_fields, LISTING_FIELDS, SEARCH_FIELDS, catalog_stats,
+                 parse_songs_args, songs_page, parse_search_args, search_songs, parse_similar_args, similar_songs,
+                 rate, rate_many, parse_export_args, songs_export, record_request, metrics, METRICS_CONTENT_TYPE,
+                 admission_check)
+from admission import Rejected
+from db import get_config
+from logsetup import configure_logging
+
+'''
+ASGI version of the songs API, served by uvicorn (python main.py serve --asgi).
+The endpoints share their parsing, database and caching code with api.py, so requests and responses are identical
+to the Flask app. SQLite calls block, so they are run on a bounded thread pool instead of on the event loop, and
+a semaphore limits how many requests can be waiting for that pool at once.
+Exports are streamed: each chunk is produced on the thread pool and sent before the next one is read.
+'''
+
+'''
+The comments are in greater detail to explain each step of the code
+'''
+
+# Routing is taken from the Flask app, so both serving modes accept exactly the same URLs
+_urls = app.url_map.bind("localhost")
+
+
+# Runs the blocking database work of the ASGI app
+# 'threads' is the size of the thread pool, and 'max_pending' is the most requests that can be running or queued on it;
+# further requests wait on the event loop without taking up a thread
+class DatabaseExecutor:
+    def __init__(self, threads=8, max_pending=64):
+        self.threads = threads
+        self.max_pending = max_pending
+        self._executor = None
+        self._semaphore = None
+
+    async def run(self, function, *args):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix="sqlite")
+            self._semaphore = asyncio.Semaphore(self.max_pending)
+        async with self._semaphore:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, function, *args)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+
+_server = get_config().get('server', {})
+db_executor = DatabaseExecutor(_server.get('asgi_threads', 8), _server.get('asgi_max_pending', 64))
+
+
+# Build the (status, headers, body) of a JSON response
+def json_response(payload, status=200):
+    return status, [(b"content-type", b"application/json")], encode_json(payload)
+
+
+# Build the response of a werkzeug HTTP error, the same page Flask returns for it
+def error_response(error):
+    response = error.get_response()
+    headers = [(key.lower().encode("latin-1"), value.encode("latin-1")) for key, value in response.headers.items()
+               if key.lower() != "content-length"]
+    return response.status_code, headers, response.get_data()
+
+
+# Serve a GET request through the shared response cache, with the same X-Cache, ETag, 304 and compression handling
+# as api.py
+async def cached(key, build, headers):
+    encoding = negotiate_encoding(headers.get(b"accept-encoding", b"").decode("latin-1"))
+    entry, hit = await db_executor.run(cached_payload, key, build, encoding)
+    response_headers = [(b"content-type", b"application/json"), (b"x-cache", b"HIT" if hit else b"MISS")]
+    if compression_enabled():
+        response_headers.append((b"vary", b"Accept-Encoding"))
+    if entry.encoding is not None:
+        response_headers.append((b"content-encoding", entry.encoding.encode()))
+    body = entry.body
+    if entry.status == 200:
+        etag = f'"{entry.etag}"'
+        response_headers.append((b"etag", etag.encode()))
+        match = headers.get(b"if-none-match", b"").decode("latin-1")
+        if etag in [tag.strip() for tag in match.split(",")] or match.strip() == "*":
+            return 304, [header for header in response_headers if header[0] not in (b"content-type", b"content-encoding")], b""
+    return entry.status, response_headers, body
+
+
+# Fetch all songs from the database
+async def get_all(query, headers):
+    logger.info("API call: GET /songs")
+    page, limit, after, filters, sort = parse_songs_args(query)
+    fields = parse_fields(query, LISTING_FIELDS)
+    return await cached(('songs', page, limit, after, filters, sort, fields),
+                        lambda: songs_page(page, limit, after, filters, sort, fields), headers)
+
+
+# Fetch the summary statistics of the catalog
+async def get_stats(query, headers):
+    logger.info("API call: GET /stats/songs")
+    return await cached(('stats',), catalog_stats, headers)
+
+
+# Fetch a song by its ID
+async def get_by_id(query, headers, song_name):
+    logger.info(f"API call: GET /songs/{song_name}")
+    match = parse_search_args(query)
+    fields = parse_fields(query, SEARCH_FIELDS)
+    return await cached(('search', song_name, match, fields), lambda: search_songs(song_name, match, fields), headers)
+
+
+# Fetch the songs whose audio features are closest to a song's
+async def get_similar(query, headers, song_id):
+    logger.info(f"API call: GET /songs/{song_id}/similar")
+    k, exact = parse_similar_args(query)
+    return await cached(('similar', song_id, k, exact), lambda: similar_songs(song_id, k, exact), headers)
+
+
+# Stream the catalog as NDJSON or CSV; the body is returned as an iterator of chunks
+async def export_songs(query, headers):
+    logger.info("API call: GET /export/songs")
+    request_headers = {name: headers.get(name.lower().encode(), b"").decode("latin-1") for name in ("Range", "Accept-Encoding")}
+    status, response_headers, chunks = await db_executor.run(songs_export, *parse_export_args(query, request_headers))
+    return status, [(key.lower().encode("latin-1"), value.encode("latin-1")) for key, value in response_headers.items()], chunks
+
+
+# Decode a JSON request body, returning None if the content-type isn't JSON (the same check as Flask's request.is_json)
+def read_json(headers, body):
+    mimetype = headers.get(b"content-type", b"").decode("latin-1").split(";")[0].strip().lower()
+    if not (mimetype == "application/json" or (mimetype.startswith("application/") and mimetype.endswith("+json"))):
+        logger.warning("Request content-type not JSON")
+        return None
+    try:
+        return json.loads(body)
+    except ValueError:
+        raise BadRequest("Failed to decode JSON object")
+
+
+# Update the rating of a song
+async def rate_song(headers, body, song_id):
+    logger.info(f"API call: POST /songs/{song_id}/rate")
+    data = read_json(headers, body)
+    if data is None:
+        return json_response({"error": "Request must be JSON"}, 400)
+    payload, status = await db_executor.run(rate, song_id, data)
+    return json_response(payload, status)
+
+
+# Update the ratings of many songs in one request
+async def rate_songs(headers, body):
+    logger.info("API call: POST /songs/rate")
+    data = read_json(headers, body)
+    if data is None:
+        return json_response({"error": "Request must be JSON"}, 400)
+    payload, status = await db_executor.run(rate_many, data)
+    return json_response(payload, status)
+
+
+# Response cache counters
+async def cache_stats():
+    return json_response(response_cache.stats())
+
+
+# Request, database and connection metrics of this process
+async def get_metrics():
+    return 200, [(b"content-type", METRICS_CONTENT_TYPE.encode())], metrics.render().encode()
+
+
+# The URL rule of a request for the metrics, like /songs/<song_name>, or "unmatched"
+def endpoint_label(method, path):
+    try:
+        rule, _ = _urls.match(path, method, return_rule=True)
+        return rule.rule
+    except HTTPException:
+        return "unmatched"
+
+
+# Apply admission control (see admission.py) to a request: charge it to its client and wait for a slot of its class
+# on the event loop. Returns the slot it holds, if any, and raises Rejected when it is turned away
+async def admit(method, path, query, headers, client):
+    try:
+        rule, values = _urls.match(path, method, return_rule=True)
+    except HTTPException:
+        return None
+    limit = admission_check(rule.rule, method, query, values,
+                            lambda name: headers.get(name.lower().encode("latin-1"), b"").decode("latin-1") or None,
+                            client[0] if client else None)
+    if limit is not None:
+        try:
+            await limit.acquire_async()
+        except Rejected:
+            logger.warning(f"Shed {method} {rule.rule}: {limit.stats()}")
+            raise
+    return limit
+
+
+# The response to a request turned away by admission control
+def rejected_response(e):
+    status, headers, body = json_response({"error": e.message}, e.status)
+    return status, headers + [(b"retry-after", str(e.retry_after).encode())], body
+
+
+# Route one request to its endpoint, turning client errors into the same responses as the Flask app
+async def dispatch(method, path, query, headers, body):
+    try:
+        endpoint, values = _urls.match(path, method)
+        # Flask answers OPTIONS itself with the allowed methods of the URL
+        if method == 'OPTIONS':
+            allowed = ", ".join(sorted(_urls.allowed_methods(path)))
+            return 200, [(b"allow", allowed.encode())], b""
+        if endpoint == 'get_all':
+            return await get_all(query, headers)
+        if endpoint == 'get_stats':
+            return await get_stats(query, headers)
+        if endpoint == 'get_by_id':
+            return await get_by_id(query, headers, **values)
+        if endpoint == 'get_similar':
+            return await get_similar(query, headers, **values)
+        if endpoint == 'export_songs':
+            return await export_songs(query, headers)
+        if endpoint == 'rate_song':
+            return await rate_song(headers, body, **values)
+        if endpoint == 'rate_songs':
+            return await rate_songs(headers, body)
+        if endpoint == 'cache_stats':
+            return await cache_stats()
+        if endpoint == 'get_metrics':
+            return await get_metrics()
+        raise NotFound()
+    except ApiError as e:
+        return json_response({"error": e.message}, e.status)
+    except HTTPException as e:
+        return error_response(e)
+
+
+# Read the whole request body
+async def read_body(receive):
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            return body
+
+
+# The ASGI application
+async def application(scope, receive, send):
+    if scope["type"] == "lifespan":
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                # Each uvicorn worker process sets up its logging once, when it starts
+                configure_logging()
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                db_executor.shutdown()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+    if scope["type"] != "http":
+        return
+
+    start_time = time.perf_counter()
+    headers = dict(scope["headers"])
+    query = MultiDict(parse_qsl(scope.get("query_string", b"").decode("utf-8", "replace"), keep_blank_values=True))
+    body = await read_body(receive)
+    slot = None
+    try:
+        try:
+            slot = await admit(scope["method"], scope["path"], query, headers, scope.get("client"))
+            status, response_headers, payload = await dispatch(scope["method"], scope["path"], query, headers, body)
+        except Rejected as e:
+            status, response_headers, payload = rejected_response(e)
+        except Exception:
+            logger.exception(f"Unhandled error for {scope['method']} {scope['path']}")
+            status, response_headers, payload = error_response(InternalServerError())
+        endpoint = endpoint_label(scope["method"], scope["path"])
+        if not isinstance(payload, bytes):
+            record_request(endpoint, scope["method"], status, time.perf_counter() - start_time)
+            size = await stream(scope, send, status, response_headers, payload)
+            metrics.inc("http_response_bytes", size, endpoint=endpoint)
+            return
+        record_request(endpoint, scope["method"], status, time.perf_counter() - start_time, len(payload))
+        response_headers.append((b"content-length", str(len(payload)).encode()))
+        if scope["method"] == "HEAD":
+            payload = b""
+        await send({"type": "http.response.start", "status": status, "headers": response_headers})
+        await send({"type": "http.response.body", "body": payload})
+    finally:
+        # The request gives back its admission slot once its response has been sent, streamed ones included
+        if slot is not None:
+            slot.release()
+
+
+# Send a response body chunk by chunk, without a content-length (the server uses chunked encoding)
+# Every chunk is read on the database thread pool; the iterator is closed at the end, releasing its connection,
+# even if the client went away. Returns the number of body bytes sent
+async def stream(scope, send, status, headers, chunks):
+    size = 0
+    try:
+        await send({"type": "http.response.start", "status": status, "headers": headers})
+        if scope["method"] != "HEAD":
+            while True:
+                chunk = await db_executor.run(next, chunks, None)
+                if chunk is None:
+                    break
+                size += len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": True})
+        await send({"type": "http.response.body", "body": b""})
+    finally:
+        await db_executor.run(chunks.close)
+    return size
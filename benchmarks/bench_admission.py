@@ -0,0 +1,109 @@
+import argparse
+import logging
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from unittest.mock import patch
+
+import numpy as np
+
+'''
+Benchmark for admission control under overload.
+It ingests a synthetic catalog (benchmarks/generate.py), then runs a flood of expensive requests (pages of 1,000 songs
+at random offsets and one-letter title searches) from several threads, each thread a client of its own that waits for
+Retry-After when it is turned away, while one probe thread keeps sending cheap requests (exact title searches) and
+ratings. It does this once with admission control off and once with it on, and reports the p50 and p99 latency of the
+probe requests, and how many of the flood requests were served, rate limited (429) or shed (503).
+Run it from the repository root: python benchmarks/bench_admission.py --rows 100000 --flood 8 --seconds 10
+'''
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import api
+import db
+import dataParsing
+from generate import generate
+
+
+# Send expensive requests as one client until the deadline, counting the response statuses
+def flood(deadline, rows, statuses, index):
+    client = api.app.test_client()
+    headers = {"X-Client": f"flood-{index}"}
+    letters = "LNSHDFCRGM"
+    while time.perf_counter() < deadline:
+        if random.random() < 0.5:
+            url = f"/songs?limit=1000&page={random.randint(1, max(rows // 1000, 1))}"
+        else:
+            url = f"/songs/{random.choice(letters)}"
+        response = client.get(url, headers=headers)
+        statuses[response.status_code] += 1
+        # A well-behaved client waits as long as it is told to before trying again
+        if "Retry-After" in response.headers:
+            time.sleep(min(float(response.headers["Retry-After"]), max(deadline - time.perf_counter(), 0)))
+
+
+# Send cheap reads and ratings until the deadline, recording the latency of every request in milliseconds
+def probe(deadline, titles, ids, latencies):
+    client = api.app.test_client()
+    headers = {"X-Client": "probe"}
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        client.get(f"/songs/{random.choice(titles)}?match=exact", headers=headers)
+        client.post(f"/songs/{random.choice(ids)}/rate", json={"rating": 4.0}, headers=headers)
+        latencies.append((time.perf_counter() - start) * 1000 / 2)
+        time.sleep(0.01)
+
+
+# Run the flood and the probe for the given number of seconds
+def run(config, args, titles, ids):
+    api.response_cache.clear()
+    statuses = Counter()
+    latencies = []
+    deadline = time.perf_counter() + args.seconds
+    with patch('db.get_config', return_value=config), patch('api.get_config', return_value=config):
+        threads = [threading.Thread(target=flood, args=(deadline, args.rows, statuses, i)) for i in range(args.flood)]
+        threads.append(threading.Thread(target=probe, args=(deadline, titles, ids, latencies)))
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    return np.percentile(latencies, 50), np.percentile(latencies, 99), len(latencies), statuses
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the latency of cheap requests under a flood of expensive ones")
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--flood", type=int, default=8, help="threads sending expensive requests")
+    parser.add_argument("--seconds", type=float, default=10.0)
+    args = parser.parse_args()
+    logging.disable(logging.CRITICAL)
+
+    work_dir = tempfile.mkdtemp()
+    try:
+        source = os.path.join(work_dir, "songs.ndjson")
+        generate(source, args.rows)
+        config = dict(api.get_config(), db_path=os.path.join(work_dir, "playlist.db"))
+        with patch('dataParsing.get_config', return_value=config), patch('db.get_config', return_value=config):
+            dataParsing.ingest_stream(source, config["db_path"])
+            songs = [dict(row) for row in db.fetch_songs(1000, offset=args.rows // 2)[0]]
+        titles = [song["title"] for song in songs]
+        ids = [song["id"] for song in songs]
+
+        admission = dict(config.get('admission', {}), client_header="X-Client")
+        for label, enabled in (("admission off", False), ("admission on", True)):
+            p50, p99, count, statuses = run(dict(config, admission=dict(admission, enabled=enabled)), args, titles, ids)
+            print(f"{label:<14} probe p50 {p50:7.2f} ms  p99 {p99:8.2f} ms ({count} probes)  "
+                  f"flood: {statuses[200]} served, {statuses[429]} rate limited, {statuses[503]} shed")
+    finally:
+        db.pool.close_all()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
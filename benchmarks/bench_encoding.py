@@ -0,0 +1,97 @@
+import argparse
+import logging
+import os
+import shutil
+import statistics
+import sqlite3
+import sys
+import tempfile
+import time
+from unittest.mock import patch
+
+'''
+Benchmark for building the GET /songs and GET /songs/<song_name> response bodies.
+It ingests a synthetic catalog (benchmarks/generate.py) into a temporary database and times the body of large pages
+and broad title searches built from the song JSON stored at ingestion (the default), and by turning every row into a
+dict and encoding it with each JSON encoder. Plain listings go through the columnar snapshot either way.
+The response cache is bypassed, so every timing includes the database reads.
+Run it from the repository root: python benchmarks/bench_encoding.py --rows 200000 --limit 1000
+'''
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import api
+import db
+import dataParsing
+from encoding import build_fragments, get_encoder
+from generate import generate
+
+
+# Median milliseconds of 'repeat' calls
+def time_ms(function, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+# Build a response body the way the API does, with the given JSON encoder for payloads that aren't encoded yet
+def body(build, encoder):
+    payload, _ = build()
+    return payload if isinstance(payload, bytes) else get_encoder(encoder)(payload)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time building song responses from stored JSON and from dicts")
+    parser.add_argument("--rows", type=int, default=200000)
+    parser.add_argument("--limit", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+    logging.disable(logging.CRITICAL)
+
+    work_dir = tempfile.mkdtemp()
+    try:
+        source = os.path.join(work_dir, "songs.ndjson")
+        db_path = os.path.join(work_dir, "playlist.db")
+        generate(source, args.rows)
+        config = {"db_path": db_path, "snapshot": {"enabled": True}}
+        with patch('dataParsing.get_config', return_value=config), patch('db.get_config', return_value=config):
+            dataParsing.ingest_stream(source, db_path)
+        # Encode every song again, to time it on its own
+        conn = sqlite3.connect(db_path, isolation_level=None)
+        start = time.perf_counter()
+        encoded = build_fragments(conn)
+        build_seconds = time.perf_counter() - start
+        stored = conn.execute("SELECT SUM(LENGTH(head) + LENGTH(tail)) FROM song_json").fetchone()[0]
+        conn.close()
+        print(f"{args.rows} songs: storing their JSON took {build_seconds:.1f}s for {encoded} songs, "
+              f"{stored / (1024 * 1024):.0f} MB")
+
+        limit = args.limit
+        cases = [
+            ("plain listing", lambda: api.songs_page(2, limit, None)),
+            ("plain listing, deep", lambda: api.songs_page(args.rows // limit - 10, limit, None)),
+            ("filtered listing", lambda: api.songs_page(2, limit, None, (("energy", "gte", 0.0),))),
+            ("sorted listing", lambda: api.songs_page(1, limit, None, (), (("tempo", True),))),
+            ("title search 'Love'", lambda: api.search_songs("Love", "search")),
+        ]
+        print(f"{'response':<22}{'stored JSON':>14}{'dicts, json':>14}{'dicts, orjson':>15}")
+        for name, build in cases:
+            with patch('db.get_config', return_value=config), patch('api.get_config', return_value=config):
+                timings = [time_ms(lambda: body(build, "json"), args.repeat)]
+                with patch('db.has_song_json', return_value=False):
+                    timings.append(time_ms(lambda: body(build, "json"), args.repeat))
+                    timings.append(time_ms(lambda: body(build, "orjson"), args.repeat))
+            db.pool.close_all()
+            print(f"{name:<22}" + "".join(f"{timing:>{width}.1f}" for timing, width in zip(timings, (14, 14, 15))))
+        print("(milliseconds per response, median)")
+    finally:
+        db.pool.close_all()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+import argparse
+import logging
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from unittest.mock import patch
+
+'''
+Benchmark for ?fields= projections and response compression.
+It ingests a synthetic catalog (benchmarks/generate.py), then requests a listing page, a sorted listing page and an
+exact title search, each with every field and with a small projection, and sends each one without compression,
+with gzip and with deflate. For every case it reports the size of the response body and the median time to build
+it, with the response cache cleared before each request, so the times include the database reads and the compression.
+Run it from the repository root: python benchmarks/bench_fields.py --rows 100000 --limit 100
+'''
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import api
+import db
+import dataParsing
+from generate import generate
+
+ENCODINGS = [None, "gzip", "deflate"]
+
+
+# Median milliseconds of 'repeat' requests of a URL, and the size of its body
+def measure(client, url, encoding, repeat):
+    headers = {"Accept-Encoding": encoding} if encoding else {}
+    timings = []
+    for _ in range(repeat):
+        api.response_cache.clear()
+        start = time.perf_counter()
+        response = client.get(url, headers=headers)
+        timings.append((time.perf_counter() - start) * 1000)
+    return len(response.get_data()), statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare response sizes and latency with projections and compression")
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--limit", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--fields", default="id,title,rating")
+    args = parser.parse_args()
+    logging.disable(logging.CRITICAL)
+
+    work_dir = tempfile.mkdtemp()
+    try:
+        source = os.path.join(work_dir, "songs.ndjson")
+        generate(source, args.rows)
+        # Admission control is off, so the repeated requests of the one client aren't rate limited
+        config = dict(api.get_config(), db_path=os.path.join(work_dir, "playlist.db"), admission={"enabled": False})
+        with patch('dataParsing.get_config', return_value=config), patch('db.get_config', return_value=config), \
+                patch('api.get_config', return_value=config), api.app.test_client() as client:
+            dataParsing.ingest_stream(source, config["db_path"])
+            title = db.fetch_songs(1, offset=args.rows // 2)[0][0]["title"]
+            cases = [
+                ("listing page", f"/songs?limit={args.limit}&page=10"),
+                ("sorted page", f"/songs?limit={args.limit}&sort=-energy"),
+                ("exact title search", f"/songs/{title}?match=exact"),
+            ]
+            print(f"{'':<38}" + "".join(f"{encoding or 'identity':>22}" for encoding in ENCODINGS))
+            for label, url in cases:
+                for projection in (None, args.fields):
+                    target = url if projection is None else f"{url}{'&' if '?' in url else '?'}fields={projection}"
+                    results = [measure(client, target, encoding, args.repeat) for encoding in ENCODINGS]
+                    name = f"{label} ({'all fields' if projection is None else projection})"
+                    print(f"{name:<38}" + "".join(f"{size:>10} B {ms:>7.2f} ms" for size, ms in results))
+        print(f"(times are medians of {args.repeat} uncached requests)")
+    finally:
+        db.pool.close_all()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
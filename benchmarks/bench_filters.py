@@ -0,0 +1,129 @@
+import argparse
+import json
+import os
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from unittest.mock import patch
+
+'''
+Benchmark for the GET /songs range filters and sorting.
+For each table size it fills a temporary database with random songs, builds the ingestion indexes, and times a
+set of filtered and sorted queries through db.fetch_songs and db.count_songs. It also prints SQLite's query plan for
+each query, which shows whether it seeks through an index or scans the table.
+Run it from the repository root: python benchmarks/bench_filters.py --sizes 10000 100000 1000000
+'''
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db
+from schema import SONG_FIELDS
+
+# The queries timed at every size - (name, filters, sort)
+QUERIES = [
+    ("selective filter, sorted on it", (("energy", "gte", 0.999),), (("energy", True),)),
+    ("broad filter, sorted on another column", (("energy", "gte", 0.5),), (("tempo", True),)),
+    ("two filters, sorted", (("danceability", "gte", 0.9), ("tempo", "lt", 100.0)), (("danceability", False),)),
+    ("selective filter, insertion order", (("valence", "lte", 0.001),), ()),
+    ("broad filter, insertion order", (("loudness", "lte", -10.0),), ()),
+    ("sort only", (), (("duration_ms", True),)),
+]
+
+
+# Fill the songs table with random rows in one INSERT ... SELECT over a recursive counter
+def fill(conn, rows):
+    expressions = []
+    for column, (_, kind, _, _) in SONG_FIELDS.items():
+        if column == "id":
+            expressions.append("printf('%022d', n)")
+        elif column == "title":
+            expressions.append("'Song ' || n")
+        elif column == "rating":
+            expressions.append("NULL")
+        elif column == "loudness":
+            expressions.append("-(abs(random()) % 60000) / 1000.0")
+        elif column == "tempo":
+            expressions.append("60 + (abs(random()) % 140000) / 1000.0")
+        elif column == "duration_ms":
+            expressions.append("60000 + abs(random()) % 400000")
+        elif kind is float:
+            expressions.append("(abs(random()) % 1000000) / 1000000.0")
+        else:
+            expressions.append("abs(random()) % 12")
+    columns = ", ".join(f'"{column}"' for column in SONG_FIELDS)
+    conn.execute(f"CREATE TABLE songs ({columns})")
+    conn.execute(f"""
+        INSERT INTO songs ({columns})
+        WITH RECURSIVE counter(n) AS (SELECT 1 UNION ALL SELECT n + 1 FROM counter WHERE n < ?)
+        SELECT {', '.join(expressions)} FROM counter
+    """, (rows,))
+    conn.commit()
+
+
+# Median milliseconds of a few runs of a function
+def time_ms(function, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append((time.perf_counter() - start) * 1000)
+    return round(statistics.median(timings), 3)
+
+
+# The query plan SQLite picks for one listing query
+def query_plan(conn, filters, sort, limit):
+    clauses, params = db._filter_clauses(filters)
+    keys = [(f'songs."{column}"', descending) for column, descending in sort]
+    keys.append(("songs.rowid", sort[-1][1] if sort else False))
+    where = f"WHERE {' AND '.join(clauses)} " if clauses else ""
+    order = ", ".join(f"{expression} DESC" if descending else expression for expression, descending in keys)
+    query = f"EXPLAIN QUERY PLAN SELECT * FROM songs {where}ORDER BY {order} LIMIT {limit}"
+    return "; ".join(row[3] for row in conn.execute(query, params))
+
+
+def run_size(tmp_dir, rows, limit, repeat):
+    path = os.path.join(tmp_dir, f"songs_{rows}.db")
+    conn = sqlite3.connect(path)
+    start = time.perf_counter()
+    fill(conn, rows)
+    with patch('db.get_config', return_value={"db_path": path}):
+        db.build_indexes(conn)
+        build_seconds = time.perf_counter() - start
+        results = []
+        for name, filters, sort in QUERIES:
+            page_ms = time_ms(lambda: db.fetch_songs(limit, filters=filters, sort=sort), repeat)
+            # The next page through the keyset cursor
+            _, after = db.fetch_songs(limit, filters=filters, sort=sort)
+            next_ms = time_ms(lambda: db.fetch_songs(limit, after=after, filters=filters, sort=sort), repeat) if after else None
+            db.invalidate_count_cache()
+            count_ms = time_ms(lambda: (db.invalidate_count_cache(), db.count_songs(filters)), repeat)
+            results.append({
+                "query": name,
+                "first_page_ms": page_ms,
+                "next_page_ms": next_ms,
+                "count_ms": count_ms,
+                "plan": query_plan(conn, filters, sort, limit),
+            })
+        db.pool.close_all()
+    conn.close()
+    os.remove(path)
+    return {"rows": rows, "load_and_index_seconds": round(build_seconds, 2), "queries": results}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time filtered and sorted song listings at several table sizes")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000])
+    parser.add_argument("--limit", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    db.logger.disabled = True
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        results = [run_size(tmp_dir, rows, args.limit, args.repeat) for rows in args.sizes]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
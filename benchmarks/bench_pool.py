@@ -0,0 +1,95 @@
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from unittest.mock import patch
+
+'''
+Benchmark for the connection pool in db.py.
+It copies the playlist database to a temporary directory and drives the Flask API through its test client
+from several threads, once with the old behaviour (config.json parsed and a new connection opened and
+closed on every call) and once with the pooled connections, then prints requests/sec for both.
+Run it from the repository root: python benchmarks/bench_pool.py --threads 8 --seconds 5
+'''
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db
+import api
+from api import app
+
+
+# Send a mix of read and write requests from one thread until the deadline, counting completed requests
+def worker(deadline, counts, index):
+    client = app.test_client()
+    done = 0
+    while time.perf_counter() < deadline:
+        client.get('/songs?page=2&limit=10')
+        client.get('/songs/Love')
+        client.post('/songs/5vYA1mW9g2Coh1HUFUSmlb/rate', json={"rating": 4.0})
+        done += 3
+    counts[index] = done
+
+
+# Run the workers for the given number of seconds and return the requests/sec achieved
+def run(threads, seconds):
+    counts = [0] * threads
+    deadline = time.perf_counter() + seconds
+    pool = [threading.Thread(target=worker, args=(deadline, counts, i)) for i in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    return sum(counts) / seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare API requests/sec with and without the connection pool")
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--db", default="data/playlist.db", help="database to copy for the benchmark")
+    args = parser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        db_copy = os.path.join(tmp_dir, "playlist.db")
+        shutil.copy(args.db, db_copy)
+        # Silence per-call logging so it doesn't dominate the timings
+        db.logger.disabled = True
+        app.logger.disabled = True
+        api.logger.disabled = True
+        # Every worker is the same client, which admission control would rate limit
+        api_config = patch('api.get_config', return_value=dict(db.get_config(), admission={"enabled": False}))
+        api_config.start()
+
+        # Before: re-read config.json and open a plain new connection for every database call
+        config_path = os.path.join(tmp_dir, "config.json")
+        with open(config_path, "w") as file:
+            json.dump({"db_path": db_copy, "pool_size": 0}, file)
+        with patch('db.get_config', lambda path='config.json': db.load_config(config_path)), \
+                patch.dict('db.DEFAULT_PRAGMAS', clear=True):
+            before = run(args.threads, args.seconds)
+
+        # After: cached config and pooled connections
+        with patch('db.get_config', return_value={"db_path": db_copy, "pool_size": args.threads}):
+            after = run(args.threads, args.seconds)
+            db.pool.close_all()
+        api_config.stop()
+
+        print(json.dumps({
+            "threads": args.threads,
+            "seconds": args.seconds,
+            "before_requests_per_sec": round(before, 1),
+            "after_requests_per_sec": round(after, 1),
+            "speedup": round(after / before, 2) if before else None,
+        }, indent=2))
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
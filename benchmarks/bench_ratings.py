@@ -0,0 +1,123 @@
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from unittest.mock import patch
+
+'''
+Benchmark for rating writes.
+It copies the playlist database to a temporary directory and posts ratings from several threads through the Flask
+test client, once with a commit per request, once through the background writer that groups commits, and once
+as POST /songs/rate batches, then prints ratings/sec and the number of "database is locked" failures for each.
+Run it from the repository root: python benchmarks/bench_ratings.py --threads 16 --seconds 5
+'''
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db
+import api
+from api import app
+
+
+# Post single ratings from one thread until the deadline, counting successes and failures
+def single_worker(deadline, counts, index, song_ids):
+    client = app.test_client()
+    done = failed = 0
+    while time.perf_counter() < deadline:
+        song_id = song_ids[(index * 7919 + done + failed) % len(song_ids)]
+        try:
+            response = client.post(f'/songs/{song_id}/rate', json={"rating": 3.0})
+            ok = response.status_code == 200
+        except Exception:
+            ok = False
+        done += ok
+        failed += not ok
+    counts[index] = (done, failed)
+
+
+# Post batches of ratings from one thread until the deadline
+def bulk_worker(deadline, counts, index, song_ids, batch):
+    client = app.test_client()
+    done = failed = 0
+    while time.perf_counter() < deadline:
+        start = (index * 7919 + done + failed) % len(song_ids)
+        items = [{"id": song_ids[(start + i) % len(song_ids)], "rating": 3.0} for i in range(batch)]
+        try:
+            response = client.post('/songs/rate', json=items)
+            ok = response.status_code == 200
+        except Exception:
+            ok = False
+        done += batch if ok else 0
+        failed += 0 if ok else batch
+    counts[index] = (done, failed)
+
+
+# Run the workers for the given number of seconds and return (ratings/sec, failed requests)
+def run(target, threads, seconds, *args):
+    counts = [(0, 0)] * threads
+    deadline = time.perf_counter() + seconds
+    pool = [threading.Thread(target=target, args=(deadline, counts, i, *args)) for i in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    return sum(done for done, _ in counts) / seconds, sum(failed for _, failed in counts)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare rating writes per request, grouped, and in bulk")
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--batch", type=int, default=100, help="ratings per POST /songs/rate request")
+    parser.add_argument("--db", default="data/playlist.db", help="database to copy for the benchmark")
+    args = parser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        db_copy = os.path.join(tmp_dir, "playlist.db")
+        shutil.copy(args.db, db_copy)
+        # Silence per-call logging so it doesn't dominate the timings
+        db.logger.disabled = True
+        api.logger.disabled = True
+        app.logger.disabled = True
+
+        config = {"db_path": db_copy, "pool_size": args.threads, "max_bulk_ratings": args.batch}
+        with patch('db.get_config', return_value=config):
+            with db.connection() as conn:
+                song_ids = [row[0] for row in conn.execute("SELECT id FROM songs")]
+
+            with patch('api.get_config', return_value=config):
+                single, single_failed = run(single_worker, args.threads, args.seconds, song_ids)
+
+            writer_config = dict(config, rating_writer={"enabled": True})
+            with patch('api.get_config', return_value=writer_config):
+                grouped, grouped_failed = run(single_worker, args.threads, args.seconds, song_ids)
+                writer = api.get_rating_writer()
+                writer.close()
+                batches = writer.batches
+
+            with patch('api.get_config', return_value=config):
+                bulk, bulk_failed = run(bulk_worker, args.threads, args.seconds, song_ids, args.batch)
+            db.pool.close_all()
+
+        print(json.dumps({
+            "threads": args.threads,
+            "seconds": args.seconds,
+            "per_request_ratings_per_sec": round(single, 1),
+            "per_request_failures": single_failed,
+            "writer_ratings_per_sec": round(grouped, 1),
+            "writer_failures": grouped_failed,
+            "writer_commits": batches,
+            "bulk_ratings_per_sec": round(bulk, 1),
+            "bulk_failures": bulk_failed,
+        }, indent=2))
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+import argparse
+import logging
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from unittest.mock import patch
+
+'''
+Benchmark for the hash-sharded catalog layout (see shards.py).
+It ingests a synthetic catalog (benchmarks/generate.py) once into a single database file and once into each requested
+number of shards, then times the ingestion, listing pages (shallow, deep and sorted), a broad title search, and rating
+writes from several threads at once. The response cache and the columnar snapshot are left out, so every timing
+includes the database reads. Fan-out only pays off with spare cores: on a single core the shards are queried one
+after the other and the merge is pure overhead.
+Run it from the repository root: python benchmarks/bench_shards.py --rows 200000 --shards 2 4 8
+'''
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import api
+import db
+import dataParsing
+from generate import generate
+
+
+# Median milliseconds of 'repeat' calls
+def time_ms(function, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+# Ratings written per second by 'threads' threads, each rating its own songs one commit at a time
+def rating_rate(song_ids, threads, seconds):
+    deadline = time.perf_counter() + seconds
+    counts = [0] * threads
+
+    def worker(index):
+        done = 0
+        while time.perf_counter() < deadline:
+            db.update_rating(song_ids[(index * 7919 + done) % len(song_ids)], 3.0)
+            done += 1
+        counts[index] = done
+
+    workers = [threading.Thread(target=worker, args=(index,)) for index in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return sum(counts) / seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare a single catalog database with sharded ones")
+    parser.add_argument("--rows", type=int, default=200000)
+    parser.add_argument("--shards", type=int, nargs="+", default=[2, 4])
+    parser.add_argument("--limit", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--threads", type=int, default=8, help="threads writing ratings")
+    parser.add_argument("--seconds", type=float, default=3.0, help="duration of the rating run")
+    args = parser.parse_args()
+    logging.disable(logging.CRITICAL)
+
+    work_dir = tempfile.mkdtemp()
+    try:
+        source = os.path.join(work_dir, "songs.ndjson")
+        generate(source, args.rows)
+        limit = args.limit
+        cases = [
+            ("first page", lambda: api.songs_page(1, limit, None)),
+            ("deep page", lambda: api.songs_page(args.rows // limit // 2, limit, None)),
+            ("sorted, filtered page", lambda: api.songs_page(1, limit, None, (("energy", "gte", 0.5),), (("tempo", True),))),
+            ("title search 'Love'", lambda: api.search_songs("Love", "search")),
+        ]
+        results = {}
+        for count in [0] + args.shards:
+            name = "single file" if count == 0 else f"{count} shards"
+            config = {"db_path": os.path.join(work_dir, f"playlist-{count}.db"), "snapshot": {"enabled": False},
+                      "shards": {"count": count}, "pool_size": 16}
+            with patch('dataParsing.get_config', return_value=config), patch('db.get_config', return_value=config), \
+                    patch('api.get_config', return_value=config):
+                start = time.perf_counter()
+                dataParsing.ingest_stream(source, config["db_path"])
+                timings = [(time.perf_counter() - start) * 1000]
+                for _, build in cases:
+                    timings.append(time_ms(build, args.repeat))
+                song_ids = [row["id"] for row in db.fetch_songs(10000)[0]]
+                timings.append(rating_rate(song_ids, args.threads, args.seconds))
+            db.pool.close_all()
+            db.invalidate_count_cache()
+            results[name] = timings
+
+        names = list(results)
+        print(f"{'':<24}" + "".join(f"{name:>14}" for name in names))
+        for row, label in enumerate(["ingestion (ms)"] + [f"{case} (ms)" for case, _ in cases] + ["ratings/sec"]):
+            print(f"{label:<24}" + "".join(f"{results[name][row]:>14.1f}" for name in names))
+        print(f"({os.cpu_count()} CPU(s); page timings are medians of {args.repeat} calls)")
+    finally:
+        db.pool.close_all()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
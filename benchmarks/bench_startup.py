@@ -0,0 +1,125 @@
+import argparse
+import http.client
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+'''
+Startup benchmark for the commands of main.py.
+Each command is run in a fresh interpreter with "python -X importtime", in a temporary directory with its own
+config.json and a synthetic catalog (benchmarks/generate.py). For every command it reports the time spent importing
+modules, whether pandas was loaded, and how long the command took: until it exited for ingest, export and
+rebuild-ratings, and until the first GET /songs answered for the servers. A bare "python -c pass" is timed as well,
+as the floor that no command can go below.
+Run it from the repository root: python benchmarks/bench_startup.py --rows 20000 --repeat 3
+'''
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MAIN = os.path.join(ROOT, "main.py")
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from generate import generate
+from load_test import free_port
+
+
+# The commands timed, as (name, arguments, whether it is a server)
+def commands(port):
+    return [
+        ("ingest", ["ingest"], False),
+        ("export", ["export", "--output", "export.ndjson"], False),
+        ("rebuild-ratings", ["rebuild-ratings"], False),
+        ("serve", ["serve", "--port", str(port)], True),
+        ("serve --asgi", ["serve", "--asgi", "--port", str(port)], True),
+    ]
+
+
+# Seconds spent importing, from the -X importtime report: the sum over the top-level imports
+# Also returns whether pandas was imported
+def import_report(stderr):
+    seconds = 0.0
+    pandas = False
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        # Nested imports are indented under the module that imported them
+        if not name[1:].startswith(" "):
+            seconds += int(cumulative) / 1e6
+        pandas = pandas or name.strip() == "pandas"
+    return seconds, pandas
+
+
+# Poll the server until GET /songs answers with a 200
+def first_response(port, process, timeout=60):
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline and process.poll() is None:
+        try:
+            connection = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+            connection.request("GET", "/songs?limit=1")
+            status = connection.getresponse().status
+            connection.close()
+            if status == 200:
+                return
+        except OSError:
+            time.sleep(0.005)
+    raise RuntimeError(f"Server did not answer on port {port}")
+
+
+# Run one command, returning its wall time (to the first response for servers), import time and pandas flag
+def run_command(arguments, server, port, work_dir):
+    start = time.perf_counter()
+    command = [sys.executable, "-X", "importtime", MAIN] + arguments
+    if not server:
+        result = subprocess.run(command, cwd=work_dir, capture_output=True, text=True)
+        seconds = time.perf_counter() - start
+        if result.returncode:
+            raise RuntimeError(f"{' '.join(arguments)} failed:\n{result.stderr[-2000:]}")
+        return (seconds,) + import_report(result.stderr)
+    process = subprocess.Popen(command, cwd=work_dir, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    try:
+        first_response(port, process)
+        seconds = time.perf_counter() - start
+    finally:
+        process.terminate()
+        _, stderr = process.communicate(timeout=30)
+    return (seconds,) + import_report(stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time the startup of every main.py command")
+    parser.add_argument("--rows", type=int, default=20000, help="songs in the synthetic catalog")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp()
+    try:
+        generate(os.path.join(work_dir, "playlist.json"), args.rows)
+        with open(os.path.join(ROOT, "config.json")) as file:
+            config = json.load(file)
+        config.update(input_path="playlist.json", db_path="playlist.db", output_path="playlist.csv")
+        with open(os.path.join(work_dir, "config.json"), "w") as file:
+            json.dump(config, file)
+
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", "pass"], check=True)
+        baseline = time.perf_counter() - start
+        print(f"{'command':<18}{'total ms':>10}{'imports ms':>12}  {'pandas':<8}measured until")
+        print(f"{'python -c pass':<18}{baseline * 1000:>10.0f}")
+        port = free_port()
+        for name, arguments, server in commands(port):
+            runs = [run_command(arguments, server, port, work_dir) for _ in range(args.repeat)]
+            seconds = statistics.median(run[0] for run in runs)
+            imports = statistics.median(run[1] for run in runs)
+            print(f"{name:<18}{seconds * 1000:>10.0f}{imports * 1000:>12.0f}  {'yes' if runs[0][2] else 'no':<8}"
+                  f"{'first response' if server else 'exit'}")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
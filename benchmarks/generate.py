@@ -0,0 +1,144 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+'''
+Synthetic catalog generator for the benchmarks.
+It writes songs in the same columnar JSON layout as input/playlist.json ({"id": {"0": ...}, "title": {"0": ...}, ...}),
+or as NDJSON with one song per line, at any size. A configurable fraction of the rows is made invalid (a missing id
+or title, text in a number column, a fraction in a whole-number column), so validation has something to reject.
+The values are drawn from a seeded random generator in fixed-size blocks, so the same seed and size always give
+the same songs whatever the output format, and a column can be written without holding the whole catalog in memory.
+Run it from the repository root: python benchmarks/generate.py --rows 1000000 --invalid-fraction 0.01 --output input/synthetic.json
+'''
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from schema import SONG_FIELDS
+
+# Rows generated per block
+BLOCK = 100000
+
+# Input columns - every Song field except the rating, which the input files don't have
+COLUMNS = [column for column in SONG_FIELDS if column != "rating"]
+
+# Words that titles are made of, so title searches have something to find
+WORDS = ["Love", "Night", "Summer", "Heart", "Dance", "Fire", "Dream", "City", "Rain", "Gold", "Moon", "Road",
+         "Wild", "Blue", "Light", "Home", "Time", "Girl", "Baby", "Star", "Ocean", "Café", "Niño", "Echo"]
+
+_BASE62 = np.frombuffer(b"0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ", dtype=np.uint8)
+
+# Value ranges of the numeric columns - (low, high, decimals) for floats, (low, high) for whole numbers
+FLOAT_RANGES = {"loudness": (-60.0, 0.0, 3), "tempo": (60.0, 200.0, 3)}
+INT_RANGES = {"key": (0, 12), "mode": (0, 2), "duration_ms": (60000, 600000), "time_signature": (3, 6),
+              "num_bars": (20, 300), "num_sections": (3, 20), "num_segments": (200, 2000), "class": (0, 2)}
+
+
+# The values of one column for rows start to end, as Python values
+def column_block(column, start, end, seed):
+    rng = np.random.default_rng([seed, COLUMNS.index(column), start // BLOCK])
+    rows = end - start
+    if column == "id":
+        # 22 random base62 characters, like a Spotify track id
+        return _BASE62[rng.integers(0, 62, (rows, 22))].view("S22").ravel().astype(str).tolist()
+    if column == "title":
+        lengths = rng.integers(1, 4, rows)
+        words = rng.integers(0, len(WORDS), (rows, 3))
+        return [" ".join(WORDS[word] for word in row[:length]) + f" {start + offset}"
+                for offset, (row, length) in enumerate(zip(words.tolist(), lengths.tolist()))]
+    if column in INT_RANGES:
+        low, high = INT_RANGES[column]
+        return rng.integers(low, high, rows).tolist()
+    low, high, decimals = FLOAT_RANGES.get(column, (0.0, 1.0, 4))
+    return np.round(rng.uniform(low, high, rows), decimals).tolist()
+
+
+# The invalid rows of a catalog, as {column: {row: bad value}}
+# About rows * fraction rows get one bad value each, in a column picked at random
+def invalid_rows(rows, fraction, seed):
+    rng = np.random.default_rng([seed, len(COLUMNS)])
+    count = int(round(rows * fraction))
+    positions = rng.choice(rows, size=count, replace=False) if count else []
+    corrupted = {column: {} for column in COLUMNS}
+    for position, column_index in zip(np.sort(positions).tolist(), rng.integers(0, len(COLUMNS), count).tolist()):
+        column = COLUMNS[column_index]
+        kind = SONG_FIELDS[column][1]
+        if kind is str:
+            bad = None
+        elif kind is int:
+            bad = 2.5
+        else:
+            bad = "n/a"
+        corrupted[column][position] = bad
+    return corrupted
+
+
+# The JSON text of a block of column values
+# Ids are plain base62 and numbers are written with repr, which gives the same text as json.dumps for them;
+# only titles need escaping
+def encode_values(column, values):
+    if column == "id":
+        return [f'"{value}"' for value in values]
+    return list(map(json.dumps if column == "title" else repr, values))
+
+
+# Write one column object ("column": {"0": value, ...}) block by block
+def write_column(file, column, rows, seed, corrupted):
+    file.write(json.dumps(column) + ":{")
+    for start in range(0, rows, BLOCK):
+        end = min(start + BLOCK, rows)
+        values = encode_values(column, column_block(column, start, end, seed))
+        for position, bad in corrupted.items():
+            if start <= position < end:
+                values[position - start] = json.dumps(bad)
+        if start:
+            file.write(",")
+        file.write(",".join(f'"{row}":{value}' for row, value in zip(range(start, end), values)))
+    file.write("}")
+
+
+# Write a synthetic catalog of 'rows' songs to 'path', returning the number of invalid rows in it
+# Files ending in .ndjson or .jsonl get one JSON object per line; anything else gets the columnar layout
+def generate(path, rows, invalid_fraction=0.0, seed=0):
+    corrupted = invalid_rows(rows, invalid_fraction, seed)
+    temporary = f"{path}.tmp"
+    with open(temporary, "w", encoding="utf-8") as file:
+        if path.endswith((".ndjson", ".jsonl")):
+            for start in range(0, rows, BLOCK):
+                end = min(start + BLOCK, rows)
+                block = {column: column_block(column, start, end, seed) for column in COLUMNS}
+                for column in COLUMNS:
+                    for position, bad in corrupted[column].items():
+                        if start <= position < end:
+                            block[column][position - start] = bad
+                file.writelines(json.dumps(dict(zip(COLUMNS, values))) + "\n" for values in zip(*block.values()))
+        else:
+            file.write("{")
+            for index, column in enumerate(COLUMNS):
+                if index:
+                    file.write(",")
+                write_column(file, column, rows, seed, corrupted[column])
+            file.write("}")
+    os.replace(temporary, path)
+    return sum(len(rows) for rows in corrupted.values())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write a synthetic playlist file for benchmarking")
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--invalid-fraction", type=float, default=0.0, help="fraction of rows with a bad value")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="input/synthetic.json", help=".ndjson/.jsonl for one song per line")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    invalid = generate(args.output, args.rows, args.invalid_fraction, args.seed)
+    print(f"Wrote {args.rows} songs ({invalid} invalid) to {args.output} in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
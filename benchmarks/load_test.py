@@ -0,0 +1,146 @@
+import argparse
+import http.client
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+'''
+Load test for the API serving modes started by "python main.py serve".
+For each mode it starts the server on a copy of the playlist database, sends a mix of list, search and rating
+requests from several client threads for a fixed time, and prints the p50/p99 latency and throughput.
+Run it from the repository root: python benchmarks/load_test.py --clients 16 --seconds 10
+'''
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODES = {
+    "wsgi": ["serve"],
+    "asgi": ["serve", "--asgi"],
+}
+
+# The request mix sent by every client - (method, path, JSON body)
+REQUESTS = [
+    ("GET", "/songs?page=2&limit=10", None),
+    ("GET", "/songs?page=7&limit=50", None),
+    ("GET", "/songs/Love", None),
+    ("GET", "/songs/3AM?match=exact", None),
+    ("POST", "/songs/5vYA1mW9g2Coh1HUFUSmlb/rate", {"rating": 4.0}),
+]
+
+
+# Pick a free local port for the server
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+# Wait until the server accepts connections
+def wait_for(port, timeout=30):
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"Server did not start on port {port}")
+
+
+# Send requests over one keep-alive connection until the deadline, recording each latency
+def client(port, deadline, latencies, errors, requests=REQUESTS):
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    index = 0
+    while time.perf_counter() < deadline:
+        method, path, body = requests[index % len(requests)]
+        index += 1
+        headers = {"Content-Type": "application/json"} if body is not None else {}
+        start = time.perf_counter()
+        try:
+            connection.request(method, path, body=json.dumps(body) if body is not None else None, headers=headers)
+            response = connection.getresponse()
+            response.read()
+            if response.status >= 500:
+                errors.append(response.status)
+        except (OSError, http.client.HTTPException):
+            errors.append(None)
+            connection.close()
+            connection = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+            continue
+        latencies.append(time.perf_counter() - start)
+    connection.close()
+
+
+# Value at the given percentile of a sorted list
+def percentile(values, fraction):
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+# Start one serving mode, drive it with the clients and return its results
+# 'requests' is the request mix, REQUESTS by default
+def run_mode(mode, tmp_dir, clients, seconds, threads, workers, requests=REQUESTS):
+    port = free_port()
+    command = [sys.executable, os.path.join(ROOT, "main.py")] + MODES[mode] + ["--port", str(port)]
+    command += ["--workers", str(workers)] if mode == "asgi" else ["--threads", str(threads)]
+    server = subprocess.Popen(command, cwd=tmp_dir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_for(port)
+        latencies = [[] for _ in range(clients)]
+        errors = []
+        deadline = time.perf_counter() + seconds
+        pool = [threading.Thread(target=client, args=(port, deadline, latencies[i], errors, requests)) for i in range(clients)]
+        for thread in pool:
+            thread.start()
+        for thread in pool:
+            thread.join()
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+    merged = sorted(latency for client_latencies in latencies for latency in client_latencies)
+    return {
+        "mode": mode,
+        "requests": len(merged),
+        "errors": len(errors),
+        "requests_per_sec": round(len(merged) / seconds, 1),
+        "p50_ms": round(percentile(merged, 0.50) * 1000, 2) if merged else None,
+        "p99_ms": round(percentile(merged, 0.99) * 1000, 2) if merged else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Latency and throughput of each API serving mode")
+    parser.add_argument("--modes", nargs="+", default=list(MODES), choices=list(MODES))
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--seconds", type=float, default=10.0)
+    parser.add_argument("--threads", type=int, default=8, help="request threads of the WSGI server")
+    parser.add_argument("--workers", type=int, default=1, help="worker processes of the ASGI server")
+    parser.add_argument("--db", default="data/playlist.db", help="database to copy for the load test")
+    args = parser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        db_copy = os.path.join(tmp_dir, "playlist.db")
+        shutil.copy(args.db, db_copy)
+        with open(os.path.join(ROOT, "config.json")) as file:
+            config = json.load(file)
+        config["db_path"] = db_copy
+        with open(os.path.join(tmp_dir, "config.json"), "w") as file:
+            json.dump(config, file)
+
+        results = [run_mode(mode, tmp_dir, args.clients, args.seconds, args.threads, args.workers)
+                   for mode in args.modes]
+        print(json.dumps({"clients": args.clients, "seconds": args.seconds, "results": results}, indent=2))
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,244 @@
+import argparse
+import json
+import logging
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+'''
+Benchmark suite for ingestion and the API, on synthetic catalogs from generate.py.
+For every size it times the ingestion stages on their own - load_data, validate_songs (the row-by-row Pydantic path),
+validate_frame, save_to_db and the streaming ingest_stream - and then drives the API served by "python main.py serve"
+from concurrent clients with a mix of listing, search, similar-songs and rating requests.
+The results are written as JSON together with the git commit they were measured on, so two runs can be compared:
+python benchmarks/suite.py run --sizes 10000 1000000 --invalid-fraction 0.01
+python benchmarks/suite.py compare benchmarks/results/<before>.json benchmarks/results/<after>.json
+Logging is switched off while the suite runs, so the timings don't include writing log lines.
+'''
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import dataParsing
+from generate import generate, column_block
+from load_test import run_mode
+
+# Metrics where a smaller value is better; for every other metric (rates) a larger value is better
+LOWER_IS_BETTER = ("seconds", "_ms", "peak_rss_mb")
+
+
+# Run one stage, returning its result and its timing entry
+def stage(function, rows, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    seconds = time.perf_counter() - start
+    return result, {"seconds": round(seconds, 3), "rows": rows, "rows_per_sec": round(rows / seconds) if seconds else None}
+
+
+# Peak memory of this process so far, in MB (None where the resource module isn't available)
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+# The API request mix for a synthetic catalog, using songs that exist in it
+def api_requests(seed):
+    song_ids = column_block("id", 0, 10, seed)
+    titles = column_block("title", 0, 10, seed)
+    return [
+        ("GET", "/songs?page=2&limit=10", None),
+        ("GET", "/songs?limit=50&energy_gte=0.9&sort=-energy", None),
+        ("GET", "/songs/Love", None),
+        ("GET", f"/songs/{titles[3]}?match=exact".replace(" ", "%20"), None),
+        ("GET", f"/songs/{song_ids[1]}/similar?k=10", None),
+        ("POST", f"/songs/{song_ids[2]}/rate", {"rating": 4.0}),
+    ]
+
+
+# Measure every stage for one catalog size
+def run_size(work_dir, rows, args):
+    results = {}
+    source = os.path.join(work_dir, f"synthetic_{rows}_{args.seed}_{args.invalid_fraction}.json")
+    if not os.path.exists(source):
+        invalid, results["generate"] = stage(generate, rows, source, rows, args.invalid_fraction, args.seed)
+        results["generate"]["invalid_rows"] = invalid
+    results["input_mb"] = round(os.path.getsize(source) / (1024 * 1024), 1)
+
+    # The in-memory path holds the whole catalog as a DataFrame, so it is only run up to --max-memory-rows
+    memory_db = os.path.join(work_dir, f"memory_{rows}.db")
+    if rows <= args.max_memory_rows:
+        df, results["load_data"] = stage(dataParsing.load_data, rows, source)
+        df.columns = df.columns.str.strip().str.lower()
+        if rows <= args.max_row_by_row:
+            _, results["validate_songs"] = stage(dataParsing.validate_songs, rows, df)
+        else:
+            results["validate_songs"] = {"skipped": f"more than {args.max_row_by_row} rows"}
+        (valid, rejected), results["validate_frame"] = stage(dataParsing.validate_frame, rows, df)
+        results["validate_frame"]["rejected"] = len(rejected)
+        valid["rating"] = None
+        del df
+        _, results["save_to_db"] = stage(dataParsing.save_to_db, len(valid), valid, memory_db)
+        del valid
+    else:
+        for name in ("load_data", "validate_songs", "validate_frame", "save_to_db"):
+            results[name] = {"skipped": f"more than {args.max_memory_rows} rows"}
+
+    # The streaming path reads, validates and writes the catalog in bounded chunks
+    stream_db = os.path.join(work_dir, f"stream_{rows}.db")
+    _, results["ingest_stream"] = stage(dataParsing.ingest_stream, rows, source, stream_db, args.chunk_size, args.workers)
+    results["peak_rss_mb"] = peak_rss_mb()
+
+    # The API, served from the streamed database by its own process
+    if args.load_seconds > 0:
+        with open(os.path.join(ROOT, "config.json")) as file:
+            config = json.load(file)
+        config["db_path"] = stream_db
+        # The load test measures how much the API can serve, so admission control doesn't turn its clients away
+        config["admission"] = {"enabled": False}
+        with open(os.path.join(work_dir, "config.json"), "w") as file:
+            json.dump(config, file)
+        results["api"] = {
+            mode: run_mode(mode, work_dir, args.clients, args.load_seconds, args.threads, args.server_workers,
+                           api_requests(args.seed))
+            for mode in args.modes
+        }
+    for path in (memory_db, stream_db):
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+        for suffix in (".similar", ".snapshot"):
+            shutil.rmtree(path + suffix, ignore_errors=True)
+    return results
+
+
+# The commit the suite runs on, and whether the working tree has uncommitted changes
+def git_state():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True,
+                                check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=ROOT,
+                                    capture_output=True, text=True).stdout.strip())
+        return commit, dirty
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+
+
+def run(args):
+    commit, dirty = git_state()
+    meta = {
+        "commit": commit,
+        "dirty": dirty,
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "invalid_fraction": args.invalid_fraction,
+        "seed": args.seed,
+    }
+    logging.disable(logging.CRITICAL)
+    work_dir = args.work_dir or tempfile.mkdtemp()
+    os.makedirs(work_dir, exist_ok=True)
+    try:
+        results = {}
+        for rows in args.sizes:
+            print(f"Running {rows} rows...", file=sys.stderr)
+            results[str(rows)] = run_size(work_dir, rows, args)
+    finally:
+        if not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    output = args.output or os.path.join(ROOT, "benchmarks", "results",
+                                         f"{commit or 'unknown'}{'-dirty' if dirty else ''}-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as file:
+        json.dump({"meta": meta, "results": results}, file, indent=2)
+    print(json.dumps(results, indent=2))
+    print(f"Results written to {output}", file=sys.stderr)
+
+
+# Flatten nested results into {"10000.load_data.seconds": value}, keeping only numbers
+def flatten(results, prefix=""):
+    flat = {}
+    for key, value in results.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{name}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+
+# Compare the metrics two runs have in common
+# Returns (metric, before, after, relative change, is a regression) rows; a change counts as a regression when the
+# metric got worse by more than 'threshold' (0.1 is 10%). Counts like rows and rejected rows are left out
+def compare(before, after, threshold=0.1):
+    old, new = flatten(before["results"]), flatten(after["results"])
+    rows = []
+    for metric in sorted(old.keys() & new.keys()):
+        if not metric.endswith(LOWER_IS_BETTER + ("_per_sec",)):
+            continue
+        if not old[metric]:
+            continue
+        change = (new[metric] - old[metric]) / old[metric]
+        worse = change > threshold if metric.endswith(LOWER_IS_BETTER) else change < -threshold
+        rows.append((metric, old[metric], new[metric], change, worse))
+    return rows
+
+
+def compare_command(args):
+    with open(args.before) as file:
+        before = json.load(file)
+    with open(args.after) as file:
+        after = json.load(file)
+    rows = compare(before, after, args.threshold)
+    print(f"{before['meta'].get('commit')} -> {after['meta'].get('commit')}")
+    width = max((len(metric) for metric, *_ in rows), default=10)
+    for metric, old, new, change, worse in rows:
+        print(f"{metric:<{width}}  {old:>12}  {new:>12}  {change:+8.1%}{'  REGRESSION' if worse else ''}")
+    regressions = sum(worse for *_, worse in rows)
+    print(f"{regressions} regression(s) over {args.threshold:.0%}")
+    # A non-zero exit status lets a CI job fail on a regression
+    sys.exit(1 if regressions else 0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingestion and API benchmarks on synthetic catalogs")
+    commands = parser.add_subparsers(dest="command", required=True)
+    run_parser = commands.add_parser("run", help="Run the benchmarks and write the results as JSON")
+    run_parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 1000000])
+    run_parser.add_argument("--invalid-fraction", type=float, default=0.01)
+    run_parser.add_argument("--seed", type=int, default=0)
+    run_parser.add_argument("--output", help="results file (default: benchmarks/results/<commit>-<time>.json)")
+    run_parser.add_argument("--work-dir", help="keep the generated catalogs here and reuse them between runs")
+    run_parser.add_argument("--max-memory-rows", type=int, default=1000000,
+                            help="largest catalog to load into one DataFrame for the in-memory stages")
+    run_parser.add_argument("--max-row-by-row", type=int, default=100000,
+                            help="largest catalog to validate with the row-by-row validate_songs")
+    run_parser.add_argument("--chunk-size", type=int, default=10000, help="rows per chunk of ingest_stream")
+    run_parser.add_argument("--workers", type=int, default=1, help="validation processes of ingest_stream")
+    run_parser.add_argument("--load-seconds", type=float, default=10.0, help="seconds of API load per mode, 0 to skip")
+    run_parser.add_argument("--clients", type=int, default=16)
+    run_parser.add_argument("--modes", nargs="+", default=["wsgi", "asgi"], choices=["wsgi", "asgi"])
+    run_parser.add_argument("--threads", type=int, default=8, help="request threads of the WSGI server")
+    run_parser.add_argument("--server-workers", type=int, default=1, help="worker processes of the ASGI server")
+    compare_parser = commands.add_parser("compare", help="Compare two results files")
+    compare_parser.add_argument("before")
+    compare_parser.add_argument("after")
+    compare_parser.add_argument("--threshold", type=float, default=0.1, help="relative change counted as a regression")
+    args = parser.parse_args()
+    if args.command == "run":
+        run(args)
+    else:
+        compare_command(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+import threading
+import time
+from collections import OrderedDict
+
+'''
+In-process cache for API responses.
+Entries are kept in least-recently-used order and the cache is bounded both by the number of entries and by the
+total size of the cached bodies, with a TTL on top. Cache keys include the data version from db.py, so a rating
+update or a re-ingest makes every older entry unreachable straight away; those entries then age out of the LRU.
+'''
+
+'''
+The comments are in greater detail to explain each step of the code
+'''
+
+
+# A cached response: the status code, the encoded body, its ETag, and the content encoding (gzip or deflate) the body
+# is compressed with, if any
+class CachedResponse:
+    __slots__ = ("status", "body", "etag", "expires", "encoding")
+
+    def __init__(self, status, body, etag, expires, encoding=None):
+        self.status = status
+        self.body = body
+        self.etag = etag
+        self.expires = expires
+        self.encoding = encoding
+
+
+class ResponseCache:
+    def __init__(self, max_entries=1024, max_bytes=16 * 1024 * 1024, ttl=60):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    # Return the cached response for the key, or None if there is no fresh entry
+    # count=False leaves the hit and miss counters alone, for a second lookup made on behalf of the same request
+    def get(self, key, count=True):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires <= now:
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += count
+                return None
+            self._entries.move_to_end(key)
+            self.hits += count
+            return entry
+
+    # Store a response, evicting the least recently used entries until the cache is back within its bounds
+    # Bodies bigger than the whole byte budget are not cached at all
+    def put(self, key, status, body, etag, encoding=None):
+        if len(body) > self.max_bytes or self.max_entries <= 0:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = CachedResponse(status, body, etag, time.monotonic() + self.ttl, encoding)
+            self._bytes += len(body)
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self._bytes -= len(entry.body)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    # Counters for monitoring the cache
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+            }
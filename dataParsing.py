@@ -1,10 +1,24 @@
 import json
+import numpy as np
 import pandas as pd
-from pydantic import BaseModel, Field, ValidationError
-from typing import Optional
+from pydantic import ValidationError
 import logging
 import sqlite3
 import os
+import time
+import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from db import (build_indexes, bump_data_version, create_ratings_tables, restore_song_ratings, refresh_rating_summary,
+                get_config, load_config, DEFAULT_PRAGMAS)
+from schema import Song, SONG_COLUMNS, SONG_FIELDS
+from similarity import ensure_index, similarity_settings
+from snapshot import ensure_snapshot, snapshot_enabled
+from stats import ensure_stats, stats_settings
+from shadow import ShadowBuild, live_path, record_progress, source_identity
+from encoding import build_fragments
+from shards import shard_count, shard_paths, shard_of, shard_root, fan_out
+from streaming import iter_rows, iter_chunks, is_ndjson, ndjson_ranges, iter_ndjson_range
 
 '''
 Data ingestion and validation pipeline for music playlist data.
@@ -18,50 +32,18 @@ It uses Pydantic for data validation, Pandas for data manipulation, and logging
 The comments are in greater detail to explain each step of the code
 '''
 
-# Set up logging
-os.makedirs('logs', exist_ok=True)
-# Logging is configured to log messages to both a file and the console
-logging.basicConfig(level=logging.INFO,
-                    format='%(asctime)s - %(levelname)s - %(message)s',
-                    handlers=[logging.FileHandler('logs/dataParsing.log'),
-                              logging.StreamHandler()])
-
-# Define the Song model using Pydantic
-# This model will be used to validate the data structure of each song entry
-class Song(BaseModel):
-    id: str
-    title: str
-    danceability: float
-    energy: float
-    key: int
-    loudness: float
-    mode: int
-    acousticness: float
-    instrumentalness: float
-    liveness: float
-    valence: float
-    tempo: float
-    duration_ms: int
-    time_signature: int
-    num_bars: int
-    num_sections: int
-    num_segments: int
-    class_: int = Field(alias='class')
-    rating: Optional[float] = None
-
-    model_config = {
-        "populate_by_name": True
-    }
-
+# Named logger
+# Once configure_logging() has run, records are written to logs/dataParsing.log and the console (see logsetup.py)
+logger = logging.getLogger("dataParsing_logger")
 
 # Function to load data from a JSON file into a Pandas DataFrame
 # It reads the JSON file, converts it to a DataFrame, and logs the number of records loaded
 # If the file does not exist or is empty, it will log an error
 def load_data(file_path):
-    logging.info(f"Loading data from {file_path}")
+    logger.info(f"Loading data from {file_path}")
     with open(file_path, 'r') as file:
         data = json.load(file)
-    logging.info(f"Loaded {len(data)} records")
+    logger.info(f"Loaded {len(data)} records")
     return pd.DataFrame.from_dict(data)
 
 # Function to validate each song in the DataFrame against the Song model
@@ -69,7 +51,7 @@ def load_data(file_path):
 # Valid songs are collected in a list and returned as a list of Song instances
 def validate_songs(df):
     #start_time=time.perf_counter()
-    logging.info("Validating data from JSON")
+    logger.info("Validating data from JSON")
     valid_rows=[] #dict to store valid rows
     # Iterate through each row in the DataFrame
     # Not using iterrows() for better performance (theoretically), instead using a range loop 
@@ -79,55 +61,556 @@ def validate_songs(df):
             song = Song(**df.iloc[index].to_dict())  # Convert row to dict, unpack and validate against Song model
             valid_rows.append(song)  # Add to valid rows if validated
         except ValidationError as e:
-            logging.error(f"Validation error in Row {index}: {e}")
+            logger.error(f"Validation error in Row {df.index[index]}: {e}")
     # Log the number of valid rows found
-    logging.info(f"{len(valid_rows)} valid rows out of {len(df)}")
+    logger.info(f"{len(valid_rows)} valid rows out of {len(df)}")
     #end_time=time.perf_counter()
-    #logging.info(f"Validation completed in {end_time-start_time:.8f} seconds")
+    #logger.info(f"Validation completed in {end_time-start_time:.8f} seconds")
     return valid_rows
 
 
+# Function to work out which values of a column are certainly accepted by the Song model, using whole-column operations
+# It is deliberately conservative: anything it isn't sure about is left for Pydantic to decide row by row
+def _column_mask(values, kind, optional):
+    dtype = values.dtype
+    nulls = values.isna()
+    is_number = pd.api.types.is_numeric_dtype(dtype) and not pd.api.types.is_bool_dtype(dtype)
+    if kind is str:
+        if pd.api.types.is_object_dtype(dtype):
+            # Object columns may hold anything, so only trust them when every non-empty value is a string
+            if pd.api.types.infer_dtype(values, skipna=True) == 'string':
+                return ~nulls
+            return values.map(lambda value: type(value) is str)
+        if pd.api.types.is_string_dtype(dtype):
+            return ~nulls
+    elif kind is float:
+        # Pydantic accepts any int or float for a float field, including NaN
+        if is_number:
+            return pd.Series(True, index=values.index)
+        if pd.api.types.is_object_dtype(dtype):
+            # A number column holding a few other values: only those values are left for Pydantic
+            accepted = _numeric_values(values).notna()
+            return accepted | nulls if optional else accepted
+        if optional:
+            return nulls
+    elif kind is int:
+        if pd.api.types.is_integer_dtype(dtype) and not pd.api.types.is_bool_dtype(dtype):
+            return ~nulls
+        if is_number or pd.api.types.is_object_dtype(dtype):
+            # Floats are accepted for int fields when they are whole numbers, like 5.0
+            numbers = (values if is_number else _numeric_values(values)).to_numpy(dtype='float64', na_value=np.nan)
+            whole = np.isfinite(numbers) & (np.floor(numbers) == numbers) & (np.abs(numbers) < 2 ** 53)
+            accepted = pd.Series(whole, index=values.index)
+            return accepted | nulls if optional else accepted
+    return pd.Series(False, index=values.index)
+
+
+# The values of an object column that are numbers, as floats, with NaN for everything else
+# Only actual ints and floats count: strings like "120" and booleans are left to Pydantic, which has its own rules
+# for them
+def _numeric_values(values):
+    plain = values.map(lambda value: isinstance(value, (int, float, np.number)) and not isinstance(value, (bool, np.bool_)))
+    return pd.to_numeric(values.where(plain), errors='coerce')
+
+# Function to validate a whole DataFrame against the Song model with column-wise checks instead of one model per row
+# Each column is checked with dtype and null-mask operations, and only the rows that fail a check are handed to Pydantic,
+# which either accepts them after all (e.g. numeric strings) or rejects them with its usual detailed error message
+# Returns a DataFrame of valid rows in the songs table layout, and a list of (row index, reason) for the rejected rows
+def validate_frame(df):
+    logger.info("Validating data from JSON")
+    frame = df.reset_index(drop=True)
+    ok = pd.Series(True, index=frame.index)
+    columns = {}
+    for column, (name, kind, optional, required) in SONG_FIELDS.items():
+        # The model also accepts the attribute name (class_) for aliased fields
+        source = column if column in frame.columns else name if name in frame.columns else None
+        if source is None:
+            if required:
+                ok[:] = False
+            columns[column] = pd.Series(None, index=frame.index, dtype=object)
+            continue
+        ok &= _column_mask(frame[source], kind, optional)
+        columns[column] = frame[source]
+    valid_df = pd.DataFrame(columns)[ok]
+
+    # Rows that failed a column check go through the Song model one by one
+    rejected = []
+    recovered = {}
+    for position in np.flatnonzero(~ok.to_numpy()):
+        try:
+            song = Song(**frame.iloc[position].to_dict())
+            recovered[position] = song.model_dump(by_alias=True)
+        except ValidationError as e:
+            logger.error(f"Validation error in Row {df.index[position]}: {e}")
+            rejected.append((df.index[position], str(e)))
+    if recovered:
+        valid_df = pd.concat([valid_df, pd.DataFrame.from_dict(recovered, orient='index', columns=SONG_COLUMNS)]).sort_index()
+    # Coerce the accepted values to the field types, the same way the model would
+    for column, (name, kind, optional, required) in SONG_FIELDS.items():
+        if kind is int:
+            valid_df[column] = valid_df[column].astype('int64')
+        elif kind is float and not valid_df[column].isna().all():
+            valid_df[column] = valid_df[column].astype('float64')
+    logger.info(f"{len(valid_df)} valid rows out of {len(df)}")
+    return valid_df.reset_index(drop=True), rejected
+
+
+# SQLite column types for the Song fields
+SQL_TYPES = {str: "TEXT", float: "REAL", int: "INTEGER"}
+
+# PRAGMAs used while the songs table is being bulk loaded
+# The table is rebuilt from scratch, so there is nothing worth journaling or syncing until the load has finished
+BULK_LOAD_PRAGMAS = {
+    # The shadow build commits after every chunk so an interrupted ingestion can resume, and WAL keeps each of those
+    # commits atomic; synchronous=OFF skips the fsyncs, which only risks the build (never the live version) on power loss
+    "journal_mode": "WAL",
+    "synchronous": "OFF",
+    "temp_store": "MEMORY",
+    "cache_size": -262144,
+}
+
+# Function to (re)create an empty songs table with a column for every Song field
+def create_songs_table(conn):
+    columns = ", ".join(f'"{column}" {SQL_TYPES[kind]}' for column, (_, kind, _, _) in SONG_FIELDS.items())
+    conn.execute("DROP TABLE IF EXISTS songs")
+    conn.execute(f"CREATE TABLE songs ({columns})")
+
+# Function to convert DataFrame columns to lists of plain Python values for sqlite3
+# Each column is converted in one go (tolist), with missing values as None so they become NULL
+def column_values(df, columns):
+    lists = []
+    for column in columns:
+        values = df[column]
+        if values.hasnans:
+            values = values.astype(object).where(values.notna(), None)
+        lists.append(values.tolist())
+    return lists
+
+# Function to insert a validated DataFrame into the songs table with a single executemany call
+# 'rowids' (used by the sharded layout) gives the rowid of every row; by default SQLite numbers them
+def insert_songs(conn, df, rowids=None):
+    if df.empty:
+        return
+    placeholders = ", ".join("?" for _ in SONG_COLUMNS)
+    if rowids is None:
+        conn.executemany(f"INSERT INTO songs VALUES ({placeholders})", zip(*column_values(df, SONG_COLUMNS)))
+        return
+    columns = ", ".join(f'"{column}"' for column in SONG_COLUMNS)
+    conn.executemany(f"INSERT INTO songs (rowid, {columns}) VALUES (?, {placeholders})",
+                     zip(rowids, *column_values(df, SONG_COLUMNS)))
+
+# Function to split a DataFrame by shard (see shards.py), returning one DataFrame per shard along with the positions
+# of its rows in the original DataFrame
+def split_by_shard(df, count):
+    shards = np.fromiter((shard_of(song_id, count) for song_id in df["id"].tolist()), dtype=np.int64, count=len(df))
+    return [(df[shards == index], np.flatnonzero(shards == index)) for index in range(count)]
+
+# Columns that make up a song's content hash - everything except the rating, which is owned by the API
+HASH_COLUMNS = [column for column in SONG_COLUMNS if column != "rating"]
+
+# Function to compute a 64-bit content hash for every row, used by incremental ingestion to spot changed songs
+def row_hashes(df):
+    return pd.util.hash_pandas_object(df[HASH_COLUMNS], index=False).to_numpy().view('int64').tolist()
+
+# Function to (re)create the table of song content hashes
+def create_hashes_table(conn):
+    conn.execute("DROP TABLE IF EXISTS song_hashes")
+    conn.execute("CREATE TABLE song_hashes (id TEXT PRIMARY KEY, row_hash INTEGER)")
+
+# Function to write a sequence of validated DataFrames into a new version of the database (see shadow.py)
+# The API keeps reading the live version while the songs are inserted with the bulk load PRAGMAs into a shadow file,
+# and the indexes are built once at the end rather than being updated row by row. Each DataFrame (one input chunk) is
+# committed with a record of the progress, so 'build' can be a resumed ShadowBuild whose first chunks are already in
+# and aren't in 'frames' any more. The finished version is checked, then swapped in for the live one
+# With "shards" -> "count" in config.json the songs are split over that many shard files instead (see shards.py),
+# which are written in parallel; every song keeps its position in the input as its rowid
+# Returns the number of rows written and the seconds spent writing
+def write_songs(db_path, frames, build=None):
+    build = build or ShadowBuild.start(db_path, shard_count(get_config()))
+    shards = build.shards
+    if shards:
+        os.makedirs(shard_root(build.path), exist_ok=True)
+    conns = []
+    try:
+        for path in build.targets:
+            conns.append(begin_bulk_load(path, resume=build.chunks > 0))
+        if not build.chunks:
+            build.seed_versions(conns[0])
+        rows = build.rows
+        chunks = build.chunks
+        seconds = 0.0
+        for df in frames:
+            start_time = time.perf_counter()
+            if shards:
+                parts = [(conn, part, positions + rows + 1)
+                         for conn, (part, positions) in zip(conns, split_by_shard(df, len(shards)))]
+                fan_out(lambda item: insert_frame(*item), parts, get_config())
+            else:
+                insert_frame(conns[0], df)
+            rows += len(df)
+            chunks += 1
+            # Commit the chunk, so an interrupted ingestion of the same input picks up after it
+            if build.source is not None:
+                for conn in conns:
+                    record_progress(conn, build.source, chunks, rows)
+                    conn.execute("COMMIT")
+                    conn.execute("BEGIN")
+            seconds += time.perf_counter() - start_time
+        start_time = time.perf_counter()
+        fan_out(finish_bulk_load, conns, get_config())
+        seconds += time.perf_counter() - start_time
+    finally:
+        for conn in conns:
+            # A failed chunk is rolled back; the committed ones stay for the next attempt to resume from
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            conn.close()
+    # Build the similar-songs index over the new songs (see similarity.py)
+    start_time = time.perf_counter()
+    derived = [ensure_index(build.path, similarity_settings(get_config()), rebuild=True, sources=shards or None)]
+    # Summarize the numeric columns for GET /stats/songs (see stats.py)
+    ensure_stats(build.path, stats_settings(get_config()), rebuild=True, sources=shards or None)
+    # Write the columnar snapshot the API serves bulk reads from (see snapshot.py); the sharded layout has none
+    if snapshot_enabled(get_config()) and not shards:
+        derived.append(ensure_snapshot(build.path, rebuild=True))
+    # Check the new version and put it live
+    build.validate(rows, derived)
+    build.publish()
+    seconds += time.perf_counter() - start_time
+    return rows, seconds
+
+# Function to open a database for a bulk load with the bulk load PRAGMAs, inside an open transaction
+# A new build starts with a fresh songs table; a resumed one carries on with the songs it already has
+# The connection may be used from the shard thread pool, one thread at a time
+def begin_bulk_load(path, resume=False):
+    conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+    for name, value in BULK_LOAD_PRAGMAS.items():
+        conn.execute(f"PRAGMA {name} = {value}")
+    conn.execute("BEGIN")
+    if not resume:
+        create_songs_table(conn)
+        create_hashes_table(conn)
+    return conn
+
+# Function to insert one validated DataFrame during a bulk load
+def insert_frame(conn, df, rowids=None):
+    insert_songs(conn, df, None if rowids is None else rowids.tolist())
+    # Record the content hashes, so a later incremental ingestion can tell which songs changed
+    conn.executemany("INSERT OR REPLACE INTO song_hashes VALUES (?, ?)", zip(df["id"].tolist(), row_hashes(df)))
+
+# Function to finish a bulk load: commit the songs, build the indexes and stored JSON, and restore the normal PRAGMAs
+def finish_bulk_load(conn):
+    # The ratings log starts empty; the ratings of the live version are copied in when the build is published,
+    # and the triggers give the songs that were rated before their average back (see shadow.py)
+    create_ratings_tables(conn)
+    # The catalog-wide rating totals of GET /stats/songs start over from the new songs
+    refresh_rating_summary(conn)
+    bump_data_version(conn, catalog=True)
+    conn.execute("COMMIT")
+    # Build the full-text and exact-match title indexes over the new table
+    build_indexes(conn)
+    # Store every song pre-encoded as JSON, for the API responses (see encoding.py)
+    build_fragments(conn)
+    for name in ("journal_mode", "synchronous"):
+        conn.execute(f"PRAGMA {name} = {DEFAULT_PRAGMAS[name]}")
+
+# Function to merge a sequence of validated DataFrames into the existing songs table, keyed on the song id
+# The incoming songs are staged in a temporary table first. Then, in a single transaction, new songs are inserted,
+# songs whose content hash changed are updated, and (with delete_missing) songs that are no longer in the input are removed.
+# Unchanged songs are not touched, and the rating column is never overwritten, so ratings given through the API survive.
+# Readers keep seeing the previous version of the table until the transaction commits
+# In the sharded layout every shard stages and merges its own songs, with one transaction per shard
+# The merge is made in the live version of the database (see shadow.py), where the files derived from it live too
+# Returns the counts of inserted, updated, deleted and unchanged songs, and the seconds spent writing
+def upsert_songs(db_path, frames, delete_missing=False):
+    db_path = live_path(db_path)
+    shards = shard_paths(db_path, shard_count(get_config()))
+    if shards:
+        os.makedirs(shard_root(db_path), exist_ok=True)
+    conns = []
+    try:
+        for path in shards or [db_path]:
+            conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+            conns.append(conn)
+            conn.execute("PRAGMA busy_timeout = 30000")
+            # Stage the input; a repeated id keeps its last occurrence, and the staged rowid is its position in the input
+            conn.execute(f"CREATE TEMP TABLE staging ({', '.join(HASH_COLUMNS)}, row_hash INTEGER, PRIMARY KEY (id))")
+        seconds = 0.0
+        rows = 0
+        for df in frames:
+            start_time = time.perf_counter()
+            if shards:
+                parts = [(conn, part, positions + rows + 1)
+                         for conn, (part, positions) in zip(conns, split_by_shard(df, len(shards)))]
+                fan_out(lambda item: stage_songs(*item), parts, get_config())
+            else:
+                stage_songs(conns[0], df, np.arange(rows + 1, rows + len(df) + 1))
+            seconds += time.perf_counter() - start_time
+            rows += len(df)
+
+        start_time = time.perf_counter()
+        for conn in conns:
+            conn.execute("BEGIN IMMEDIATE")
+            if not conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'songs'").fetchone():
+                create_songs_table(conn)
+        # New songs of a sharded catalog get rowids after the highest one of any shard, in the order of the input,
+        # so rowids stay unique across the shards and listings keep showing the songs in the order they were added
+        first_rowid = None
+        if shards:
+            first_rowid = max(conn.execute("SELECT IFNULL(MAX(rowid), 0) FROM songs").fetchone()[0] for conn in conns)
+        results = fan_out(lambda conn: merge_staged(conn, delete_missing, first_rowid), conns, get_config())
+        for conn in conns:
+            conn.execute("COMMIT")
+        fan_out(finish_upsert, conns, get_config())
+        seconds += time.perf_counter() - start_time
+    except Exception:
+        for conn in conns:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+        raise
+    finally:
+        for conn in conns:
+            conn.close()
+    counts = {name: sum(result[name] for result in results) for name in ("inserted", "updated", "deleted", "unchanged")}
+    changed = bool(counts["inserted"] or counts["updated"] or counts["deleted"])
+    # Rebuild the similar-songs index if the songs changed (see similarity.py)
+    start_time = time.perf_counter()
+    ensure_index(db_path, similarity_settings(get_config()), rebuild=changed, sources=shards or None)
+    # Summarize the numeric columns again if the songs changed (see stats.py)
+    ensure_stats(db_path, stats_settings(get_config()), rebuild=changed, sources=shards or None)
+    # Rewrite the columnar snapshot if the songs changed (see snapshot.py); the sharded layout has none
+    if snapshot_enabled(get_config()) and not shards:
+        ensure_snapshot(db_path, rebuild=changed)
+    seconds += time.perf_counter() - start_time
+    return counts, seconds
+
+# Function to stage one validated DataFrame for an incremental ingestion, with the positions of its rows in the input
+def stage_songs(conn, df, positions):
+    placeholders = ", ".join("?" for _ in range(len(HASH_COLUMNS) + 2))
+    conn.executemany(
+        f"INSERT OR REPLACE INTO temp.staging (rowid, {', '.join(HASH_COLUMNS)}, row_hash) VALUES ({placeholders})",
+        zip(positions.tolist(), *column_values(df, HASH_COLUMNS), row_hashes(df)),
+    )
+
+# Function to merge the staged songs into the songs table, inside the caller's transaction
+# New songs get SQLite's next rowids, or with 'first_rowid' (sharded layout) first_rowid plus their position in the input
+# Returns the counts of inserted, updated, deleted and unchanged songs
+def merge_staged(conn, delete_missing, first_rowid=None):
+    columns = ", ".join(f'"{column}"' for column in HASH_COLUMNS)
+    staged_columns = ", ".join(f's."{column}"' for column in HASH_COLUMNS)
+    conn.execute("CREATE TABLE IF NOT EXISTS song_hashes (id TEXT PRIMARY KEY, row_hash INTEGER)")
+    # Existing songs whose stored hash differs from the incoming one (or that have no hash yet)
+    conn.execute("""
+        CREATE TEMP TABLE changed AS
+        SELECT s.id FROM temp.staging s
+        WHERE EXISTS (SELECT 1 FROM songs WHERE songs.id = s.id)
+          AND s.row_hash IS NOT (SELECT h.row_hash FROM song_hashes h WHERE h.id = s.id)
+    """)
+    updated = conn.execute(f"""
+        UPDATE songs SET ({columns}) = (SELECT {staged_columns} FROM temp.staging s WHERE s.id = songs.id)
+        WHERE id IN (SELECT id FROM temp.changed)
+    """).rowcount
+    if first_rowid is None:
+        inserted = conn.execute(f"""
+            INSERT INTO songs ({columns})
+            SELECT {staged_columns} FROM temp.staging s WHERE NOT EXISTS (SELECT 1 FROM songs WHERE songs.id = s.id)
+            ORDER BY s.rowid
+        """).rowcount
+    else:
+        inserted = conn.execute(f"""
+            INSERT INTO songs (rowid, {columns})
+            SELECT ? + s.rowid, {staged_columns} FROM temp.staging s
+            WHERE NOT EXISTS (SELECT 1 FROM songs WHERE songs.id = s.id) ORDER BY s.rowid
+        """, (first_rowid,)).rowcount
+    deleted = 0
+    if delete_missing:
+        deleted = conn.execute(
+            "DELETE FROM songs WHERE NOT EXISTS (SELECT 1 FROM temp.staging s WHERE s.id = songs.id)"
+        ).rowcount
+        conn.execute("DELETE FROM song_hashes WHERE NOT EXISTS (SELECT 1 FROM temp.staging s WHERE s.id = song_hashes.id)")
+    conn.execute("""
+        INSERT OR REPLACE INTO song_hashes (id, row_hash)
+        SELECT s.id, s.row_hash FROM temp.staging s
+        WHERE s.row_hash IS NOT (SELECT h.row_hash FROM song_hashes h WHERE h.id = s.id)
+    """)
+    if inserted or deleted:
+        create_ratings_tables(conn)
+        # New songs that were rated under the same id before get their average back
+        if inserted:
+            restore_song_ratings(conn)
+        # Inserted and deleted songs bypass the rating summary triggers, so its totals are recomputed
+        refresh_rating_summary(conn)
+    staged = conn.execute("SELECT COUNT(*) FROM temp.staging").fetchone()[0]
+    changed = conn.execute("SELECT COUNT(*) FROM temp.changed").fetchone()[0]
+    if inserted or updated or deleted:
+        bump_data_version(conn, catalog=True)
+    return {"inserted": inserted, "updated": updated, "deleted": deleted, "unchanged": staged - inserted - changed}
+
+# Function to bring the indexes and stored JSON up to date after an incremental ingestion
+def finish_upsert(conn):
+    # The triggers have kept the title search index in sync, so only missing indexes need creating
+    build_indexes(conn, rebuild=False)
+    # Only the new and changed songs need encoding again
+    build_fragments(conn, rebuild=False)
+
 # Function to save the validated DataFrame to a SQLite database
 # It connects to the database, saves the DataFrame as a table named 'songs', and logs the process
 # If the database file does not exist, it will be created
 def save_to_db(df, db_path='data/playlist.db'):
-    logging.info(f"Saving data to database at {db_path}")
-    conn = sqlite3.connect(db_path)
-    df.to_sql('songs', conn, if_exists='replace', index=False) #(table name, connection object, if_exists='replace' to overwrite existing table, index=false to drop index)
-    conn.close()
-    logging.info("Data saved to database successfully")
-
-# Function to load configuration settings from a JSON file
-# It reads the configuration file and returns the settings as a dictionary
-def load_config(path='config.json'):
-    try:
-        with open(path, 'r') as file:
-            config = json.load(file)
-        logging.info(f"Loaded config from {path}")
-        return config
-    except Exception as e:
-        logging.error(f"Error loading config from {path}: {e}")
-        return {}
+    logger.info(f"Saving data to database at {db_path}")
+    write_songs(db_path, [df])
+    logger.info("Data saved to database successfully")
 
-# Main function to execute the data ingestion and validation process
-if __name__ == "__main__":
+# Function to turn one chunk of raw rows into validated songs
+# Rows are numbered by their position in the file, so validation errors point at the right row
+# Returns the validated DataFrame, the number of rows read, and the seconds spent validating
+def validate_chunk(rows, first_row):
+    start_time = time.perf_counter()
+    df = pd.DataFrame(rows, index=range(first_row, first_row + len(rows)))
+    df.columns = df.columns.str.strip().str.lower()
+    validated_df, _ = validate_frame(df)
+    validated_df["rating"] = None
+    return validated_df, len(rows), time.perf_counter() - start_time
+
+# Function run by the worker processes for NDJSON input: parse one byte range of the file and validate it
+# Returns the same as validate_chunk, plus the seconds spent parsing
+def parse_and_validate_range(path, start, end):
+    start_time = time.perf_counter()
+    rows = list(iter_ndjson_range(path, start, end))
+    parse_seconds = time.perf_counter() - start_time
+    # Row numbers within a range aren't known up front, so errors are reported by byte range
+    logger.info(f"Validating rows from bytes {start}-{end}")
+    return validate_chunk(rows, 0) + (parse_seconds,)
+
+# Function to ingest a large input file without loading it into memory
+# Rows are read incrementally (columnar JSON or NDJSON, see streaming.py) and validated chunk_size rows at a time,
+# so peak memory depends on the chunk size and not on the size of the input file
+# With workers > 1 the chunks are validated on a process pool, and NDJSON files are also parsed there (each worker
+# takes its own byte range); columnar JSON can't be split without reading it, so it is parsed by the main process.
+# A single writer inserts the validated chunks in order, keeping only a few chunks in flight at a time
+# With upsert=True the chunks are merged into the existing table instead of replacing it (see upsert_songs)
+# Otherwise a new version of the database is built (see shadow.py); if an earlier ingestion of the same file was
+# interrupted, its committed chunks are kept and skipped in the input
+# Logs rows/sec for each stage and returns the number of valid rows
+def ingest_stream(input_path, db_path='data/playlist.db', chunk_size=10000, workers=1, upsert=False, delete_missing=False):
+    logger.info(f"Streaming data from {input_path} to {db_path} in chunks of {chunk_size} rows with {workers} worker(s)")
+    stats = {"rows": 0, "valid": 0, "parse": 0.0, "validate": 0.0}
+    start_time = time.perf_counter()
+    ranges = workers > 1 and is_ndjson(input_path)
+    build = None
+    if not upsert:
+        source = source_identity(input_path, chunk_size, "ranges" if ranges else "rows")
+        build = ShadowBuild.start(db_path, shard_count(get_config()), source)
+    skip = build.chunks if build is not None else 0
+
+    # Yield raw chunks from the input with the file position of their first row, timing how long the parsing takes
+    # The chunks a resumed build already has are read past without being validated
+    def raw_chunks():
+        rows = iter_rows(input_path)
+        first_row = 0
+        index = 0
+        while True:
+            parse_start = time.perf_counter()
+            chunk = next(iter_chunks(rows, chunk_size), None)
+            stats["parse"] += time.perf_counter() - parse_start
+            if chunk is None:
+                return
+            if index >= skip:
+                yield chunk, first_row
+            first_row += len(chunk)
+            index += 1
+
+    # Collect the timings of a finished chunk and pass its songs on to the writer
+    def finished(result):
+        validated_df, rows, validate_seconds = result[:3]
+        if len(result) > 3:
+            stats["parse"] += result[3]
+        stats["rows"] += rows
+        stats["valid"] += len(validated_df)
+        stats["validate"] += validate_seconds
+        logger.info(f"Processed {stats['rows']} rows ({stats['valid']} valid)")
+        return validated_df
+
+    def frames():
+        if workers <= 1:
+            for chunk, first_row in raw_chunks():
+                yield finished(validate_chunk(chunk, first_row))
+            return
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            # Chunks are only submitted as the loop below asks for them
+            if ranges:
+                submissions = (
+                    executor.submit(parse_and_validate_range, input_path, start, end)
+                    for start, end in ndjson_ranges(input_path, chunk_size)[skip:]
+                )
+            else:
+                submissions = (executor.submit(validate_chunk, chunk, first_row) for chunk, first_row in raw_chunks())
+            pending = deque()
+            for future in submissions:
+                pending.append(future)
+                # Keep a bounded number of chunks in flight, so memory stays bounded when the writer falls behind
+                if len(pending) >= 2 * workers:
+                    yield finished(pending.popleft().result())
+            while pending:
+                yield finished(pending.popleft().result())
+
+    valid = None
+    if upsert:
+        counts, write_seconds = upsert_songs(db_path, frames(), delete_missing)
+        logger.info(f"Incremental ingestion: {counts}")
+    else:
+        # A resumed build also holds the valid rows of the chunks it skipped
+        valid, write_seconds = write_songs(db_path, frames(), build)
+    total_seconds = time.perf_counter() - start_time
+
+    # Report throughput per stage (parse and validate time are summed across workers)
+    def rate(seconds):
+        return f"{stats['rows'] / seconds:,.0f} rows/sec" if seconds > 0 else "n/a"
+    logger.info(
+        f"Streaming ingestion finished: {stats['valid']} valid rows out of {stats['rows']} in {total_seconds:.2f}s "
+        f"(parse: {rate(stats['parse'])}, validate: {rate(stats['validate'])}, write: {rate(write_seconds)}, "
+        f"overall: {rate(total_seconds)})"
+    )
+    return stats["valid"] if valid is None else valid
+
+# Run the ingestion with the settings from config.json, overridden by the arguments that are given:
+# the input file, streaming in chunks of chunk_size rows, the number of validation processes, and incremental
+# ingestion (upsert), optionally deleting the songs that are not in the input
+def ingest(input_path=None, stream=False, chunk_size=None, workers=None, upsert=False, delete_missing=False):
     #get configuration settings
-    config = load_config('config.json')
+    config = get_config()
     #get input and output paths from config or use defaults
-    input_path = config.get("input_path", 'data/playlist.json')
+    input_path = input_path or config.get("input_path", 'data/playlist.json')
     db_path=config.get("db_path", 'data/playlist.db')
     #output_path = config.get("output_path", 'data/playlist.csv')
-    logging.info("Starting data ingestion and validation process")
-    # Load the data from the JSON file
-    df = load_data(input_path)
-    # Ensure the column names are stripped of whitespace and converted to lowercase
-    df.columns = df.columns.str.strip().str.lower()
-    # Validate the songs in the DataFrame
-    validated_df = validate_songs(df)
-    # print(validated_df.head(10))
-    validated_df = pd.DataFrame([song.model_dump(by_alias=True) for song in validated_df])
-    validated_df["rating"] = None
-    #validated_df.to_csv(output_path, index=False)
-    save_to_db(validated_df, db_path)
-    logging.info(f"Saved validated data to database at {db_path}")
-    #logging.info(f"Saved validated data to {output_path}")
\ No newline at end of file
+    logger.info("Starting data ingestion and validation process")
+    workers = workers or config.get("workers", 1)
+    if stream or workers > 1 or is_ndjson(input_path):
+        # Streaming mode keeps memory bounded for very large inputs
+        ingest_stream(
+            input_path, db_path, chunk_size or config.get("chunk_size", 10000), workers,
+            upsert=upsert, delete_missing=delete_missing,
+        )
+    else:
+        # Load the data from the JSON file
+        df = load_data(input_path)
+        # Ensure the column names are stripped of whitespace and converted to lowercase
+        df.columns = df.columns.str.strip().str.lower()
+        # Validate the songs in the DataFrame
+        validated_df, _ = validate_frame(df)
+        # print(validated_df.head(10))
+        validated_df["rating"] = None
+        #validated_df.to_csv(output_path, index=False)
+        if upsert:
+            counts, _ = upsert_songs(db_path, [validated_df], delete_missing)
+            logger.info(f"Incremental ingestion: {counts}")
+        else:
+            save_to_db(validated_df, db_path)
+    logger.info(f"Saved validated data to database at {db_path}")
+    #logger.info(f"Saved validated data to {output_path}")
+
+# Main function to execute the data ingestion and validation process
+# "python dataParsing.py" takes the same arguments as "python main.py ingest", which it runs
+if __name__ == "__main__":
+    from main import main
+    main(["ingest"] + sys.argv[1:])
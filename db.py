@@ -2,33 +2,29 @@ import sqlite3
 import logging
 import os
 import json
-from contextlib import closing
+import re
+import time
+import threading
+import heapq
+import itertools
+from contextlib import contextmanager
+from metrics import metrics, timed
+from shards import shard_count, shard_paths, shard_of, fan_out
+from shadow import live_path, RETIRED_MESSAGE
 
 '''
 The comments are in greater detail to explain each step of the code
 '''
 
-# Ensure the logs directory exists
-os.makedirs('logs', exist_ok=True)
-
 # logging.basicConfig(level=logging.INFO,
 #                     format='%(asctime)s - %(levelname)s - %(message)s',
 #                     handlers=[logging.FileHandler('logs/db.log'),
 #                               logging.StreamHandler()])
 
-# Configure named logger
+# Named logger
+# Once configure_logging() has run, records go through a queue to a background thread that writes logs/db.log and the
+# console (see logsetup.py)
 logger = logging.getLogger("db_logger")
-logger.setLevel(logging.INFO)
-
-file_handler = logging.FileHandler('logs/db.log')
-stream_handler = logging.StreamHandler()
-
-formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-file_handler.setFormatter(formatter)
-stream_handler.setFormatter(formatter)
-
-logger.addHandler(file_handler)
-logger.addHandler(stream_handler)
 
 #DB_PATH = 'data/playlist.db'
 
@@ -38,52 +34,944 @@ def load_config(path='config.json'):
     try:
         with open(path, 'r') as file:
             config = json.load(file)
-        logging.info(f"Loaded config from {path}")
+        logger.info(f"Loaded config from {path}")
         return config
     except Exception as e:
-        logging.error(f"Error loading config from {path}: {e}")
+        logger.error(f"Error loading config from {path}: {e}")
         return {}
 
+# Cached configuration, so config.json is parsed once instead of on every database call
+# The file is re-checked at most once per second and reloaded only when its modification time changes
+_config_cache = {"path": None, "mtime": None, "checked": 0.0, "data": {}}
+_config_lock = threading.Lock()
+
+def get_config(path='config.json'):
+    now = time.monotonic()
+    with _config_lock:
+        if _config_cache["path"] == path and now - _config_cache["checked"] < 1.0:
+            return _config_cache["data"]
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            mtime = None
+        if _config_cache["path"] != path or _config_cache["mtime"] != mtime:
+            _config_cache["data"] = load_config(path)
+            _config_cache["path"] = path
+            _config_cache["mtime"] = mtime
+        _config_cache["checked"] = now
+        return _config_cache["data"]
+
+# Default PRAGMAs applied to every new connection, overridable through the "sqlite" section of config.json
+# WAL lets readers carry on while a rating is being written, and synchronous=NORMAL is safe under WAL
+# mmap_size and cache_size (negative = KiB) keep hot pages in memory between requests
+DEFAULT_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "mmap_size": 268435456,
+    "cache_size": -65536,
+}
+
 # Function to establish a connection to the SQLite database
-def get_connection():
+# 'path' is the file of one shard (see shards.py); by default it is db_path from the config
+def get_connection(path=None):
     # Load configuration settings
-    config=load_config()
+    config = get_config()
     # Establish a connection to the SQLite database
     logger.info("Establishing database connection")
     # Check if the database path is provided in the config, otherwise use default
-    conn = sqlite3.connect(config.get('db_path', 'data/playlist.db'))
+    # check_same_thread is off because pooled connections move between request threads (one thread at a time)
+    conn = sqlite3.connect(path or config.get('db_path', 'data/playlist.db'), check_same_thread=False)
+    metrics.inc("db_connections_opened")
     conn.row_factory = sqlite3.Row # This allows us to access columns by name
+    # Apply the startup PRAGMAs
+    pragmas = {**DEFAULT_PRAGMAS, **config.get('sqlite', {})}
+    for name, value in pragmas.items():
+        conn.execute(f"PRAGMA {name} = {value}")
     logger.info("Database connection established")
     return conn
 
-def fetch_all_songs():
-    # Fetch all songs from the database
-    logger.info("Fetching all songs from the database")
-    with closing(get_connection()) as conn:
-        # Fetch all is a SELECT * query
-        return conn.execute("SELECT * FROM songs").fetchall()
 
-def fetch_song_by_id(song_id):
-    # Fetch a single song by its ID
-    logger.info(f"Fetching song with ID {song_id}")
-    with closing(get_connection()) as conn:
-        # Fetching a song by ID is a SELECT query with a WHERE clause
-        query = "SELECT * FROM songs WHERE title LIKE ?"
-        return conn.execute(query,(f"%{song_id}%",)).fetchall()
-        #return conn.execute(, (song_id,)).fetchone()
+# Pool of open connections that are reused across Flask requests
+# A request checks a connection out, uses it, and hands it back, so the connect and PRAGMA cost is paid once
+# Idle connections are kept on a stack per database file (db_path, or each shard file), so a busy thread keeps getting
+# the connection it used last. When db_path, the shards or the sqlite settings in config.json change, or an ingestion
+# points db_path at a new version of the database (see shadow.py), the pool moves to a new generation and connections
+# from the old one are closed as they come back
+class ConnectionPool:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._idle = {}
+        self._settings = None
+        self._generation = 0
 
+    # Work out which generation current connections should belong to, based on the loaded config
+    def _current_generation(self, config):
+        settings = (live_path(config.get('db_path', 'data/playlist.db')), shard_count(config),
+                    json.dumps(config.get('sqlite', {}), sort_keys=True))
+        with self._lock:
+            if settings != self._settings:
+                if self._settings is not None:
+                    logger.info("Database settings changed, recycling pooled connections")
+                self._settings = settings
+                self._generation += 1
+                stale, self._idle = self._idle, {}
+            else:
+                stale = {}
+            generation = self._generation
+        for conn, _ in itertools.chain.from_iterable(stale.values()):
+            conn.close()
+        return generation
 
-def update_rating(song_id, rating):
-    # Update the rating of a song by its ID
-    logger.info(f"Updating rating for song ID {song_id} to {rating}")
+    def acquire(self, path=None):
+        generation = self._current_generation(get_config())
+        with self._lock:
+            idle = self._idle.get(path, [])
+            while idle:
+                conn, conn_generation = idle.pop()
+                if conn_generation == generation:
+                    return conn, generation
+                conn.close()
+        return get_connection(path), generation
+
+    def release(self, conn, generation, path=None):
+        # Never hand out a connection with a half-finished transaction
+        if conn.in_transaction:
+            conn.rollback()
+        max_idle = get_config().get('pool_size', 8)
+        with self._lock:
+            idle = self._idle.setdefault(path, [])
+            if generation == self._generation and len(idle) < max_idle:
+                idle.append((conn, generation))
+                return
+        conn.close()
+
+    # Close every idle connection, e.g. on shutdown or after the database file has been replaced
+    def close_all(self):
+        with self._lock:
+            idle, self._idle = self._idle, {}
+            self._generation += 1
+        for conn, _ in itertools.chain.from_iterable(idle.values()):
+            conn.close()
+
+
+pool = ConnectionPool()
+
+# Context manager used by all queries below to borrow a pooled connection, to db_path or to the shard file 'path'
+# Setting pool_size to 0 in config.json turns pooling off and opens a fresh connection for every call
+@contextmanager
+def connection(path=None):
+    if get_config().get('pool_size', 8) <= 0:
+        conn = get_connection(path)
+        try:
+            yield conn
+        finally:
+            conn.close()
+        return
+    conn, generation = pool.acquire(path)
     try:
-        with closing(get_connection()) as conn:
-            # Update rating is an UPDATE query with a WHERE clause
-            cursor = conn.execute(
-                "UPDATE songs SET rating = ? WHERE id = ?", (rating, song_id)
+        yield conn
+    finally:
+        pool.release(conn, generation, path)
+
+# The shard files of the catalog (see shards.py), or an empty list when it is a single database file
+# They sit next to the live version of the database (see shadow.py)
+def _shards():
+    config = get_config()
+    return shard_paths(config.get('db_path', 'data/playlist.db'), shard_count(config))
+
+# Run function(conn) on every shard in parallel, each with a pooled connection to its file, returning the results
+# in shard order
+def _each_shard(function, shards):
+    def run(path):
+        with connection(path) as conn:
+            return function(conn)
+    return fan_out(run, shards, get_config())
+
+# The shard file holding a song, or None for the single-file layout
+def _shard_for(song_id):
+    shards = _shards()
+    return shards[shard_of(song_id, len(shards))] if shards else None
+
+# Where SQLite sorts a value among values of other types: NULL, then numbers, then text, then blobs
+def _type_rank(value):
+    if value is None:
+        return 0
+    if isinstance(value, (int, float)):
+        return 1
+    return 2 if isinstance(value, str) else 3
+
+# Text or blob value that sorts the other way round, for descending merge keys
+class _Reversed:
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+    def __lt__(self, other):
+        return other.value < self.value
+
+# Key that orders a column value the way SQLite's ORDER BY does, in either direction
+# Text compares by code point, which is the order of SQLite's BINARY collation over UTF-8
+def _order_key(value, descending):
+    rank = _type_rank(value)
+    if rank == 0:
+        return (0, 0)
+    if not descending:
+        return (rank, value)
+    return (-rank, -value) if rank == 1 else (-rank, _Reversed(value))
+
+# Merge the rows returned by the shards into one stream ordered by 'keys', a list of (column, descending) pairs
+# Each shard's rows are already in that order, and the rowid (the last key) is unique, so the result is the order a
+# single database would have returned
+def _merge_rows(results, keys):
+    if len(keys) == 1:
+        column, descending = keys[0]
+        return heapq.merge(*results, key=lambda row: row[column], reverse=descending)
+    return heapq.merge(*results, key=lambda row: tuple(_order_key(row[column], descending) for column, descending in keys))
+
+# The position of the song at 0-based position offset - 1 of a sorted, filtered listing of a sharded catalog, as the
+# list of its sort values followed by its rowid, or None if there are not that many songs
+# Only the sort columns and rowids of the first 'offset' songs of every shard are read
+def _position_before(offset, filters, keys, order, merge_keys, shards):
+    clauses, params = _filter_clauses(filters)
+    where = f"WHERE {' AND '.join(clauses)} " if clauses else ""
+    columns = ", ".join(expression for expression, _ in keys)
+    query = f"SELECT {columns} FROM songs {where}ORDER BY {order} LIMIT ?"
+    rows = _each_shard(lambda conn: conn.execute(query, params + [offset]).fetchall(), shards)
+    if len(keys) == 1 and not keys[0][1]:
+        # In plain rowid order the rowids themselves are the keys, and sorting plain integers is fastest
+        rowids = sorted(row[0] for row in itertools.chain.from_iterable(rows))
+        return [rowids[offset - 1]] if len(rowids) >= offset else None
+    last = next(itertools.islice(_merge_rows(rows, merge_keys), offset - 1, None), None)
+    return list(last) if last is not None else None
+
+# Cached row counts, so listing endpoints don't run COUNT(*) on every call
+# There is one entry per catalog version and set of filters (the unfiltered total is the empty tuple), so an ingestion
+# made by any process starts a new set of counts, while rating writes keep them. A count filtered on the rating is keyed
+# by the data version as well, since every rating can change it. An entry is also refreshed once it is older than
+# count_cache_ttl seconds (from config.json). At most COUNT_CACHE_SIZE different entries are kept
+_count_cache = {}
+COUNT_CACHE_SIZE = 256
+
+# SQL comparison for each range filter suffix accepted by GET /songs (?energy_gte=0.7)
+FILTER_OPERATORS = {"gt": ">", "gte": ">=", "lt": "<", "lte": "<="}
+
+# Build the WHERE conditions for a list of (column, operator, value) range filters
+# Column names must already have been checked against the Song schema; they are quoted here all the same
+def _filter_clauses(filters):
+    clauses = [f'songs."{column}" {FILTER_OPERATORS[operator]} ?' for column, operator, _ in filters]
+    return clauses, [value for _, _, value in filters]
+
+# Build the keyset condition "the row comes after 'values' in this order"
+# 'keys' is a list of (SQL expression, descending) pairs and 'values' the sort values of the last row of the previous page.
+# SQLite puts NULLs first in ascending order and last in descending order, and the condition follows the same rule
+def _keyset_clause(keys, values):
+    options = []
+    params = []
+    for index, (expression, descending) in enumerate(keys):
+        value = values[index]
+        if value is None and descending:
+            # Nothing sorts after a NULL in descending order, except further ties handled by the later keys
+            continue
+        parts = []
+        option_params = []
+        for (previous, _), previous_value in zip(keys[:index], values[:index]):
+            if previous_value is None:
+                parts.append(f"{previous} IS NULL")
+            else:
+                parts.append(f"{previous} = ?")
+                option_params.append(previous_value)
+        if value is None:
+            parts.append(f"{expression} IS NOT NULL")
+        elif descending:
+            parts.append(f"({expression} < ? OR {expression} IS NULL)")
+            option_params.append(value)
+        else:
+            parts.append(f"{expression} > ?")
+            option_params.append(value)
+        options.append("(" + " AND ".join(parts) + ")")
+        params.extend(option_params)
+    return "(" + " OR ".join(options) + ")" if options else "0", params
+
+# Whether the database has the song_json table, which ingestion creates
+def has_song_json(conn):
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'song_json'").fetchone() is not None
+
+@timed(rows=lambda result: len(result[0]))
+def fetch_songs(limit, offset=0, after=None, filters=(), sort=(), fragments=False, columns=None, stats=True):
+    # Fetch a single page of songs
+    # 'filters' is a list of (column, operator, value) range filters and 'sort' a list of (column, descending) sort keys;
+    # without sort keys the songs come in insertion (rowid) order, and with them the rowid breaks ties
+    # If 'after' is given it is the position of the last song on the previous page (keyset pagination), which lets SQLite
+    # seek straight to the page instead of walking over 'offset' rows: the rowid, or with sort keys a list of the sort values
+    # followed by the rowid
+    # Each song comes with its precomputed rating stats (rating_count, rating_mean and rating_hist_0..5), looked up by primary key
+    # With fragments=True (and a song_json table) the rows hold the song's stored JSON (head and tail), its rating,
+    # rating stats and sort columns instead of every column
+    # With 'columns' (a ?fields= projection) only those columns and the sort columns are read, and with stats=False the
+    # rating stats are left out as well
+    # In the sharded layout every shard runs the same query and the pages are merged (see shards.py)
+    # Returns the rows and the position to continue from, or None if this was the last page
+    logger.info(f"Fetching songs: limit={limit}, offset={offset}, after={after}, filters={filters}, sort={sort}")
+    shards = _shards()
+    # The rowid tie-break runs in the direction of the last sort key, so a single-column index can serve the whole order
+    keys = [(f'songs."{column}"', descending) for column, descending in sort]
+    keys.append(("songs.rowid", sort[-1][1] if sort else False))
+    order = ", ".join(f"{expression} DESC" if descending else expression for expression, descending in keys)
+    merge_keys = [(column, descending) for column, descending in sort] + [("rowid", keys[-1][1])]
+    if shards and after is None and offset:
+        # A deep page of a sharded catalog starts after the song at position offset - 1, which is found from the
+        # shards' sort keys alone; the page itself is then read like a keyset page
+        after = _position_before(offset, filters, keys, order, merge_keys, shards)
+        if after is None:
+            return [], None
+        if not sort:
+            after = after[0]
+    clauses, params = _filter_clauses(filters)
+    if after is not None:
+        clause, keyset_params = _keyset_clause(keys, list(after) if sort else [after])
+        clauses.append(clause)
+        params += keyset_params
+    where = f"WHERE {' AND '.join(clauses)} " if clauses else ""
+    if after is not None or shards:
+        page = f"{where}ORDER BY {order} LIMIT ?"
+        params.append(limit)
+    else:
+        page = f"{where}ORDER BY {order} LIMIT ? OFFSET ?"
+        params += [limit, offset]
+
+    selected = None
+    if columns is not None:
+        selected = "".join(f', songs."{column}"' for column in dict.fromkeys(list(columns) + [column for column, _ in sort]))
+
+    def read(conn):
+        if selected is not None:
+            select = f"SELECT songs.rowid{selected}" + (_STATS_COLUMNS + _STATS_JOIN if stats else " FROM songs")
+        elif fragments and has_song_json(conn):
+            select = SONG_JSON_WITH_STATS.format(sort_columns="".join(f', songs."{column}"' for column, _ in sort))
+        else:
+            select = SONGS_WITH_STATS
+        try:
+            return conn.execute(f"{select} {page}", params).fetchall()
+        except sqlite3.OperationalError as e:
+            if "no such table" not in str(e):
+                raise
+            # Databases that have never been rated have no rating_stats table yet
+            return conn.execute(f"SELECT songs.rowid{', *' if selected is None else selected} FROM songs {page}", params).fetchall()
+
+    if shards:
+        # Any shard may hold the whole page, so each returns a full page and the merge keeps the first 'limit' songs
+        rows = list(itertools.islice(_merge_rows(_each_shard(read, shards), merge_keys), limit))
+    else:
+        with connection() as conn:
+            rows = read(conn)
+    # A short page means there is nothing left to fetch
+    if len(rows) < limit or not rows:
+        return rows, None
+    last = rows[-1]
+    if not sort:
+        return rows, last["rowid"]
+    return rows, [last[column] for column, _ in sort] + [last["rowid"]]
+
+@timed()
+def count_songs(filters=()):
+    # Return the number of songs matching the filters (all songs by default), served from a short-lived cache
+    key = (get_catalog_version(), tuple(filters))
+    if any(column == "rating" for column, _, _ in filters):
+        key += (get_data_version(),)
+    now = time.monotonic()
+    cached = _count_cache.get(key)
+    if cached is not None and now < cached[1]:
+        return cached[0]
+    logger.info(f"Counting songs in the database: filters={filters}")
+    ttl = get_config().get('count_cache_ttl', 30)
+    clauses, params = _filter_clauses(filters)
+    where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+    count = lambda conn: conn.execute(f"SELECT COUNT(*) FROM songs{where}", params).fetchone()[0]
+    shards = _shards()
+    if shards:
+        total = sum(_each_shard(count, shards))
+    else:
+        with connection() as conn:
+            total = count(conn)
+    if len(_count_cache) >= COUNT_CACHE_SIZE:
+        _count_cache.clear()
+    _count_cache[key] = (total, now + ttl)
+    return total
+
+def invalidate_count_cache():
+    # Drop the cached counts, e.g. after the songs table has been rewritten
+    _count_cache.clear()
+
+def iter_songs(filters=(), after=None, batch_size=1000):
+    # Stream the songs matching the filters in insertion (rowid) order, starting after the given rowid
+    # One query is run and its rows are fetched in batches of batch_size, so memory use doesn't grow with the table;
+    # the pooled connection is held (and sees one consistent version of the table) until the generator is closed
+    # In the sharded layout every shard streams its songs and the streams are merged by rowid
+    # Yields lists of rows, each row being the rowid followed by the songs table columns
+    logger.info(f"Streaming songs: filters={filters}, after={after}")
+    clauses, params = _filter_clauses(filters)
+    if after is not None:
+        clauses.append("songs.rowid > ?")
+        params.append(after)
+    where = f"WHERE {' AND '.join(clauses)} " if clauses else ""
+    query = f"SELECT songs.rowid, * FROM songs {where}ORDER BY songs.rowid"
+    shards = _shards()
+    if not shards:
+        yield from _iter_query(None, query, params, batch_size)
+        return
+    streams = [_iter_query(path, query, params, batch_size) for path in shards]
+    try:
+        merged = heapq.merge(*(itertools.chain.from_iterable(stream) for stream in streams), key=lambda row: row[0])
+        while True:
+            rows = list(itertools.islice(merged, batch_size))
+            if not rows:
+                break
+            yield rows
+    finally:
+        for stream in streams:
+            stream.close()
+
+# Run a query on a pooled connection to db_path (or the shard file 'path') and yield its rows in batches
+def _iter_query(path, query, params, batch_size):
+    with connection(path) as conn:
+        cursor = conn.execute(query, params)
+        try:
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                metrics.inc("db_rows", len(rows), function="iter_songs")
+                yield rows
+        finally:
+            cursor.close()
+
+@timed()
+def rowid_at(position, filters=(), after=None):
+    # The rowid of the song at a 0-based position among the songs matching the filters (after the given rowid),
+    # in insertion order, or None if there are not that many songs
+    clauses, params = _filter_clauses(filters)
+    if after is not None:
+        clauses.append("songs.rowid > ?")
+        params.append(after)
+    where = f"WHERE {' AND '.join(clauses)} " if clauses else ""
+    shards = _shards()
+    if shards:
+        # Each shard returns its first position + 1 rowids, and the song at the position is among them
+        query = f"SELECT songs.rowid FROM songs {where}ORDER BY songs.rowid LIMIT ?"
+        read = lambda conn: [row[0] for row in conn.execute(query, params + [position + 1])]
+        return next(itertools.islice(heapq.merge(*_each_shard(read, shards)), position, None), None)
+    with connection() as conn:
+        row = conn.execute(f"SELECT songs.rowid FROM songs {where}ORDER BY songs.rowid LIMIT 1 OFFSET ?",
+                           params + [position]).fetchone()
+    return row[0] if row else None
+
+# A range filter parameter of GET /songs: a column name and a comparison suffix (?energy_gte=0.7)
+FILTER_PARAM = re.compile(r"(\w+?)_(gte|gt|lte|lt)")
+
+# Columns indexed for GET /songs filters and sorts, unless config.json lists its own "indexed_columns"
+DEFAULT_INDEXED_COLUMNS = ["danceability", "energy", "tempo", "valence", "loudness", "duration_ms", "rating"]
+
+# Covering indexes built unless config.json lists its own "covering_indexes": each is a list of columns, led by the
+# column the index is searched on. The default one answers an exact title match that only asks for the id, title and
+# rating (?match=exact&fields=id,title,rating) without reading the songs table
+DEFAULT_COVERING_INDEXES = [["title", "id", "rating"]]
+
+# The name of the covering index over a list of columns
+def covering_index_name(columns):
+    return "idx_songs_cover_" + "_".join(columns)
+
+# The column list of a covering index; a leading title is compared case-insensitively, like the title matches
+def _covering_columns(columns):
+    return ", ".join(f'"{column}" COLLATE NOCASE' if index == 0 and column == "title" else f'"{column}"'
+                     for index, column in enumerate(columns))
+
+# Build the indexes over the songs table, called by dataParsing once the songs table has been loaded
+# idx_songs_id serves the rating updates, which look songs up by id
+# songs_fts is an FTS5 index over songs.title that reads the titles from the songs table itself (external content),
+# and the triggers keep it in sync whenever a row is inserted, deleted or has its title changed
+# idx_songs_title is a plain B-tree index used for exact, case-insensitive title matches
+# With rebuild=False an existing full-text index is kept as it is (the triggers have kept it up to date),
+# which is what incremental ingestion wants; only missing pieces are created
+def build_indexes(conn, rebuild=True):
+    logger.info("Building song indexes")
+    exists = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'songs_fts'").fetchone()
+    if rebuild or not exists:
+        conn.executescript("""
+            DROP TABLE IF EXISTS songs_fts;
+            CREATE VIRTUAL TABLE songs_fts USING fts5(title, content='songs', content_rowid='rowid', prefix='2 3');
+            INSERT INTO songs_fts(songs_fts) VALUES ('rebuild');
+        """)
+    conn.executescript("""
+        CREATE TRIGGER IF NOT EXISTS songs_fts_insert AFTER INSERT ON songs BEGIN
+            INSERT INTO songs_fts(rowid, title) VALUES (new.rowid, new.title);
+        END;
+        CREATE TRIGGER IF NOT EXISTS songs_fts_delete AFTER DELETE ON songs BEGIN
+            INSERT INTO songs_fts(songs_fts, rowid, title) VALUES ('delete', old.rowid, old.title);
+        END;
+        CREATE TRIGGER IF NOT EXISTS songs_fts_update AFTER UPDATE OF title ON songs BEGIN
+            INSERT INTO songs_fts(songs_fts, rowid, title) VALUES ('delete', old.rowid, old.title);
+            INSERT INTO songs_fts(rowid, title) VALUES (new.rowid, new.title);
+        END;
+
+        CREATE INDEX IF NOT EXISTS idx_songs_title ON songs(title COLLATE NOCASE);
+        CREATE INDEX IF NOT EXISTS idx_songs_id ON songs(id);
+    """)
+    # One index per commonly filtered or sorted column, so range filters and sorts on them seek instead of scanning
+    existing = {row[1] for row in conn.execute("PRAGMA table_info(songs)")}
+    for column in get_config().get('indexed_columns', DEFAULT_INDEXED_COLUMNS):
+        if column in existing:
+            conn.execute(f'CREATE INDEX IF NOT EXISTS "idx_songs_{column}" ON songs("{column}")')
+    # Covering indexes for common ?fields= projections, so those queries are answered from the index alone
+    for columns in get_config().get('covering_indexes', DEFAULT_COVERING_INDEXES):
+        if all(column in existing for column in columns):
+            conn.execute(f'CREATE INDEX IF NOT EXISTS "{covering_index_name(columns)}" ON songs({_covering_columns(columns)})')
+    # Sampled statistics, so the query planner can choose between the indexes when several filters are combined
+    conn.execute("PRAGMA analysis_limit = 1000")
+    conn.execute("ANALYZE")
+    conn.commit()
+
+# Turn a free-text title search into an FTS5 query
+# Every word becomes a quoted prefix term, so "love st" matches "Love Story" and the user's input can't inject FTS syntax
+def fts_query(text):
+    tokens = re.findall(r"\w+", text)
+    return " ".join(f'"{token}"*' for token in tokens)
+
+@timed(rows=len)
+def fetch_song_by_id(song_id, exact=False, fragments=False, columns=None):
+    # Fetch songs by their title
+    # By default this is a ranked full-text search on the title words (prefix and token matching),
+    # and with exact=True it is a case-insensitive exact title match on the B-tree index
+    # With fragments=True (and a song_json table) the rows hold the song's rowid, rating and stored JSON (head and tail)
+    # instead of its columns, and with 'columns' (a ?fields= projection) they hold only those columns
+    logger.info(f"Fetching song with ID {song_id} (exact={exact})")
+    shards = _shards()
+    if shards:
+        return _search_shards(song_id, exact, fragments, columns, shards)
+    with connection() as conn:
+        return _search(conn, song_id, exact, fragments, columns)[0]
+
+# Run a title search on one database, returning the rows and whether they are ordered by search rank
+# With merge=True (for the sharded layout) the rows also get the columns the shards' results are merged on:
+# "search_rowid", and "search_rank" for full-text matches
+def _search(conn, song_id, exact, fragments, projection=None, merge=False):
+    join = ""
+    if projection is not None:
+        columns = ", ".join(f'songs."{column}"' for column in projection)
+    elif fragments and has_song_json(conn):
+        columns = "songs.rowid, songs.rating, j.head, j.tail"
+        join = " LEFT JOIN song_json j ON j.song_rowid = songs.rowid"
+    else:
+        columns = "songs.*"
+    if merge:
+        columns += ", songs.rowid AS search_rowid"
+    if exact:
+        query = f"SELECT {columns} FROM songs{join} WHERE title = ? COLLATE NOCASE"
+        return conn.execute(query, (song_id,)).fetchall(), False
+    match = fts_query(song_id)
+    if match:
+        try:
+            rank = ", songs_fts.rank AS search_rank" if merge else ""
+            query = (
+                f"SELECT {columns}{rank} FROM songs_fts JOIN songs ON songs.rowid = songs_fts.rowid{join} "
+                "WHERE songs_fts MATCH ? ORDER BY songs_fts.rank"
             )
-            conn.commit()
-            return cursor.rowcount  # Returns number of rows updated
+            return conn.execute(query, (match,)).fetchall(), True
+        except sqlite3.OperationalError as e:
+            # Databases ingested before the search index existed don't have songs_fts yet
+            logger.warning(f"Title search index unavailable, falling back to LIKE: {e}")
+    # Fetching a song by ID is a SELECT query with a WHERE clause
+    query = f"SELECT {columns} FROM songs{join} WHERE title LIKE ?"
+    return conn.execute(query,(f"%{song_id}%",)).fetchall(), False
+
+# Run a title search on every shard and merge the matches: ranked matches by rank, the others in rowid order
+# Each shard ranks its matches against its own titles, so with very unevenly filled shards the order of matches with
+# close ranks can differ from the single-file layout. The rows are returned as dictionaries, without the merge columns
+def _search_shards(song_id, exact, fragments, projection, shards):
+    results = _each_shard(lambda conn: _search(conn, song_id, exact, fragments, projection, merge=True), shards)
+    rows = list(itertools.chain.from_iterable(rows for rows, _ in results))
+    if any(ranked for _, ranked in results):
+        rows.sort(key=lambda row: (row["search_rank"], row["search_rowid"]))
+    else:
+        rows.sort(key=lambda row: row["search_rowid"])
+    merge_columns = ("search_rowid", "search_rank")
+    return [{column: row[column] for column in row.keys() if column not in merge_columns} for row in rows]
+
+
+# Fetch songs by their rowids in a single query, returning a dictionary of rowid -> row
+# In the sharded layout the rowids are looked up on every shard at once
+@timed(rows=len)
+def fetch_songs_by_rowid(rowids):
+    if not rowids:
+        return {}
+    placeholders = ", ".join("?" for _ in rowids)
+    read = lambda conn: conn.execute(f"SELECT rowid, * FROM songs WHERE rowid IN ({placeholders})", list(rowids)).fetchall()
+    shards = _shards()
+    if shards:
+        rows = itertools.chain.from_iterable(_each_shard(read, shards))
+    else:
+        with connection() as conn:
+            rows = read(conn)
+    return {row["rowid"]: row for row in rows}
+
+
+# The rowid of the song with the given ID, or None if there is no such song
+# A seek on idx_songs_id; in the sharded layout only the shard that holds the song is read
+@timed()
+def fetch_rowid_by_id(song_id):
+    with connection(_shard_for(song_id)) as conn:
+        row = conn.execute("SELECT rowid FROM songs WHERE id = ? ORDER BY rowid LIMIT 1", (song_id,)).fetchone()
+    return row[0] if row else None
+
+
+# Fetch the current rating and rating stats of the songs with rowids first to last, as a dictionary keyed by rowid
+# Used with the columnar snapshot (see snapshot.py), which holds everything but the ratings
+# With fragments=True (and a song_json table) the rows also hold each song's stored JSON (head and tail)
+@timed(rows=len)
+def fetch_ratings_between(first, last, fragments=False):
+    def read(conn):
+        try:
+            if fragments and has_song_json(conn):
+                query = SONG_JSON_WITH_STATS.format(sort_columns="")
+            else:
+                query = (
+                    "SELECT songs.rowid, songs.rating, r.count AS rating_count, r.mean AS rating_mean, "
+                    + ", ".join(f"r.{column} AS rating_{column}" for column in _HIST_COLUMNS)
+                    + " FROM songs LEFT JOIN rating_stats r ON r.song_id = songs.id"
+                )
+            return conn.execute(f"{query} WHERE songs.rowid BETWEEN ? AND ?", (first, last)).fetchall()
+        except sqlite3.OperationalError as e:
+            if "no such table" not in str(e):
+                raise
+            return conn.execute("SELECT rowid, rating FROM songs WHERE rowid BETWEEN ? AND ?", (first, last)).fetchall()
+
+    shards = _shards()
+    if shards:
+        rows = itertools.chain.from_iterable(_each_shard(read, shards))
+    else:
+        with connection() as conn:
+            rows = read(conn)
+    return {row["rowid"]: row for row in rows}
+
+
+# The data version is a counter stored in the database that goes up every time the catalog changes,
+# through a rating update or an ingestion. Anything derived from the songs table (like cached API responses)
+# records the version it was built from, and is stale as soon as the version moves on.
+# Keeping it in the database means every API process sees writes made by the others
+def get_data_version():
+    return _get_version('data_version')
+
+# The catalog version only moves on when an ingestion changes the songs themselves, not on rating updates,
+# so files derived from the song features (like the similarity index) can tell whether they are still current
+def get_catalog_version():
+    return _get_version('catalog_version')
+
+# In the sharded layout each shard keeps its own counters, moved on by the writes to that shard, and the version of
+# the catalog is their sum
+@timed()
+def _get_version(key):
+    def read(conn):
+        try:
+            row = conn.execute("SELECT value FROM catalog_meta WHERE key = ?", (key,)).fetchone()
+        except sqlite3.OperationalError:
+            # Databases ingested before the counter existed
+            return 0
+        return row[0] if row else 0
+
+    shards = _shards()
+    if shards:
+        return sum(_each_shard(read, shards))
+    with connection() as conn:
+        return read(conn)
+
+# Increase the data version, as part of the caller's write transaction
+# Ingestions pass catalog=True, which increases the catalog version as well
+def bump_data_version(conn, catalog=False):
+    conn.execute("CREATE TABLE IF NOT EXISTS catalog_meta (key TEXT PRIMARY KEY, value INTEGER)")
+    for key in ('data_version', 'catalog_version') if catalog else ('data_version',):
+        conn.execute(
+            "INSERT INTO catalog_meta (key, value) VALUES (?, 1) "
+            "ON CONFLICT (key) DO UPDATE SET value = value + 1",
+            (key,),
+        )
+
+# Ratings are kept as an append-only log in the ratings table, one row per rating given through the API.
+# rating_stats holds the running count, sum, mean and histogram of each song's ratings; the ratings_stats_insert
+# trigger folds every new rating into it as it is written, so reads never have to aggregate the log.
+# The histogram has one bucket per whole star: hist_0 counts ratings in [0, 1), ..., hist_4 those in [4, 5), hist_5 the 5s.
+# The trigger also copies the new mean into songs.rating, so that column is the song's average rating
+RATING_BUCKETS = 6
+_HIST_COLUMNS = [f"hist_{bucket}" for bucket in range(RATING_BUCKETS)]
+
+# The rating stats columns of a listing, and the join that brings them in
+_STATS_COLUMNS = (
+    ", r.count AS rating_count, r.mean AS rating_mean, "
+    + ", ".join(f"r.{column} AS rating_{column}" for column in _HIST_COLUMNS)
+)
+_STATS_JOIN = " FROM songs LEFT JOIN rating_stats r ON r.song_id = songs.id"
+
+# The songs query used for listing, with each song's rating stats joined on
+SONGS_WITH_STATS = "SELECT songs.rowid, songs.*" + _STATS_COLUMNS + _STATS_JOIN
+
+# The listing query with each song's pre-encoded JSON (see encoding.py) in place of its columns
+# Songs whose JSON hasn't been stored get NULL head and tail
+SONG_JSON_WITH_STATS = (
+    "SELECT songs.rowid, songs.rating, j.head, j.tail, r.count AS rating_count, r.mean AS rating_mean, "
+    + ", ".join(f"r.{column} AS rating_{column}" for column in _HIST_COLUMNS)
+    + "{sort_columns} FROM songs LEFT JOIN song_json j ON j.song_rowid = songs.rowid "
+    "LEFT JOIN rating_stats r ON r.song_id = songs.id"
+)
+
+# rating_summary keeps running totals over the whole catalog for GET /stats/songs (see stats.py), so that endpoint
+# never scans the table: the "songs" row summarizes songs.rating (the songs' average ratings) and the "ratings" row
+# every rating in the log. Each row has the count, sum and sum of squares of the values, and a histogram with
+# half-star bins: bin_0 counts values in [0, 0.5), ..., bin_9 those in [4.5, 5].
+# The ratings_summary_insert trigger adds every new rating, and songs_rating_summary moves a song's old average out
+# and its new one in whenever songs.rating changes. Ingestions, which insert and delete songs without the triggers,
+# recompute both rows with refresh_rating_summary()
+RATING_SUMMARY_BINS = 10
+_BIN_COLUMNS = [f"bin_{index}" for index in range(RATING_SUMMARY_BINS)]
+
+# SQL for the histogram bin of a rating, NULL when there is no rating
+def _summary_bin(value):
+    return f"MIN(CAST({value} * {RATING_SUMMARY_BINS / 5} AS INTEGER), {RATING_SUMMARY_BINS - 1})"
+
+# SQL for the change of a running total when a song's rating goes from old.rating to new.rating
+# 'term' maps a rating expression to its contribution, with NULL (no rating) contributing nothing
+def _summary_change(term):
+    return f"IFNULL({term('new.rating')}, 0) - IFNULL({term('old.rating')}, 0)"
+
+# The aggregations over a column of ratings that make up a rating_summary row
+def _summary_columns(column):
+    return (f"COUNT({column}), IFNULL(SUM({column}), 0), IFNULL(SUM({column} * {column}), 0), "
+            + ", ".join(f"IFNULL(SUM({_summary_bin(column)} = {index}), 0)" for index in range(RATING_SUMMARY_BINS)))
+
+RATINGS_SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS ratings ("
+    "id INTEGER PRIMARY KEY, song_id TEXT NOT NULL, rating REAL NOT NULL, created_at REAL)",
+    "CREATE INDEX IF NOT EXISTS idx_ratings_song ON ratings(song_id)",
+    "CREATE TABLE IF NOT EXISTS rating_stats ("
+    "song_id TEXT PRIMARY KEY, count INTEGER NOT NULL, sum REAL NOT NULL, mean REAL, "
+    + ", ".join(f"{column} INTEGER NOT NULL DEFAULT 0" for column in _HIST_COLUMNS) + ")",
+    "CREATE TRIGGER IF NOT EXISTS ratings_stats_insert AFTER INSERT ON ratings BEGIN "
+    f"INSERT INTO rating_stats (song_id, count, sum, mean, {', '.join(_HIST_COLUMNS)}) "
+    "VALUES (new.song_id, 1, new.rating, new.rating, "
+    + ", ".join(f"CAST(new.rating AS INTEGER) = {bucket}" for bucket in range(RATING_BUCKETS)) + ") "
+    "ON CONFLICT (song_id) DO UPDATE SET count = count + 1, sum = sum + excluded.sum, "
+    "mean = (sum + excluded.sum) / (count + 1), "
+    + ", ".join(f"{column} = {column} + excluded.{column}" for column in _HIST_COLUMNS) + "; "
+    "UPDATE songs SET rating = (SELECT mean FROM rating_stats WHERE song_id = new.song_id) WHERE id = new.song_id; "
+    "END",
+    "CREATE TABLE IF NOT EXISTS rating_summary ("
+    "name TEXT PRIMARY KEY, count INTEGER NOT NULL, sum REAL NOT NULL, sum_squares REAL NOT NULL, "
+    + ", ".join(f"{column} INTEGER NOT NULL" for column in _BIN_COLUMNS) + ")",
+    "CREATE TRIGGER IF NOT EXISTS ratings_summary_insert AFTER INSERT ON ratings BEGIN "
+    "UPDATE rating_summary SET count = count + 1, sum = sum + new.rating, "
+    "sum_squares = sum_squares + new.rating * new.rating, "
+    + ", ".join(f"{column} = {column} + ({_summary_bin('new.rating')} = {index})"
+                for index, column in enumerate(_BIN_COLUMNS))
+    + " WHERE name = 'ratings'; END",
+    "CREATE TRIGGER IF NOT EXISTS songs_rating_summary AFTER UPDATE OF rating ON songs "
+    "WHEN old.rating IS NOT new.rating BEGIN "
+    "UPDATE rating_summary SET "
+    f"count = count + {_summary_change(lambda value: f'{value} IS NOT NULL')}, "
+    f"sum = sum + {_summary_change(lambda value: value)}, "
+    f"sum_squares = sum_squares + {_summary_change(lambda value: f'{value} * {value}')}, "
+    + ", ".join(f"{column} = {column} + {_summary_change(lambda value: f'({_summary_bin(value)} = {index})')}"
+                for index, column in enumerate(_BIN_COLUMNS))
+    + " WHERE name = 'songs'; END",
+]
+
+# Create the ratings tables and trigger if they don't exist yet, as part of the caller's transaction
+def create_ratings_tables(conn):
+    for statement in RATINGS_SCHEMA:
+        conn.execute(statement)
+
+# Recompute both rows of rating_summary from the songs table and the ratings log, as part of the caller's transaction
+# Called after ingestions and rating rebuilds, which change ratings in bulk
+def refresh_rating_summary(conn):
+    conn.execute("DELETE FROM rating_summary")
+    conn.execute(f"INSERT INTO rating_summary SELECT 'songs', {_summary_columns('rating')} FROM songs")
+    conn.execute(f"INSERT INTO rating_summary SELECT 'ratings', {_summary_columns('rating')} FROM ratings")
+
+# Copy the mean ratings into songs rows that have none, e.g. after the songs table was rewritten by an ingestion
+def restore_song_ratings(conn):
+    conn.execute(
+        "UPDATE songs SET rating = (SELECT mean FROM rating_stats WHERE song_id = songs.id) "
+        "WHERE rating IS NULL AND id IN (SELECT song_id FROM rating_stats)"
+    )
+
+# Append one rating to the log, returning 1 if the song exists and 0 otherwise
+# Databases from before the ratings log get its tables on the first rating
+def _insert_rating(conn, song_id, rating, now):
+    query = "INSERT INTO ratings (song_id, rating, created_at) SELECT id, ?, ? FROM songs WHERE id = ? LIMIT 1"
+    try:
+        return conn.execute(query, (rating, now, song_id)).rowcount
+    except sqlite3.OperationalError as e:
+        if "no such table" not in str(e):
+            raise
+        create_ratings_tables(conn)
+        refresh_rating_summary(conn)
+        return conn.execute(query, (rating, now, song_id)).rowcount
+
+# Whether a write failed because an ingestion swapped in a new version of the database while it waited for its lock
+# (see shadow.py): the old version refuses new ratings, or SQLite refuses writes to a plain file that was replaced.
+# Such a write is made again, once, on the new version
+def _retired(error):
+    return RETIRED_MESSAGE in str(error) or "readonly database" in str(error)
+
+@timed()
+def update_rating(song_id, rating):
+    # Record a new rating for a song by its ID
+    # In the sharded layout only the shard that holds the song is written
+    logger.info(f"Adding rating {rating} for song ID {song_id}")
+    for attempt in range(2):
+        try:
+            with connection(_shard_for(song_id)) as conn:
+                # The rating is appended to the log, and the trigger updates the song's running stats
+                count = _insert_rating(conn, song_id, rating, time.time())
+                # Only an actual change moves the data version on
+                if count > 0:
+                    bump_data_version(conn)
+                conn.commit()
+                return count  # Returns number of songs rated
+        except sqlite3.DatabaseError as e:
+            if attempt == 0 and _retired(e):
+                logger.info("The database version was replaced, writing the rating to the new one")
+                continue
+            logger.error(f"Failed to update rating: {e}")
+            raise
+        except Exception as e:
+            logger.error(f"Failed to update rating: {e}")
+            raise
+
+# Record the ratings of many songs in a single transaction
+# 'ratings' is a list of (song_id, rating) pairs, applied in order, and the result holds the number of songs rated
+# for each pair, so callers can report per item whether the song exists. One commit (and one fsync) covers the whole batch
+# In the sharded layout the ratings are grouped by shard and every shard commits its own group, in parallel
+# A group whose version was replaced while it waited (see _retired) is written again on the new version, regrouped
+# for its layout, while the groups that were committed before the swap are already in the new version
+@timed()
+def update_ratings(ratings):
+    logger.info(f"Adding {len(ratings)} ratings in one transaction")
+    now = time.time()
+
+    def write(conn, items):
+        counts = [_insert_rating(conn, song_id, rating, now) for song_id, rating in items]
+        if any(counts):
+            bump_data_version(conn)
+        conn.commit()
+        return counts
+
+    try:
+        counts = [0] * len(ratings)
+        pending = list(enumerate(ratings))
+        for attempt in range(2):
+            shards = _shards()
+            groups = {}
+            for position, (song_id, rating) in pending:
+                path = shards[shard_of(song_id, len(shards))] if shards else None
+                groups.setdefault(path, []).append((position, song_id, rating))
+
+            def write_group(path):
+                try:
+                    with connection(path) as conn:
+                        return write(conn, [(song_id, rating) for _, song_id, rating in groups[path]])
+                except sqlite3.DatabaseError as e:
+                    if attempt == 0 and _retired(e):
+                        return None
+                    raise
+
+            pending = []
+            for path, group_counts in zip(groups, fan_out(write_group, list(groups), get_config())):
+                if group_counts is None:
+                    pending.extend((position, (song_id, rating)) for position, song_id, rating in groups[path])
+                    continue
+                for (position, _, _), count in zip(groups[path], group_counts):
+                    counts[position] = count
+            if not pending:
+                break
+            logger.info(f"The database version was replaced, writing {len(pending)} ratings to the new one")
+        return counts
     except Exception as e:
-        logger.error(f"Failed to update rating: {e}")
+        logger.error(f"Failed to update ratings: {e}")
         raise
+
+# Recompute every song's rating stats from the ratings log
+# Ratings stored in songs.rating before the log existed are first backfilled into it as one rating each,
+# then rating_stats is rebuilt with a single aggregation and the means are copied back into songs.rating
+# Returns the number of songs with ratings
+def rebuild_rating_stats():
+    logger.info("Rebuilding rating stats from the ratings log")
+    shards = _shards()
+    if shards:
+        # Every shard holds the ratings of its own songs
+        return sum(_each_shard(_rebuild_rating_stats, shards))
+    with connection() as conn:
+        return _rebuild_rating_stats(conn)
+
+def _rebuild_rating_stats(conn):
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        create_ratings_tables(conn)
+        conn.execute(
+            "INSERT INTO ratings (song_id, rating, created_at) SELECT id, rating, NULL FROM songs "
+            "WHERE rating IS NOT NULL AND NOT EXISTS (SELECT 1 FROM ratings WHERE ratings.song_id = songs.id)"
+        )
+        conn.execute("DELETE FROM rating_stats")
+        buckets = ", ".join(f"SUM(CAST(rating AS INTEGER) = {bucket})" for bucket in range(RATING_BUCKETS))
+        conn.execute(
+            f"INSERT INTO rating_stats (song_id, count, sum, mean, {', '.join(_HIST_COLUMNS)}) "
+            f"SELECT song_id, COUNT(*), SUM(rating), AVG(rating), {buckets} FROM ratings GROUP BY song_id"
+        )
+        conn.execute("UPDATE songs SET rating = (SELECT mean FROM rating_stats WHERE song_id = songs.id)")
+        refresh_rating_summary(conn)
+        rated = conn.execute("SELECT COUNT(*) FROM rating_stats").fetchone()[0]
+        bump_data_version(conn)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return rated
+
+# The running rating totals for GET /stats/songs: the "songs" and "ratings" rows of rating_summary as lists of
+# [count, sum, sum of squares, bin counts...], and the lowest and highest song rating, which are two seeks on the
+# rating index rather than running totals, since a total can't tell what the next lowest rating is
+# Databases without the summary table (ingested before it existed) have the totals aggregated on the fly
+# In the sharded layout the totals of the shards are added up
+@timed()
+def fetch_rating_summary():
+    def read(conn):
+        try:
+            rows = {row[0]: list(row[1:]) for row in conn.execute(
+                f"SELECT name, count, sum, sum_squares, {', '.join(_BIN_COLUMNS)} FROM rating_summary")}
+        except sqlite3.OperationalError:
+            rows = {}
+        if "songs" not in rows:
+            rows["songs"] = list(conn.execute(f"SELECT {_summary_columns('rating')} FROM songs").fetchone())
+        if "ratings" not in rows:
+            try:
+                rows["ratings"] = list(conn.execute(f"SELECT {_summary_columns('rating')} FROM ratings").fetchone())
+            except sqlite3.OperationalError:
+                rows["ratings"] = [0, 0.0, 0.0] + [0] * RATING_SUMMARY_BINS
+        # MIN and MAX in separate queries, so each is a single seek on the index
+        rows["min"] = conn.execute("SELECT MIN(rating) FROM songs").fetchone()[0]
+        rows["max"] = conn.execute("SELECT MAX(rating) FROM songs").fetchone()[0]
+        return rows
+
+    shards = _shards()
+    if not shards:
+        with connection() as conn:
+            return read(conn)
+    parts = _each_shard(read, shards)
+    lows = [part["min"] for part in parts if part["min"] is not None]
+    highs = [part["max"] for part in parts if part["max"] is not None]
+    return {
+        "songs": [sum(values) for values in zip(*(part["songs"] for part in parts))],
+        "ratings": [sum(values) for values in zip(*(part["ratings"] for part in parts))],
+        "min": min(lows) if lows else None,
+        "max": max(highs) if highs else None,
+    }
@@ -0,0 +1,133 @@
+import functools
+import json
+import logging
+
+'''
+JSON encoding of the API responses.
+Ingestion stores every song pre-encoded in the song_json table, so GET /songs and GET /songs/<song_name> can build
+their responses by joining bytes instead of turning each row into a dict and encoding it again. The rating fields
+change with every rating given through the API, so they are left out of the stored JSON: each song is kept as a head
+(the columns that sort before "rating") and a tail (those after it), and the rating - plus the "ratings" summary in
+listings - is encoded and put in between when the response is built. Rating updates therefore never rewrite the
+stored JSON, and the result is byte for byte what jsonify produces for the same song (sorted keys, no spaces,
+non-ASCII characters escaped).
+Responses that aren't built from stored songs go through the encoder named by "json_encoder" in config.json: "json"
+(the default) is the standard library encoder with jsonify's settings, and "orjson" is faster but writes non-ASCII
+characters as UTF-8 and very small or large numbers without an exponent, so its bytes (and ETags) differ.
+'''
+
+'''
+The comments are in greater detail to explain each step of the code
+'''
+
+logger = logging.getLogger("api_logger")
+
+# Songs encoded per batch when filling the song_json table
+FRAGMENT_BATCH = 10000
+
+# The standard library encoder with the settings jsonify uses outside debug mode
+_encoder = json.JSONEncoder(ensure_ascii=True, sort_keys=True, separators=(",", ":"))
+
+
+# Encode a value the way jsonify does, without the trailing newline
+def dumps(value):
+    return _encoder.encode(value).encode()
+
+
+# Split the columns of a song row into those that sort before the rating fields and those that sort after them,
+# as lists of positions in the row; the rowid isn't part of the JSON
+def split_columns(columns):
+    columns = [None if column == "rowid" else column for column in columns]
+    head = [index for index, column in enumerate(columns) if column is not None and column < "rating"]
+    tail = [index for index, column in enumerate(columns) if column is not None and column > "ratings"]
+    return head, tail
+
+
+# The stored JSON of one song: the head ('{"acousticness":...,' up to just before "rating") and the tail
+# (',"tempo":...}' from just after it), as bytes
+def encode_fragments(columns, row, head, tail):
+    first = dumps({columns[index]: row[index] for index in head})
+    last = dumps({columns[index]: row[index] for index in tail})
+    return first[:-1] + (b"," if head else b""), (b"," if tail else b"") + last[1:]
+
+
+# The JSON of one song from its head and tail, with its rating and (for listings) the encoded ratings summary
+def song_json(head, tail, rating, ratings=None):
+    middle = b'"rating":' + (b"null" if rating is None else dumps(rating))
+    if ratings is not None:
+        middle += b',"ratings":' + ratings
+    return head + middle + tail
+
+
+# The body of a listing: 'payload' holds every key but "data", which sorts before all of them and is filled with
+# the already encoded songs
+def encode_page(payload, songs):
+    rest = dumps(payload)
+    return b'{"data":[' + b",".join(songs) + b"]" + (b"," + rest[1:] if payload else b"}") + b"\n"
+
+
+# The body of a list of already encoded songs
+def encode_list(songs):
+    return b"[" + b",".join(songs) + b"]\n"
+
+
+# Create the song_json table and encode every song that isn't in it yet, as part of ingestion
+# The triggers drop a song's stored JSON when the song is deleted or any of its columns other than the rating change,
+# so after an incremental ingestion only the new and changed songs are encoded again. rebuild=True starts over,
+# for a freshly written songs table. Returns the number of songs encoded
+def build_fragments(conn, rebuild=True):
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(songs)")]
+    watched = ", ".join(f'"{column}"' for column in columns if column != "rating")
+    conn.execute("BEGIN")
+    try:
+        if rebuild:
+            conn.execute("DROP TABLE IF EXISTS song_json")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS song_json (song_rowid INTEGER PRIMARY KEY, head BLOB NOT NULL, tail BLOB NOT NULL)"
+        )
+        conn.execute(
+            "CREATE TRIGGER IF NOT EXISTS song_json_delete AFTER DELETE ON songs BEGIN "
+            "DELETE FROM song_json WHERE song_rowid = old.rowid; END"
+        )
+        conn.execute(
+            f"CREATE TRIGGER IF NOT EXISTS song_json_update AFTER UPDATE OF {watched} ON songs BEGIN "
+            "DELETE FROM song_json WHERE song_rowid = old.rowid; END"
+        )
+        cursor = conn.execute(
+            "SELECT songs.rowid, songs.* FROM songs "
+            "WHERE NOT EXISTS (SELECT 1 FROM song_json j WHERE j.song_rowid = songs.rowid)"
+        )
+        names = [description[0] for description in cursor.description]
+        head, tail = split_columns(names)
+        encoded = 0
+        while True:
+            rows = cursor.fetchmany(FRAGMENT_BATCH)
+            if not rows:
+                break
+            conn.executemany(
+                "INSERT INTO song_json VALUES (?, ?, ?)",
+                [(row[0],) + encode_fragments(names, row, head, tail) for row in rows],
+            )
+            encoded += len(rows)
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    return encoded
+
+
+# The response encoder called 'name' - a function from a payload to the response body, ending in a newline like
+# jsonify's. An unknown name, or "orjson" when it isn't installed, falls back to the standard library encoder
+@functools.lru_cache(maxsize=None)
+def get_encoder(name="json"):
+    if name == "orjson":
+        try:
+            import orjson
+        except ImportError:
+            logger.warning("orjson is not installed, using the standard library JSON encoder")
+        else:
+            options = orjson.OPT_SORT_KEYS | orjson.OPT_APPEND_NEWLINE
+            return lambda payload: orjson.dumps(payload, option=options)
+    elif name != "json":
+        logger.warning(f"Unknown json_encoder '{name}', using the standard library JSON encoder")
+    return lambda payload: _encoder.encode(payload).encode() + b"\n"
@@ -0,0 +1,74 @@
+import csv
+import io
+import json
+import os
+import zlib
+
+from db import iter_songs
+from schema import SONG_COLUMNS
+
+'''
+Bulk export of the songs table as NDJSON (one JSON object per line) or CSV, used by GET /export/songs and by
+"python main.py export", which writes it to a file (the output_path in config.json by default).
+The songs are read with a single query whose rows are fetched in batches, and every batch is encoded and handed on
+as soon as it is read, so the first bytes go out straight away and memory use doesn't depend on the size of the catalog.
+With gzip each batch is compressed and flushed on its own, so a compressed export streams just the same.
+'''
+
+'''
+The comments are in greater detail to explain each step of the code
+'''
+
+# Content type of each export format
+EXPORT_FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv; charset=utf-8",
+}
+
+
+# Encode one batch of rows (rowid followed by the songs columns) in an export format
+def encode_rows(rows, format):
+    if format == "ndjson":
+        return "".join(
+            json.dumps(dict(zip(SONG_COLUMNS, row[1:])), separators=(",", ":")) + "\n" for row in rows
+        ).encode("utf-8")
+    buffer = io.StringIO()
+    csv.writer(buffer, lineterminator="\n").writerows(row[1:] for row in rows)
+    return buffer.getvalue().encode("utf-8")
+
+
+# The export as a sequence of byte chunks, one per batch of rows
+# The CSV header is only written for an export that starts at the beginning, so a resumed export can be appended
+# to what was already received; 'stats' (if given) counts the rows and bytes produced
+def export_chunks(format="ndjson", filters=(), after=None, header=True, compress=False, batch_size=1000, stats=None):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+    stats = stats if stats is not None else {}
+    stats.update(rows=0, bytes=0)
+
+    def output(chunk):
+        if compressor is not None:
+            chunk = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        stats["bytes"] += len(chunk)
+        return chunk
+
+    if format == "csv" and header:
+        yield output((",".join(SONG_COLUMNS) + "\n").encode("utf-8"))
+    for rows in iter_songs(filters, after, batch_size):
+        stats["rows"] += len(rows)
+        yield output(encode_rows(rows, format))
+    if compressor is not None:
+        tail = compressor.flush()
+        stats["bytes"] += len(tail)
+        yield tail
+
+
+# Write an export to a file, returning the number of rows and bytes written
+# The file is written under a temporary name and renamed into place once complete
+def export_to_file(path, format="ndjson", filters=(), compress=False, batch_size=1000):
+    stats = {}
+    temporary = f"{path}.tmp"
+    with open(temporary, "wb") as file:
+        for chunk in export_chunks(format, filters, compress=compress, batch_size=batch_size, stats=stats):
+            file.write(chunk)
+    os.replace(temporary, path)
+    return stats["rows"], stats["bytes"]
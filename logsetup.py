@@ -0,0 +1,98 @@
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+
+'''
+Logging setup shared by the API, database and ingestion modules.
+The modules only look their logger up by name when they are imported; nothing is attached to it until the entry point
+(main.py, or api.py / dataParsing.py / asgi.py run on their own) calls configure_logging() once at startup. So importing
+a module opens no log files, and a process that never logs doesn't pay for the handlers.
+A configured logger gets a QueueHandler, which only puts each record on an in-memory queue. One background thread (a
+QueueListener) takes the records off the queue and writes them to the log file and to the console, so a request thread
+never waits on file or terminal I/O to log a line.
+'''
+
+'''
+The comments are in greater detail to explain each step of the code
+'''
+
+_queue = queue.SimpleQueue()
+_handlers = []
+_listener = None
+_formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+
+
+# Hands the queued records of each logger to that logger's own handlers, so every logger keeps its own file
+class _LoggerRouter:
+    def __init__(self):
+        self.handlers = {}
+
+    def handle(self, record):
+        for handler in self.handlers.get(record.name, ()):
+            if record.levelno >= handler.level:
+                handler.handle(record)
+
+
+_router = _LoggerRouter()
+
+
+# Writes to whatever sys.stderr is when the record is written, rather than the stream at the time it was configured,
+# so logging keeps working when stderr is swapped out (as pytest does while capturing output)
+class _StderrHandler(logging.StreamHandler):
+    @property
+    def stream(self):
+        return sys.stderr
+
+    @stream.setter
+    def stream(self, value):
+        pass
+
+
+# Configure a named logger that logs INFO and above to logs/<filename> and to the console, through the queue
+# Calling it again for the same logger doesn't add more handlers
+def get_logger(name, filename):
+    global _listener
+    logger = logging.getLogger(name)
+    logger.setLevel(logging.INFO)
+    # The queue handler is the only way out, so nothing is written again (on the calling thread) by the root logger
+    logger.propagate = False
+    if name in _router.handlers:
+        return logger
+    # Ensure the logs directory exists
+    os.makedirs('logs', exist_ok=True)
+    file_handler = logging.FileHandler(os.path.join('logs', filename))
+    stream_handler = _StderrHandler()
+    for handler in (file_handler, stream_handler):
+        handler.setFormatter(_formatter)
+    _router.handlers[name] = [file_handler, stream_handler]
+    logger.addHandler(logging.handlers.QueueHandler(_queue))
+    if _listener is None:
+        _listener = logging.handlers.QueueListener(_queue, _router)
+        _listener.start()
+        atexit.register(stop)
+    return logger
+
+
+# The log file of every logger of the project, in logs/
+LOG_FILES = {
+    "api_logger": "api.log",
+    "db_logger": "db.log",
+    "dataParsing_logger": "dataParsing.log",
+}
+
+
+# Configure every logger in LOG_FILES; calling it again changes nothing
+def configure_logging():
+    for name, filename in LOG_FILES.items():
+        get_logger(name, filename)
+
+
+# Write out the records still on the queue and stop the background thread
+def stop():
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -1,20 +1,160 @@
-import subprocess
+import argparse
+import sys
+import time
 
-def run_data_parsing():
-    subprocess.run(["python", "dataParsing.py"], check=True)
+from logsetup import configure_logging
 
-def run_api():
-    subprocess.run(["python", "api.py"], check=True)
+'''
+Entry point of the project. Every command runs in this process, and imports only the modules it needs when it runs:
+"serve" never loads pandas, and no command pays for the ingestion dependencies unless it ingests. Logging is
+configured once here, before the command runs.
+"python main.py ingest" validates the input file and loads it into the database, with the input_path, chunk_size and
+workers of config.json unless --input, --chunk-size and --workers are given (--stream, --upsert and --delete-missing
+as in dataParsing.py). "python main.py serve" starts the API on a production server instead of Flask's development
+server, with the host, port, threads and workers taken from the "server" section of config.json unless they are given
+on the command line, and "python main.py dev" runs it on Flask's development server with the debugger.
+"python main.py rebuild-ratings" recomputes the per-song rating stats from the ratings log. "python main.py export"
+writes the catalog (or the songs matching --where range filters) to a file as NDJSON or CSV, to the output_path of
+config.json unless --output is given.
+Run without a command from a terminal it shows the interactive menu; without a terminal (cron, containers) it prints
+the usage and exits with an error instead of waiting for input.
+'''
+
+
+# Validate the input file and load it into the database (see dataParsing.py)
+def run_ingest(args):
+    from dataParsing import ingest
+    ingest(args.input, args.stream, args.chunk_size, args.workers, args.upsert, args.delete_missing)
+
+
+# Run the API on Flask's development server, with the debugger
+# The reloader restarts this command in a new process, so it is left off when the API is started from the menu
+def run_dev(reload=True):
+    from api import app
+    app.run(debug=True, use_reloader=reload)
+
+
+# Read the "server" section of config.json
+def load_server_config(path='config.json'):
+    from db import get_config
+    return get_config(path).get('server', {})
+
+
+# Write the catalog to a file
+# The format comes from --format or the file extension (.csv, otherwise NDJSON), and a .gz extension turns on gzip
+def export_catalog(args):
+    from werkzeug.datastructures import MultiDict
+    from api import ApiError, parse_filters
+    from db import get_config
+    from export import export_to_file
+    config = get_config()
+    output = args.output or config.get('output_path', 'data/playlist.csv')
+    name = output[:-3] if output.endswith(".gz") else output
+    format = args.format or ("csv" if name.endswith(".csv") else "ndjson")
+    # --where energy_gte=0.7 takes the same range filters as GET /songs
+    try:
+        filters = parse_filters(MultiDict(where.split("=", 1) for where in args.where if "=" in where))
+    except ApiError as e:
+        sys.exit(e.message)
+    start_time = time.perf_counter()
+    rows, size = export_to_file(output, format, filters, compress=args.gzip or output.endswith(".gz"),
+                                batch_size=config.get('export_batch_size', 1000))
+    print(f"Exported {rows} songs to {output} ({size} bytes) in {time.perf_counter() - start_time:.2f}s")
+
+
+# Serve the Flask app with waitress, a multi-threaded WSGI server
+# Without waitress installed this falls back to werkzeug's threaded server, still without the debugger and reloader
+def serve_wsgi(host, port, threads):
+    from api import app
+    try:
+        from waitress import serve
+    except ImportError:
+        from werkzeug.serving import run_simple
+        print("waitress is not installed, using werkzeug's threaded server")
+        run_simple(host, port, app, threaded=True)
+        return
+    serve(app, host=host, port=port, threads=threads)
+
+
+# Serve the ASGI app from asgi.py with uvicorn, using 'workers' processes
+def serve_asgi(host, port, workers):
+    try:
+        import uvicorn
+    except ImportError:
+        sys.exit("uvicorn is required for --asgi: pip install uvicorn")
+    uvicorn.run("asgi:application", host=host, port=port, workers=workers, lifespan="on", log_level="warning")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Playlist ingestion and API")
+    commands = parser.add_subparsers(dest="command")
+    ingest = commands.add_parser("ingest", help="Validate the input file and load it into the database")
+    ingest.add_argument("--stream", action="store_true", help="read and insert the input in bounded-size chunks")
+    ingest.add_argument("--chunk-size", type=int, help="rows per chunk in streaming mode")
+    ingest.add_argument("--input", help="input file, overrides input_path in config.json (.ndjson/.jsonl for row-oriented input)")
+    ingest.add_argument("--workers", type=int, help="parse and validate on this many processes (implies --stream)")
+    ingest.add_argument("--upsert", action="store_true", help="merge into the existing songs table by id, keeping ratings")
+    ingest.add_argument("--delete-missing", action="store_true", help="with --upsert, delete songs that are not in the input")
+    serve = commands.add_parser("serve", help="Run the API on a production server")
+    serve.add_argument("--asgi", action="store_true", help="Serve the async variant (asgi.py) with uvicorn")
+    serve.add_argument("--host", help="Address to listen on")
+    serve.add_argument("--port", type=int, help="Port to listen on")
+    serve.add_argument("--threads", type=int, help="Request threads of the WSGI server")
+    serve.add_argument("--workers", type=int, help="Worker processes of the ASGI server")
+    commands.add_parser("dev", help="Run the API on Flask's development server")
+    commands.add_parser("rebuild-ratings", help="Recompute every song's rating stats from the ratings log")
+    export = commands.add_parser("export", help="Write the catalog to a file as NDJSON or CSV")
+    export.add_argument("--output", help="File to write (default: output_path from config.json)")
+    export.add_argument("--format", choices=["ndjson", "csv"], help="Export format (default: from the file extension)")
+    export.add_argument("--gzip", action="store_true", help="Compress the file with gzip (default for .gz files)")
+    export.add_argument("--where", action="append", default=[], metavar="FILTER=VALUE",
+                        help="Range filter, like energy_gte=0.7 (can be repeated)")
+    args = parser.parse_args(argv)
+    if args.command is None and not sys.stdin.isatty():
+        parser.print_usage(sys.stderr)
+        sys.exit("A command is required when not running in a terminal")
+
+    configure_logging()
+
+    if args.command == "ingest":
+        run_ingest(args)
+        return
+
+    if args.command == "dev":
+        run_dev()
+        return
+
+    if args.command == "rebuild-ratings":
+        from db import rebuild_rating_stats
+        print(f"Rebuilt rating stats for {rebuild_rating_stats()} songs")
+        return
+
+    if args.command == "export":
+        export_catalog(args)
+        return
+
+    if args.command == "serve":
+        config = load_server_config()
+        host = args.host or config.get('host', '127.0.0.1')
+        port = args.port or config.get('port', 5000)
+        if args.asgi:
+            serve_asgi(host, port, args.workers or config.get('workers', 1))
+        else:
+            serve_wsgi(host, port, args.threads or config.get('threads', 8))
+        return
 
-if __name__ == "__main__":
     print("Choose an option:")
     print("1. Ingest new data (dataParsing.py)")
     print("2. Run API (api.py)")
     choice = input("Enter a value: ")
 
     if choice == "1":
-        run_data_parsing()
+        main(["ingest"])
     elif choice == "2":
-        run_api()
+        run_dev(reload=False)
     else:
         print("Invalid choice.")
+
+
+if __name__ == "__main__":
+    main()
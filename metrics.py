@@ -0,0 +1,229 @@
+import bisect
+import collections
+import functools
+import math
+import sys
+import threading
+import time
+
+'''
+In-process metrics, served in the Prometheus text format on GET /metrics.
+Counters count things (requests, connections opened, rows read, response bytes). Histograms record durations: each
+keeps cumulative counts per bucket, a running sum and count (what Prometheus scrapes) and the most recent samples,
+from which the p50, p95 and p99 are worked out. Every series is identified by a metric name and a set of labels,
+like db_query_seconds{function="fetch_songs"}.
+Each API process (or uvicorn worker) keeps its own metrics.
+There is also a sampling profiler that can be switched on for a single request: a background thread takes a snapshot
+of the request thread's Python stack at a fixed interval, and the sampled stacks are counted in the "collapsed" format
+that flame graph tools read (one line per stack, frames separated by ';', followed by the number of samples).
+'''
+
+'''
+The comments are in greater detail to explain each step of the code
+'''
+
+# Bucket upper bounds of the duration histograms, in seconds
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Quantiles reported for every histogram
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+# One histogram series
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS, samples=1024):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        # The latest samples, for the quantiles
+        self.recent = collections.deque(maxlen=samples)
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+        self.recent.append(value)
+
+    # The q-quantile of the recent samples (nearest rank), or NaN without samples
+    def quantile(self, q):
+        if not self.recent:
+            return math.nan
+        ordered = sorted(self.recent)
+        return ordered[min(len(ordered) - 1, max(0, math.ceil(q * len(ordered)) - 1))]
+
+
+# The counters and histograms of one process
+class Metrics:
+    def __init__(self, samples=1024):
+        self._lock = threading.Lock()
+        self.samples = samples
+        self.counters = {}
+        self.histograms = {}
+        self.help = {}
+
+    # Describe a metric, for the HELP line of its output
+    def describe(self, name, text):
+        self.help[name] = text
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(samples=self.samples)
+            histogram.observe(value)
+
+    def clear(self):
+        with self._lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+    # Current value of a counter, 0 if it was never incremented
+    def value(self, name, **labels):
+        return self.counters.get((name, tuple(sorted(labels.items()))), 0)
+
+    # The histogram of a series, or None if nothing was observed for it
+    def histogram(self, name, **labels):
+        return self.histograms.get((name, tuple(sorted(labels.items()))))
+
+    # All metrics in the Prometheus text exposition format
+    # Counters get the _total suffix; histograms are written as _bucket/_sum/_count series, followed by a
+    # <name>_quantile gauge with the p50, p95 and p99 of the recent samples
+    def render(self):
+        lines = []
+        with self._lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted((key, self._copy(histogram)) for key, histogram in self.histograms.items())
+        seen = set()
+        for (name, labels), value in counters:
+            if name not in seen:
+                seen.add(name)
+                lines += self._header(f"{name}_total", name, "counter")
+            lines.append(f"{name}_total{_labels(labels)} {_number(value)}")
+        for (name, labels), (buckets, counts, total, count, quantiles) in histograms:
+            if name not in seen:
+                seen.add(name)
+                lines += self._header(name, name, "histogram")
+            cumulative = 0
+            for bound, bucket_count in zip(buckets + (math.inf,), counts):
+                cumulative += bucket_count
+                lines.append(f"{name}_bucket{_labels(labels + (('le', _number(bound)),))} {cumulative}")
+            lines.append(f"{name}_sum{_labels(labels)} {_number(total)}")
+            lines.append(f"{name}_count{_labels(labels)} {count}")
+        for (name, labels), (_, _, _, _, quantiles) in histograms:
+            if f"{name}_quantile" not in seen:
+                seen.add(f"{name}_quantile")
+                lines += self._header(f"{name}_quantile", name, "gauge", "p50, p95 and p99 of the recent samples of ")
+            for q, value in quantiles:
+                lines.append(f"{name}_quantile{_labels(labels + (('quantile', str(q)),))} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+    def _copy(self, histogram):
+        return (histogram.buckets, list(histogram.counts), histogram.sum, histogram.count,
+                [(q, histogram.quantile(q)) for q in QUANTILES])
+
+    def _header(self, series, name, kind, prefix=""):
+        header = [f"# TYPE {series} {kind}"]
+        if name in self.help:
+            header.insert(0, f"# HELP {series} {prefix}{self.help[name]}")
+        return header
+
+
+# Format label pairs as {name="value",...}
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+
+# Escape a label value: backslashes, double quotes and newlines
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+# Format a number the way Prometheus expects, including +Inf and NaN
+def _number(value):
+    if isinstance(value, float):
+        if math.isnan(value):
+            return "NaN"
+        if math.isinf(value):
+            return "+Inf" if value > 0 else "-Inf"
+        return repr(value)
+    return str(value)
+
+
+# The metrics of this process
+metrics = Metrics()
+metrics.describe("http_requests", "HTTP requests by endpoint, method and status")
+metrics.describe("http_request_seconds", "Request latency by endpoint")
+metrics.describe("http_response_bytes", "Response body bytes by endpoint")
+metrics.describe("db_query_seconds", "Time spent in each database function")
+metrics.describe("db_rows", "Rows returned by each database function")
+metrics.describe("db_connections_opened", "SQLite connections opened")
+
+
+# Decorator that times a database function into db_query_seconds and, with 'rows', counts the rows it returned
+# 'rows' is a function from the return value to a number of rows
+def timed(rows=None):
+    def decorator(function):
+        function_name = function.__name__
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                result = function(*args, **kwargs)
+            finally:
+                metrics.observe("db_query_seconds", time.perf_counter() - start, function=function_name)
+            if rows is not None:
+                metrics.inc("db_rows", rows(result), function=function_name)
+            return result
+        return wrapper
+    return decorator
+
+
+# Samples the Python stack of one thread at a fixed interval while it runs
+# Use start() and stop() around the work to profile; collapsed() returns the counted stacks
+class SamplingProfiler:
+    def __init__(self, thread_id=None, interval=0.001):
+        self.thread_id = thread_id if thread_id is not None else threading.get_ident()
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self.samples = 0
+        self._running = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._running.set()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._running.clear()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        return self
+
+    def _run(self):
+        while self._running.is_set():
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({code.co_filename.rsplit('/', 1)[-1]}:{frame.f_lineno})")
+                    frame = frame.f_back
+                self.stacks[";".join(reversed(stack))] += 1
+                self.samples += 1
+            time.sleep(self.interval)
+
+    # The sampled stacks in the collapsed format, most frequent first
+    def collapsed(self):
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
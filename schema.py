@@ -0,0 +1,61 @@
+from pydantic import BaseModel, Field
+from typing import Optional, Union, get_args, get_origin
+
+'''
+The Song model and the column metadata derived from it.
+It is shared by the ingestion pipeline, which validates input rows against it and creates the songs table from it,
+and by the API, which checks filter and sort parameters against it. It only needs pydantic, so the API can use it
+without loading the ingestion dependencies.
+'''
+
+'''
+The comments are in greater detail to explain each step of the code
+'''
+
+# Define the Song model using Pydantic
+# This model will be used to validate the data structure of each song entry
+class Song(BaseModel):
+    id: str
+    title: str
+    danceability: float
+    energy: float
+    key: int
+    loudness: float
+    mode: int
+    acousticness: float
+    instrumentalness: float
+    liveness: float
+    valence: float
+    tempo: float
+    duration_ms: int
+    time_signature: int
+    num_bars: int
+    num_sections: int
+    num_segments: int
+    class_: int = Field(alias='class')
+    rating: Optional[float] = None
+
+    model_config = {
+        "populate_by_name": True
+    }
+
+# Column names of the songs table, in model order ('class' instead of the class_ attribute name)
+SONG_COLUMNS = [field.alias or name for name, field in Song.model_fields.items()]
+
+# For every column: the model attribute name, the Python type of the field, and whether it may be left empty
+# Optional[float] is unwrapped to float, with the optional flag set
+def _song_fields():
+    fields = {}
+    for name, field in Song.model_fields.items():
+        annotation = field.annotation
+        optional = False
+        if get_origin(annotation) is Union:
+            annotation = next(arg for arg in get_args(annotation) if arg is not type(None))
+            optional = True
+        fields[field.alias or name] = (name, annotation, optional, field.is_required())
+    return fields
+
+SONG_FIELDS = _song_fields()
+
+# Numeric columns, which GET /songs can filter on with range parameters like ?energy_gte=0.7
+NUMERIC_COLUMNS = [column for column, (_, kind, _, _) in SONG_FIELDS.items() if kind in (int, float)]
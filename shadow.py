@@ -0,0 +1,299 @@
+import json
+import logging
+import os
+import re
+import shutil
+import sqlite3
+import time
+
+from shards import shard_of, shard_paths, shard_root
+
+'''
+Shadow builds of the catalog, used by full ingestions.
+db_path is a symbolic link to the live version of the database, a file in a directory next to it
+(data/playlist.db -> playlist.db.versions/v3.db). An ingestion writes the next version (v4.db) from scratch while the
+API keeps serving the live one, and builds the indexes, stored JSON, snapshot, similarity index and stats next to it.
+Every chunk is committed together with a record of the input file and how far into it the build got, so an interrupted
+ingestion of the same input carries on after the last committed chunk instead of starting over.
+Once the build is complete it is checked, the ratings given through the API in the meantime are copied into it, and
+the link is replaced with one atomic rename. SQLite resolves the link when a connection is opened, so requests that
+are running finish on the old version while new connections open the new one; the connection pool notices the link
+has changed and recycles its idle connections. The old version is marked as retired, so a rating that was waiting
+for its lock is written again on the new version instead of being lost.
+Each ingestion deletes the versions before the one it replaced, keeping one version back for readers that resolved
+the link just before the swap.
+'''
+
+'''
+The comments are in greater detail to explain each step of the code
+'''
+
+logger = logging.getLogger("dataParsing_logger")
+
+# Error message of the trigger that stops rating writes to a retired version (see db.update_rating)
+RETIRED_MESSAGE = "catalog version retired"
+
+
+# Raised when a finished shadow build doesn't pass its checks; the live version is left in place
+class ShadowBuildError(Exception):
+    pass
+
+
+# Directory holding the versions of a database
+def versions_root(db_path):
+    return f"{db_path}.versions"
+
+
+# The file of version 'number' of a database
+def version_path(db_path, number):
+    return os.path.join(versions_root(db_path), f"v{number}.db")
+
+
+# The file the API currently reads: where db_path links to, or db_path itself when it is a plain file
+# (databases ingested before shadow builds existed)
+def live_path(db_path):
+    return os.path.realpath(db_path)
+
+
+# The number of a version file, or 0 for a plain database file
+def version_number(path):
+    match = re.fullmatch(r"v(\d+)\.db", os.path.basename(path))
+    return int(match.group(1)) if match and os.path.dirname(path).endswith(".versions") else 0
+
+
+# The database files of a version: its shard files when it has a shard directory, otherwise the file itself
+# Returns an empty list when there is no database yet
+def version_sources(path):
+    root = shard_root(path)
+    if os.path.isdir(root):
+        names = [name for name in os.listdir(root) if re.fullmatch(r"shard-\d+\.db", name)]
+        return [os.path.join(root, name) for name in sorted(names, key=lambda name: int(name[6:-3]))]
+    return [path] if os.path.exists(path) else []
+
+
+# A record of the input of a streaming ingestion: the file, its size and modification time, and how it is split into
+# chunks. A build is only resumed for exactly the same input read the same way
+def source_identity(input_path, chunk_size, split):
+    status = os.stat(input_path)
+    return json.dumps({"path": os.path.abspath(input_path), "size": status.st_size, "mtime": status.st_mtime_ns,
+                       "chunk_size": chunk_size, "split": split}, sort_keys=True)
+
+
+# Delete a version of a database along with everything derived from it
+# For the plain file that db_path was before its first shadow build, db_path (now the link) is kept
+def remove_version(path, keep_file=False):
+    for name in [path + suffix for suffix in ("-wal", "-shm", "-journal", ".stats.json")] + ([] if keep_file else [path]):
+        if os.path.isfile(name) and not os.path.islink(name):
+            os.remove(name)
+    for suffix in (".shards", ".snapshot", ".similar"):
+        shutil.rmtree(path + suffix, ignore_errors=True)
+
+
+# The progress of a build: (source, chunks, rows) from each of its files, or None when a file is missing or unfinished
+def _read_progress(path):
+    if not os.path.exists(path):
+        return None
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute("SELECT source, chunks, rows FROM ingest_progress").fetchone()
+    except sqlite3.DatabaseError:
+        return None
+    finally:
+        conn.close()
+
+
+# Record how far a build has got, as part of the transaction that wrote the chunk
+def record_progress(conn, source, chunks, rows):
+    conn.execute("CREATE TABLE IF NOT EXISTS ingest_progress (id INTEGER PRIMARY KEY CHECK (id = 0), "
+                 "source TEXT NOT NULL, chunks INTEGER NOT NULL, rows INTEGER NOT NULL)")
+    conn.execute("INSERT OR REPLACE INTO ingest_progress VALUES (0, ?, ?, ?)", (source, chunks, rows))
+
+
+# One shadow build: the next version of the database, written into 'path' (or its shard files 'shards')
+# 'chunks' and 'rows' are how many input chunks and valid rows an interrupted build had already committed
+class ShadowBuild:
+    def __init__(self, db_path, number, count, source=None, chunks=0, rows=0):
+        self.db_path = db_path
+        self.number = number
+        self.path = version_path(db_path, number)
+        self.shards = shard_paths(self.path, count)
+        self.targets = self.shards or [self.path]
+        self.source = source
+        self.chunks = chunks
+        self.rows = rows
+        self.live = live_path(db_path)
+
+    # Start the next version of a database, or resume the interrupted build of the same input
+    # Builds of other inputs left behind by an interrupted ingestion are deleted
+    @classmethod
+    def start(cls, db_path, count, source=None):
+        os.makedirs(versions_root(db_path), exist_ok=True)
+        live = version_number(live_path(db_path)) if os.path.islink(db_path) else 0
+        numbers = [version_number(os.path.join(versions_root(db_path), name))
+                   for name in os.listdir(versions_root(db_path))]
+        numbers = sorted({number for number in numbers if number})
+        for number in numbers:
+            if number <= live:
+                continue
+            build = cls(db_path, number, count, source)
+            progress = [_read_progress(path) for path in build.targets] if source is not None else [None]
+            if all(item is not None and item[0] == source for item in progress):
+                # Shards commit their chunks one by one, so some may be a chunk ahead: they are rewound to the
+                # last chunk every shard has
+                chunks, rows = min((item[1], item[2]) for item in progress)
+                build.rewind(chunks, rows)
+                logger.info(f"Resuming the build of {build.path} after {chunks} chunks ({rows} rows)")
+                return build
+            logger.info(f"Removing the unfinished build {build.path}")
+            remove_version(build.path)
+        build = cls(db_path, max(numbers + [live]) + 1, count, source)
+        logger.info(f"Building {build.path} as the next version of {db_path}")
+        return build
+
+    # Drop the songs an interrupted build wrote after its last complete chunk
+    def rewind(self, chunks, rows):
+        self.chunks, self.rows = chunks, rows
+        for path in self.targets:
+            conn = sqlite3.connect(path)
+            try:
+                conn.execute("DELETE FROM songs WHERE rowid > ?", (rows,))
+                conn.execute("DELETE FROM song_hashes WHERE id NOT IN (SELECT id FROM songs)")
+                record_progress(conn, self.source, chunks, rows)
+                conn.commit()
+            finally:
+                conn.close()
+
+    # Version counters for a new build: the catalog version carries on from the live version's, so files derived from
+    # the new songs never share a version with the old ones. Set on the first file inside its first transaction
+    def seed_versions(self, conn):
+        conn.execute("CREATE TABLE IF NOT EXISTS catalog_meta (key TEXT PRIMARY KEY, value INTEGER)")
+        conn.execute("INSERT OR REPLACE INTO catalog_meta VALUES ('catalog_version', ?)",
+                     (_counter(version_sources(self.live), 'catalog_version'),))
+
+    # Check the finished build before it goes live: every file passes SQLite's quick check, has the tables the API
+    # reads and its stored JSON, and together they hold every valid row of the input
+    def validate(self, rows, derived=()):
+        total = 0
+        for path in self.targets:
+            conn = sqlite3.connect(path)
+            try:
+                check = conn.execute("PRAGMA quick_check").fetchone()[0]
+                if check != "ok":
+                    raise ShadowBuildError(f"{path} failed its integrity check: {check}")
+                tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+                missing = {"songs", "songs_fts", "song_json", "ratings", "rating_stats", "rating_summary"} - tables
+                if missing:
+                    raise ShadowBuildError(f"{path} is missing tables: {', '.join(sorted(missing))}")
+                songs = conn.execute("SELECT COUNT(*) FROM songs").fetchone()[0]
+                encoded = conn.execute("SELECT COUNT(*) FROM song_json").fetchone()[0]
+                if encoded != songs:
+                    raise ShadowBuildError(f"{path} has stored JSON for {encoded} of {songs} songs")
+                total += songs
+            finally:
+                conn.close()
+        if total != rows:
+            raise ShadowBuildError(f"{self.path} holds {total} songs, expected {rows}")
+        for path in derived:
+            if not os.path.exists(path):
+                raise ShadowBuildError(f"{path} was not built")
+
+    # Copy the ratings logged on the live version into the build, with their ids above 'marks' (per live file)
+    # Inserting them fires the build's triggers, which fold them into rating_stats, songs.rating and rating_summary
+    # Returns the highest id copied from every live file
+    def _copy_ratings(self, sources, marks):
+        copied = list(marks)
+        for index, path in enumerate(self.targets):
+            conn = sqlite3.connect(path, isolation_level=None)
+            try:
+                conn.create_function("shard_of", 2, shard_of, deterministic=True)
+                where = f" AND shard_of(song_id, {len(self.shards)}) = {index}" if self.shards else ""
+                for position, source in enumerate(sources):
+                    conn.execute("ATTACH DATABASE ? AS live", (source,))
+                    try:
+                        high = conn.execute("SELECT IFNULL(MAX(id), 0) FROM live.ratings").fetchone()[0]
+                        conn.execute("INSERT INTO ratings (song_id, rating, created_at) SELECT song_id, rating, "
+                                     f"created_at FROM live.ratings WHERE id > ?{where} ORDER BY id", (marks[position],))
+                        copied[position] = max(copied[position], high)
+                    except sqlite3.OperationalError as e:
+                        # Live versions without a ratings log have nothing to copy
+                        if "no such table" not in str(e):
+                            raise
+                    finally:
+                        conn.execute("DETACH DATABASE live")
+            finally:
+                conn.close()
+        return copied
+
+    # Put the build live
+    # Most of the ratings are copied while the live version keeps taking writes. Then every live file is locked
+    # against writers, the ratings given since are copied, the data version is moved past the live one (so cached
+    # responses of the old version are never served again), and the link is swapped. The old files are marked as
+    # retired before their locks are released, so writers that were waiting retry on the new version
+    def publish(self):
+        start_time = time.perf_counter()
+        sources = version_sources(self.live)
+        marks = self._copy_ratings(sources, [0] * len(sources))
+        locks = []
+        try:
+            for source in sources:
+                conn = sqlite3.connect(source, timeout=30, isolation_level=None)
+                locks.append(conn)
+                conn.execute("BEGIN IMMEDIATE")
+            self._copy_ratings(sources, marks)
+            data_version = _counter(sources, 'data_version') + 1
+            for index, path in enumerate(self.targets):
+                conn = sqlite3.connect(path)
+                try:
+                    conn.execute("UPDATE catalog_meta SET value = ? WHERE key = 'data_version'",
+                                 (data_version if index == 0 else 0,))
+                    conn.execute("DROP TABLE IF EXISTS ingest_progress")
+                    conn.commit()
+                finally:
+                    conn.close()
+            # The trigger is written before the swap: once a plain db_path file is replaced by the link, SQLite no
+            # longer lets its connections write to it
+            for conn in locks:
+                conn.execute("CREATE TABLE IF NOT EXISTS ratings ("
+                             "id INTEGER PRIMARY KEY, song_id TEXT NOT NULL, rating REAL NOT NULL, created_at REAL)")
+                conn.execute("CREATE TRIGGER IF NOT EXISTS ratings_retired BEFORE INSERT ON ratings BEGIN "
+                             f"SELECT RAISE(ABORT, '{RETIRED_MESSAGE}'); END")
+            link = f"{self.db_path}.link-{os.getpid()}"
+            if os.path.lexists(link):
+                os.remove(link)
+            os.symlink(os.path.relpath(self.path, os.path.dirname(os.path.abspath(self.db_path))), link)
+            os.replace(link, self.db_path)
+            for conn in locks:
+                conn.execute("COMMIT")
+        finally:
+            for conn in locks:
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+                conn.close()
+        logger.info(f"{self.db_path} now links to {self.path} (swapped in {time.perf_counter() - start_time:.2f}s)")
+        self.collect_garbage()
+
+    # Delete every version except the new one and the one it replaced
+    def collect_garbage(self):
+        keep = {self.number, version_number(self.live)}
+        for name in os.listdir(versions_root(self.db_path)):
+            number = version_number(os.path.join(versions_root(self.db_path), name))
+            if number and number not in keep:
+                remove_version(version_path(self.db_path, number))
+        # The plain file db_path was before its first shadow build counts as version 0
+        if 0 not in keep:
+            remove_version(self.db_path, keep_file=True)
+
+
+# The sum of a version counter over the files of a version
+def _counter(sources, key):
+    total = 0
+    for path in sources:
+        conn = sqlite3.connect(path)
+        try:
+            row = conn.execute("SELECT value FROM catalog_meta WHERE key = ?", (key,)).fetchone()
+        except sqlite3.OperationalError:
+            row = None
+        finally:
+            conn.close()
+        total += row[0] if row else 0
+    return total
@@ -0,0 +1,292 @@
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+'''
+Nearest-neighbour index over the songs' audio features, used by GET /songs/<id>/similar.
+At the end of an ingestion the feature columns are read from the songs table once, standardized (zero mean and unit
+variance per feature) and written as .npy files into a directory next to the database, one directory per catalog
+version. The API memory-maps those files read-only, so every worker process shares the same pages, and answers
+each query with one vectorized distance computation over the matrix instead of touching SQLite row by row.
+For large catalogs the rows are grouped into partitions around k-means centroids (an inverted-file index); a query
+then only scans the rows of the few partitions whose centroids are closest to the song, which is approximate but
+much faster.
+'''
+
+'''
+The comments are in greater detail to explain each step of the code
+'''
+
+logger = logging.getLogger("db_logger")
+
+# Audio features compared by default, unless config.json lists its own "similarity" -> "features"
+DEFAULT_FEATURES = ["danceability", "energy", "loudness", "acousticness", "instrumentalness", "liveness", "valence", "tempo"]
+
+DEFAULT_SETTINGS = {
+    "features": DEFAULT_FEATURES,
+    # Catalogs with at least this many songs get a partitioned index; 0 turns partitioning off
+    "partition_min_rows": 100000,
+    # Number of partitions; 0 means about the square root of the number of songs
+    "partitions": 0,
+    # Number of closest partitions scanned per query
+    "probe": 8,
+    "max_k": 100,
+}
+
+
+# The similarity settings from the "similarity" section of config.json, with the defaults filled in
+def similarity_settings(config):
+    return {**DEFAULT_SETTINGS, **config.get('similarity', {})}
+
+
+# Directory holding the index files of every catalog version of a database, next to its live version (see shadow.py)
+def index_root(db_path):
+    return f"{os.path.realpath(db_path)}.similar"
+
+
+# Read the rowids and feature columns from the songs table into NumPy arrays
+# The rows are fetched in large batches straight into preallocated arrays
+def read_features(conn, features, batch_size=50000):
+    total = conn.execute("SELECT COUNT(*) FROM songs").fetchone()[0]
+    matrix = np.empty((total, len(features)), dtype=np.float64)
+    rowids = np.empty(total, dtype=np.int64)
+    columns = ", ".join(f'"{column}"' for column in features)
+    cursor = conn.execute(f"SELECT rowid, {columns} FROM songs ORDER BY rowid")
+    position = 0
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        end = position + len(rows)
+        rowids[position:end] = [row[0] for row in rows]
+        # Missing feature values count as the column mean once the matrix is standardized
+        matrix[position:end] = np.array([row[1:] for row in rows], dtype=np.float64)
+        position = end
+    return rowids[:position], matrix[:position]
+
+
+# Group the rows around k-means centroids, returning the centroids and each row's partition
+# The centroids are fitted on a sample of at most 50 rows per partition, then every row is assigned to its closest one
+def partition(matrix, partitions, iterations=10, seed=0):
+    rng = np.random.default_rng(seed)
+    sample = matrix[rng.choice(len(matrix), size=min(len(matrix), partitions * 50), replace=False)]
+    centroids = sample[rng.choice(len(sample), size=partitions, replace=False)].copy()
+    for _ in range(iterations):
+        labels = nearest_centroids(sample, centroids)
+        for index in range(partitions):
+            members = sample[labels == index]
+            if len(members):
+                centroids[index] = members.mean(axis=0)
+    return centroids, nearest_centroids(matrix, centroids)
+
+
+# Index of the closest centroid for every row, computed in blocks to bound the memory of the distance matrix
+def nearest_centroids(matrix, centroids, block=65536):
+    labels = np.empty(len(matrix), dtype=np.int64)
+    squared = (centroids ** 2).sum(axis=1)
+    for start in range(0, len(matrix), block):
+        rows = matrix[start:start + block]
+        # |x - c|^2 = |x|^2 - 2 x.c + |c|^2, and |x|^2 is the same for every centroid
+        labels[start:start + block] = np.argmin(squared - 2 * rows @ centroids.T, axis=1)
+    return labels
+
+
+# Build the index files of the current catalog version, returning the directory they were written to
+# 'sources' lists the database files holding the songs - the shard files of a sharded catalog (see shards.py) - and
+# defaults to db_path itself; the index files always go next to db_path
+# The files are written into a temporary directory that is renamed into place once complete, so a reader never sees
+# a half-written index; directories of older catalog versions are removed
+def build_index(db_path, version, settings, sources=None):
+    start_time = time.perf_counter()
+    features = settings["features"]
+    parts = []
+    for source in sources or [db_path]:
+        conn = sqlite3.connect(source)
+        try:
+            parts.append(read_features(conn, features))
+        finally:
+            conn.close()
+    rowids, matrix = (np.concatenate(arrays) for arrays in zip(*parts))
+
+    # Standardize every feature, so tempo (around 120) doesn't drown out danceability (0 to 1)
+    mean = np.nanmean(matrix, axis=0) if len(matrix) else np.zeros(len(features))
+    std = np.nanstd(matrix, axis=0) if len(matrix) else np.ones(len(features))
+    std[~(std > 0)] = 1.0
+    mean = np.nan_to_num(mean)
+    matrix = np.nan_to_num((matrix - mean) / std).astype(np.float32)
+
+    # Partition large catalogs and store the rows grouped by partition, so each partition is one contiguous slice
+    partitions = min(settings["partitions"] or int(np.sqrt(len(matrix))), len(matrix))
+    offsets = np.array([0, len(matrix)], dtype=np.int64)
+    centroids = np.empty((0, len(features)), dtype=np.float32)
+    if settings["partition_min_rows"] and len(matrix) >= settings["partition_min_rows"] and partitions > 1:
+        centroids, labels = partition(matrix, partitions)
+        order = np.argsort(labels, kind="stable")
+        rowids, matrix = rowids[order], matrix[order]
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(labels, minlength=partitions))]).astype(np.int64)
+        centroids = centroids.astype(np.float32)
+
+    root = index_root(db_path)
+    os.makedirs(root, exist_ok=True)
+    target = os.path.join(root, f"v{version}")
+    staging = os.path.join(root, f".build-{os.getpid()}-{threading.get_ident()}")
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+    # Songs are looked up by rowid (the API finds it from the song id through idx_songs_id), so the index holds only
+    # fixed-size integers: a row's position is found by a binary search on the sorted rowids
+    rowid_order = np.argsort(rowids, kind="stable")
+    arrays = {
+        "features": matrix,
+        "rowids": rowids,
+        "sorted_rowids": rowids[rowid_order],
+        "sorted_positions": rowid_order.astype(np.int64),
+        "centroids": centroids,
+        "offsets": offsets,
+    }
+    for name, array in arrays.items():
+        np.save(os.path.join(staging, f"{name}.npy"), array)
+    with open(os.path.join(staging, "meta.json"), "w") as file:
+        json.dump({"catalog_version": version, "features": features, "mean": mean.tolist(), "std": std.tolist(),
+                   "rows": len(matrix), "partitions": len(centroids)}, file)
+    # A rebuilt version replaces the previous files of the same version; readers keep their open memory maps
+    previous = f"{staging}-old"
+    if os.path.exists(target):
+        os.rename(target, previous)
+    try:
+        os.rename(staging, target)
+    except OSError:
+        # Another process finished the same version first
+        shutil.rmtree(staging, ignore_errors=True)
+    shutil.rmtree(previous, ignore_errors=True)
+    for name in os.listdir(root):
+        if name.startswith("v") and name != f"v{version}":
+            shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+    logger.info(f"Built similarity index v{version}: {len(matrix)} songs, {len(centroids)} partitions "
+                f"in {time.perf_counter() - start_time:.2f}s")
+    return target
+
+
+# The catalog version of a set of database files: the sum of their counters, as db.get_catalog_version() counts it
+def catalog_version(paths):
+    version = 0
+    for path in paths:
+        conn = sqlite3.connect(path)
+        try:
+            row = conn.execute("SELECT value FROM catalog_meta WHERE key = 'catalog_version'").fetchone()
+        except sqlite3.OperationalError:
+            row = None
+        finally:
+            conn.close()
+        version += row[0] if row else 0
+    return version
+
+
+# Whether a directory holds a complete index in the current layout; one written before the songs were looked up by
+# rowid has no sorted_rowids.npy, and is built again
+def _complete(directory):
+    return all(os.path.exists(os.path.join(directory, name)) for name in ("meta.json", "sorted_rowids.npy"))
+
+
+# Make sure the index files of the database's current catalog version exist, building them if they don't
+# Called by dataParsing at the end of every ingestion; rebuild=True always builds them anew
+def ensure_index(db_path, settings, rebuild=False, sources=None):
+    version = catalog_version(sources or [db_path])
+    directory = os.path.join(index_root(db_path), f"v{version}")
+    if not rebuild and _complete(directory):
+        return directory
+    return build_index(db_path, version, settings, sources)
+
+
+# A loaded index: the memory-mapped arrays of one catalog version
+class SimilarityIndex:
+    def __init__(self, directory):
+        with open(os.path.join(directory, "meta.json")) as file:
+            self.meta = json.load(file)
+        self.version = self.meta["catalog_version"]
+        load = lambda name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r")
+        self.features = load("features")
+        self.rowids = load("rowids")
+        self.sorted_rowids = load("sorted_rowids")
+        self.sorted_positions = load("sorted_positions")
+        self.centroids = np.asarray(load("centroids"))
+        self.offsets = np.asarray(load("offsets"))
+
+    # Row position of a song's rowid in the matrix, or None if the song isn't in the index
+    # (binary search on the sorted rowids)
+    def position(self, rowid):
+        index = int(np.searchsorted(self.sorted_rowids, rowid))
+        if index < len(self.sorted_rowids) and self.sorted_rowids[index] == rowid:
+            return int(self.sorted_positions[index])
+        return None
+
+    # Rows to compare a query against: everything, or with partitions the rows of the 'probe' closest partitions
+    def candidates(self, vector, k, probe):
+        if len(self.centroids) == 0 or probe >= len(self.centroids):
+            return None
+        order = np.argsort(((self.centroids - vector) ** 2).sum(axis=1))
+        selected = []
+        count = 0
+        # Take at least 'probe' partitions, and more if they don't hold enough songs for k results
+        for taken, partition_index in enumerate(order):
+            if taken >= probe and count > k:
+                break
+            start, end = self.offsets[partition_index], self.offsets[partition_index + 1]
+            selected.append(np.arange(start, end))
+            count += end - start
+        return np.concatenate(selected)
+
+    # The k songs closest to the one with the given rowid, as (rowid, distance) pairs from nearest to farthest
+    # Returns None if the song isn't in the index
+    def nearest(self, rowid, k, probe=8, exact=False):
+        position = self.position(rowid)
+        if position is None:
+            return None
+        vector = np.asarray(self.features[position])
+        candidates = None if exact else self.candidates(vector, k, probe)
+        rows = self.features if candidates is None else self.features[candidates]
+        distances = np.sqrt(((rows - vector) ** 2).sum(axis=1))
+        positions = np.arange(len(self.features)) if candidates is None else candidates
+        # The song itself is always at distance 0, so it is left out
+        keep = positions != position
+        distances, positions = distances[keep], positions[keep]
+        k = min(k, len(distances))
+        if k == 0:
+            return []
+        top = np.argpartition(distances, k - 1)[:k]
+        top = top[np.argsort(distances[top], kind="stable")]
+        return [(int(self.rowids[positions[i]]), float(distances[i])) for i in top]
+
+
+# Keeps the index of the current catalog version loaded in a process
+# current() checks the catalog version and, when it has moved on, switches to that version's files,
+# building them first if the ingestion that made the new version didn't
+class IndexManager:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._index = None
+        self._key = None
+
+    def current(self, db_path, version, settings, sources=None):
+        index = self._index
+        if index is not None and self._key == (db_path, version):
+            return index
+        with self._lock:
+            if self._index is None or self._key != (db_path, version):
+                directory = os.path.join(index_root(db_path), f"v{version}")
+                if not _complete(directory):
+                    directory = build_index(db_path, version, settings, sources)
+                self._index = SimilarityIndex(directory)
+                self._key = (db_path, version)
+                logger.info(f"Loaded similarity index v{version} ({self._index.meta['rows']} songs)")
+            return self._index
+
+    def clear(self):
+        with self._lock:
+            self._index = None
+            self._key = None
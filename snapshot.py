@@ -0,0 +1,250 @@
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+from schema import SONG_FIELDS
+
+'''
+Columnar snapshot of the songs table, written next to the database at the end of every ingestion.
+Each column is stored as its own NumPy .npy file: numbers as int64/float64 arrays, and text as one array of UTF-8
+bytes plus an array of offsets into it (so a column of long titles doesn't pay for fixed-width strings). A manifest
+records the catalog version the snapshot was taken at. The API memory-maps the files read-only and serves bulk reads
+as slices of the arrays, instead of building a sqlite3.Row and then a dict for every song.
+The rating column is not part of the snapshot: ratings change all the time, so they are always read from SQLite
+(one query per page) and the snapshot stays valid until the next ingestion. When the catalog version in the database
+no longer matches the manifest (or there is no snapshot at all) the API falls back to reading SQLite.
+'''
+
+'''
+The comments are in greater detail to explain each step of the code
+'''
+
+logger = logging.getLogger("db_logger")
+
+# Columns stored in the snapshot - every column of the songs table except the rating
+SNAPSHOT_COLUMNS = [column for column in SONG_FIELDS if column != "rating"]
+NUMPY_TYPES = {int: np.int64, float: np.float64}
+
+
+# Whether snapshots are written and served, from the "snapshot" section of config.json (on by default)
+def snapshot_enabled(config):
+    return config.get('snapshot', {}).get('enabled', True)
+
+
+# Directory holding the snapshots of a database, next to its live version (see shadow.py)
+def snapshot_root(db_path):
+    return f"{os.path.realpath(db_path)}.snapshot"
+
+
+# Write a text column: the UTF-8 bytes of every value back to back, and the offset where each value starts
+# The bytes are streamed to a temporary file and turned into a .npy file at the end, once their total size is known
+class _TextColumnWriter:
+    def __init__(self, directory, name, rows):
+        self.directory = directory
+        self.name = name
+        self.offsets = np.lib.format.open_memmap(os.path.join(directory, f"{name}.offsets.npy"), mode="w+",
+                                                 dtype=np.int64, shape=(rows + 1,))
+        self.offsets[0] = 0
+        self.raw_path = os.path.join(directory, f"{name}.raw")
+        self.raw = open(self.raw_path, "wb")
+        self.size = 0
+
+    def write(self, position, values):
+        encoded = [value.encode("utf-8") if value is not None else b"" for value in values]
+        lengths = np.fromiter((len(value) for value in encoded), dtype=np.int64, count=len(encoded))
+        self.offsets[position + 1:position + 1 + len(encoded)] = self.size + np.cumsum(lengths)
+        self.raw.write(b"".join(encoded))
+        self.size += int(lengths.sum())
+
+    def close(self):
+        self.raw.close()
+        self.offsets.flush()
+        del self.offsets
+        with open(os.path.join(self.directory, f"{self.name}.data.npy"), "wb") as file, open(self.raw_path, "rb") as raw:
+            np.lib.format.write_array_header_1_0(file, {"descr": "|u1", "fortran_order": False, "shape": (self.size,)})
+            shutil.copyfileobj(raw, file)
+        os.remove(self.raw_path)
+
+
+# Write the snapshot of the current songs table, tagged with the given catalog version
+# Rows are read in batches and written straight into memory-mapped output files, so memory use doesn't grow with the table.
+# The files are written to a temporary directory that is renamed into place once complete; older snapshots are removed
+def write_snapshot(db_path, version, batch_size=50000):
+    start_time = time.perf_counter()
+    root = snapshot_root(db_path)
+    os.makedirs(root, exist_ok=True)
+    staging = os.path.join(root, f".build-{os.getpid()}-{threading.get_ident()}")
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+
+    conn = sqlite3.connect(db_path)
+    try:
+        rows = conn.execute("SELECT COUNT(*) FROM songs").fetchone()[0]
+        rowids = np.lib.format.open_memmap(os.path.join(staging, "rowid.npy"), mode="w+", dtype=np.int64, shape=(rows,))
+        writers = {}
+        nulls = {}
+        for column in SNAPSHOT_COLUMNS:
+            kind = SONG_FIELDS[column][1]
+            if kind is str:
+                writers[column] = _TextColumnWriter(staging, column, rows)
+            else:
+                writers[column] = np.lib.format.open_memmap(os.path.join(staging, f"{column}.npy"), mode="w+",
+                                                            dtype=NUMPY_TYPES[kind], shape=(rows,))
+            nulls[column] = np.zeros(rows, dtype=bool)
+
+        columns = ", ".join(f'"{column}"' for column in SNAPSHOT_COLUMNS)
+        cursor = conn.execute(f"SELECT rowid, {columns} FROM songs ORDER BY rowid")
+        position = 0
+        while position < rows:
+            batch = cursor.fetchmany(batch_size)
+            if not batch:
+                break
+            end = position + len(batch)
+            values = list(zip(*batch))
+            rowids[position:end] = values[0]
+            for column, column_values in zip(SNAPSHOT_COLUMNS, values[1:]):
+                missing = np.fromiter((value is None for value in column_values), dtype=bool, count=len(batch))
+                nulls[column][position:end] = missing
+                if isinstance(writers[column], _TextColumnWriter):
+                    writers[column].write(position, column_values)
+                else:
+                    filled = [0 if value is None else value for value in column_values] if missing.any() else column_values
+                    writers[column][position:end] = filled
+            position = end
+    finally:
+        conn.close()
+
+    rowids.flush()
+    del rowids
+    manifest_columns = []
+    for column in SNAPSHOT_COLUMNS:
+        writer = writers[column]
+        if isinstance(writer, _TextColumnWriter):
+            writer.close()
+        else:
+            writer.flush()
+        # A null mask is only stored for columns that have missing values
+        has_nulls = bool(nulls[column][:position].any())
+        if has_nulls:
+            np.save(os.path.join(staging, f"{column}.nulls.npy"), nulls[column][:position])
+        manifest_columns.append({"name": column, "kind": SONG_FIELDS[column][1].__name__, "nulls": has_nulls})
+    writers.clear()
+    with open(os.path.join(staging, "manifest.json"), "w") as file:
+        json.dump({"catalog_version": version, "rows": position, "columns": manifest_columns}, file)
+
+    target = os.path.join(root, f"v{version}")
+    previous = f"{staging}-old"
+    if os.path.exists(target):
+        os.rename(target, previous)
+    try:
+        os.rename(staging, target)
+    except OSError:
+        shutil.rmtree(staging, ignore_errors=True)
+    shutil.rmtree(previous, ignore_errors=True)
+    for name in os.listdir(root):
+        if name.startswith("v") and name != f"v{version}":
+            shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+    logger.info(f"Wrote catalog snapshot v{version}: {position} songs in {time.perf_counter() - start_time:.2f}s")
+    return target
+
+
+# Make sure the snapshot of the database's current catalog version exists, writing it if it doesn't
+# Called by dataParsing at the end of every ingestion; rebuild=True always writes it anew
+def ensure_snapshot(db_path, rebuild=False):
+    conn = sqlite3.connect(db_path)
+    try:
+        row = conn.execute("SELECT value FROM catalog_meta WHERE key = 'catalog_version'").fetchone()
+    except sqlite3.OperationalError:
+        row = None
+    finally:
+        conn.close()
+    version = row[0] if row else 0
+    directory = os.path.join(snapshot_root(db_path), f"v{version}")
+    if not rebuild and os.path.exists(os.path.join(directory, "manifest.json")):
+        return directory
+    return write_snapshot(db_path, version)
+
+
+# A loaded snapshot: the memory-mapped columns of one catalog version
+class Snapshot:
+    def __init__(self, directory):
+        with open(os.path.join(directory, "manifest.json")) as file:
+            self.manifest = json.load(file)
+        self.version = self.manifest["catalog_version"]
+        self.rows = self.manifest["rows"]
+        load = lambda name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r")
+        self.rowids = load("rowid")
+        self.columns = []
+        for column in self.manifest["columns"]:
+            name = column["name"]
+            if column["kind"] == "str":
+                data = (load(f"{name}.data"), load(f"{name}.offsets"))
+            else:
+                data = load(name)
+            self.columns.append((name, column["kind"], data, load(f"{name}.nulls") if column["nulls"] else None))
+
+    # Position of the first song after the given rowid (binary search on the sorted rowids)
+    def position_after(self, rowid):
+        return int(np.searchsorted(self.rowids, rowid, side="right"))
+
+    # The songs in positions start to end, as dictionaries of plain Python values in table column order
+    # Each column is converted for the whole slice at once; 'columns' limits the dictionaries to those columns
+    # (and the rowid), and the other columns aren't read at all
+    def rows_between(self, start, end, columns=None):
+        end = min(end, self.rows)
+        if start >= end:
+            return []
+        values = [self.rowids[start:end].tolist()]
+        names = ["rowid"]
+        for name, kind, data, nulls in self.columns:
+            if columns is not None and name not in columns:
+                continue
+            if kind == "str":
+                blob, offsets = data
+                bounds = offsets[start:end + 1].tolist()
+                raw = bytes(blob[bounds[0]:bounds[-1]])
+                base = bounds[0]
+                column = [raw[a - base:b - base].decode("utf-8") for a, b in zip(bounds, bounds[1:])]
+            else:
+                column = data[start:end].tolist()
+            if nulls is not None:
+                missing = nulls[start:end]
+                column = [None if flag else value for value, flag in zip(column, missing.tolist())]
+            names.append(name)
+            values.append(column)
+        return [dict(zip(names, row)) for row in zip(*values)]
+
+
+# Keeps the snapshot of the current catalog version loaded in a process
+# current() returns None when there is no snapshot for the version, so callers fall back to SQLite
+class SnapshotManager:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._key = None
+
+    def current(self, db_path, version):
+        if self._key == (db_path, version):
+            return self._snapshot
+        with self._lock:
+            if self._key != (db_path, version):
+                directory = os.path.join(snapshot_root(db_path), f"v{version}")
+                try:
+                    self._snapshot = Snapshot(directory)
+                    logger.info(f"Loaded catalog snapshot v{version} ({self._snapshot.rows} songs)")
+                except (OSError, ValueError, KeyError) as e:
+                    logger.info(f"No usable catalog snapshot v{version}, reading from SQLite: {e}")
+                    self._snapshot = None
+                self._key = (db_path, version)
+            return self._snapshot
+
+    def clear(self):
+        with self._lock:
+            self._snapshot = None
+            self._key = None
@@ -0,0 +1,184 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+from schema import NUMERIC_COLUMNS
+from similarity import catalog_version, read_features
+
+'''
+Precomputed summaries of the numeric song columns, served by GET /stats/songs.
+At the end of an ingestion the numeric columns are read from the songs table once, and for each column the count,
+number of missing values, min, max, mean, standard deviation, a few percentiles and a fixed-bin histogram are computed
+with vectorized NumPy operations. They are written as one JSON file next to the database, for the catalog version
+they were computed from, so the API reads them instead of paging through every song.
+The rating column is the exception: ratings change with every POST /songs/<id>/rate, so its summary is kept in the
+database by triggers (see db.rating_summary) and only assembled into the same shape here.
+'''
+
+'''
+The comments are in greater detail to explain each step of the code
+'''
+
+logger = logging.getLogger("db_logger")
+
+# Columns summarized at ingestion; rating is summarized from the database instead
+FEATURE_COLUMNS = [column for column in NUMERIC_COLUMNS if column != "rating"]
+
+DEFAULT_SETTINGS = {
+    # Number of equal-width histogram bins between each column's min and max
+    "bins": 20,
+    "percentiles": [1, 5, 25, 50, 75, 95, 99],
+}
+
+
+# The "stats" section of config.json, filled in with the defaults
+def stats_settings(config):
+    return {**DEFAULT_SETTINGS, **config.get('stats', {})}
+
+
+# The file holding the summaries of a database, next to its live version (see shadow.py)
+def stats_path(db_path):
+    return f"{os.path.realpath(db_path)}.stats.json"
+
+
+# Round a float for the JSON output, keeping None (and NaN, from an empty column) as null
+def _number(value):
+    value = float(value)
+    return None if np.isnan(value) else round(value, 6)
+
+
+# The summary of one column: 'values' is a float array with NaN for missing values
+def summarize(values, bins, percentiles):
+    present = values[~np.isnan(values)]
+    summary = {"count": int(len(present)), "nulls": int(len(values) - len(present))}
+    if not len(present):
+        return {**summary, "min": None, "max": None, "mean": None, "std": None,
+                "percentiles": {f"p{p}": None for p in percentiles}, "histogram": {"edges": [], "counts": []}}
+    counts, edges = np.histogram(present, bins=bins)
+    return {
+        **summary,
+        "min": _number(present.min()),
+        "max": _number(present.max()),
+        "mean": _number(present.mean()),
+        "std": _number(present.std()),
+        "percentiles": {f"p{p}": _number(value) for p, value in zip(percentiles, np.percentile(present, percentiles))},
+        "histogram": {"edges": [_number(edge) for edge in edges], "counts": counts.tolist()},
+    }
+
+
+# Compute the summaries of every feature column and write them to the stats file, replacing it atomically
+# In the sharded layout the columns of all the shards are read and summarized together
+def build_stats(db_path, version, settings, sources=None):
+    start_time = time.perf_counter()
+    parts = []
+    for source in sources or [db_path]:
+        conn = sqlite3.connect(source)
+        try:
+            parts.append(read_features(conn, FEATURE_COLUMNS)[1])
+        finally:
+            conn.close()
+    matrix = np.concatenate(parts)
+    stats = {
+        "catalog_version": version,
+        "rows": len(matrix),
+        "columns": {column: summarize(matrix[:, position], settings["bins"], settings["percentiles"])
+                    for position, column in enumerate(FEATURE_COLUMNS)},
+    }
+    path = stats_path(db_path)
+    staging = f"{path}.{os.getpid()}-{threading.get_ident()}"
+    with open(staging, "w") as file:
+        json.dump(stats, file)
+    os.replace(staging, path)
+    logger.info(f"Built column stats v{version}: {len(matrix)} songs in {time.perf_counter() - start_time:.2f}s")
+    return stats
+
+
+# Read the stats file, or None if there isn't one
+def load_stats(db_path):
+    try:
+        with open(stats_path(db_path)) as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return None
+
+
+# Make sure the stats file is of the database's current catalog version, computing it if it isn't
+# Called by dataParsing at the end of every ingestion; rebuild=True always computes it anew
+def ensure_stats(db_path, settings, rebuild=False, sources=None):
+    version = catalog_version(sources or [db_path])
+    if not rebuild:
+        stats = load_stats(db_path)
+        if stats is not None and stats["catalog_version"] == version:
+            return stats
+    return build_stats(db_path, version, settings, sources)
+
+
+# The summary of the rating column, in the same shape as the others, from the running totals in the database
+# (see db.fetch_rating_summary). The histogram has fixed half-star bins, and the percentiles are interpolated within
+# them, since exact ones would need every rating
+def rating_column(summary, songs, percentiles):
+    count, total, squares = summary["songs"][:3]
+    counts = list(summary["songs"][3:])
+    edges = np.linspace(0, 5, len(counts) + 1)
+    result = {"count": count, "nulls": songs - count, "min": summary["min"], "max": summary["max"]}
+    if not count:
+        return {**result, "mean": None, "std": None, "percentiles": {f"p{p}": None for p in percentiles},
+                "histogram": {"edges": edges.tolist(), "counts": counts}}
+    mean = total / count
+    cumulative = np.concatenate([[0], np.cumsum(counts)])
+    estimates = np.interp(np.array(percentiles) / 100 * count, cumulative, edges)
+    # The estimates can't lie outside the actual ratings
+    estimates = np.clip(estimates, summary["min"], summary["max"])
+    return {
+        **result,
+        "mean": _number(mean),
+        "std": _number(np.sqrt(max(squares / count - mean * mean, 0.0))),
+        "percentiles": {f"p{p}": _number(value) for p, value in zip(percentiles, estimates)},
+        "histogram": {"edges": edges.tolist(), "counts": counts},
+    }
+
+
+# The summary of every rating given through the API, from the running totals of the ratings log
+def ratings_log(summary):
+    count, total, squares = summary["ratings"][:3]
+    counts = list(summary["ratings"][3:])
+    mean = total / count if count else None
+    return {
+        "count": count,
+        "mean": _number(mean) if count else None,
+        "std": _number(np.sqrt(max(squares / count - mean * mean, 0.0))) if count else None,
+        "histogram": {"edges": np.linspace(0, 5, len(counts) + 1).tolist(), "counts": counts},
+    }
+
+
+# The loaded stats file of the current catalog version, shared by the requests of an API process
+# A missing or outdated file (e.g. from before this feature, or while an ingestion is still writing it) is computed
+# on the first request
+class StatsManager:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = None
+        self._key = None
+
+    def current(self, db_path, version, settings, sources=None):
+        stats = self._stats
+        if stats is not None and self._key == (db_path, version):
+            return stats
+        with self._lock:
+            if self._stats is None or self._key != (db_path, version):
+                stats = load_stats(db_path)
+                if stats is None or stats["catalog_version"] != version:
+                    stats = build_stats(db_path, version, settings, sources)
+                self._stats = stats
+                self._key = (db_path, version)
+            return self._stats
+
+    def clear(self):
+        with self._lock:
+            self._stats = None
+            self._key = None
@@ -0,0 +1,266 @@
+import json
+import os
+import re
+
+'''
+Incremental readers for large playlist files.
+Rows are produced one at a time as plain dictionaries, so the memory used does not depend on the size of the file.
+Two layouts are supported:
+1. The columnar JSON written by pandas ({"id": {"0": ...}, "title": {"0": ...}, ...}), which is what input/playlist.json uses
+2. Row-oriented NDJSON, with one JSON object per line
+'''
+
+'''
+The comments are in greater detail to explain each step of the code
+'''
+
+_decoder = json.JSONDecoder()
+_WHITESPACE = " \t\r\n"
+
+# One "key": value pair of a column object, parsed with a single regex match
+# Numbers (by far the most common values) are captured directly; any other value is left for the JSON decoder
+# The lookahead makes sure a number is followed by its delimiter, so a number cut off at the end of the buffer never matches
+_ITEM = re.compile(
+    r'\s*(,)?\s*"((?:[^"\\]|\\.)*)"\s*:\s*'
+    r'(?:(-?(?:0|[1-9]\d*)(\.\d+)?([eE][+-]?\d+)?)(?=\s*[,}]))?',
+    re.S,
+)
+# Everything up to the next closing brace that isn't inside a string, used to skip over a column without decoding it
+_SKIP = re.compile(r'(?:[^"}]++|"(?:[^"\\]++|\\.)*+")*+', re.S)
+
+
+# Turn the raw text of a token read by _JsonScanner back into the UTF-8 text of the file
+# The raw text still holds its \u escapes, so they are unescaped afterwards as written, and plain ASCII is untouched
+def _utf8(raw):
+    return raw if raw.isascii() else raw.encode('latin-1').decode('utf-8')
+
+
+# Reads a JSON document from a binary file a block at a time and parses it one value at a time
+# The file is decoded as latin-1, which maps every byte to exactly one character. That keeps character positions
+# equal to byte offsets, so the position of any value can be handed to another scanner to seek to directly.
+# JSON syntax is plain ASCII, so parsing is unaffected; a token with UTF-8 text in it is decoded again from its raw
+# bytes (see _utf8) before its escapes are read
+class _JsonScanner:
+    def __init__(self, file, offset=0, block_size=1 << 16):
+        self.file = file
+        self.block_size = block_size
+        self.file.seek(offset)
+        self.buffer = ""
+        self.pos = 0
+        self.base = offset # byte offset of buffer[0] in the file
+        self.eof = False
+
+    # Append the next block of the file to the buffer, dropping what has already been parsed
+    def _fill(self):
+        if self.eof:
+            return False
+        data = self.file.read(self.block_size)
+        if not data:
+            self.eof = True
+            return False
+        self.base += self.pos
+        self.buffer = self.buffer[self.pos:] + data.decode('latin-1')
+        self.pos = 0
+        return True
+
+    # Byte offset of the next character to be parsed
+    def offset(self):
+        return self.base + self.pos
+
+    # Return the next non-whitespace character without consuming it ('' at the end of the file)
+    def peek(self):
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill():
+                return ''
+
+    # Consume the given structural character, raising ValueError if something else is found
+    def expect(self, char):
+        found = self.peek()
+        if found != char:
+            raise ValueError(f"Expected '{char}' at byte {self.offset()}, found {found!r}")
+        self.pos += 1
+
+    # Parse the next complete JSON value
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.buffer, self.pos)
+                # A value only counts as complete once the delimiter after it is in the buffer,
+                # otherwise a number cut off at the end of a block ("1." of "1.5") would be returned early
+                after = end
+                while after < len(self.buffer) and self.buffer[after] in _WHITESPACE:
+                    after += 1
+                if (after < len(self.buffer) and self.buffer[after] in ',:]}') or not self._fill():
+                    raw = self.buffer[self.pos:end]
+                    self.pos = end
+                    return value if raw.isascii() else json.loads(_utf8(raw))
+            except json.JSONDecodeError:
+                if not self._fill():
+                    raise
+
+    # Read the next "key": value pair of the current object, or return None once the object is closed
+    # 'first' tells whether this is the first pair, which isn't preceded by a comma
+    def next_item(self, first):
+        match = _ITEM.match(self.buffer, self.pos)
+        while match is None:
+            if self.peek() == '}':
+                self.pos += 1
+                return None
+            if not self._fill():
+                break
+            match = _ITEM.match(self.buffer, self.pos)
+        if match is not None:
+            comma, key, number, fraction, exponent = match.groups()
+            if (comma is None) == first:
+                key = _utf8(key)
+                if '\\' in key:
+                    key = json.loads(f'"{key}"')
+                self.pos = match.end()
+                if number is None:
+                    return key, self.value()
+                if fraction or exponent:
+                    return key, float(number)
+                return key, int(number)
+        # Anything unusual goes through the slower general path, which also produces the error messages
+        if self.peek() == '}':
+            self.pos += 1
+            return None
+        if not first:
+            self.expect(',')
+        key = self.value()
+        self.expect(':')
+        return key, self.value()
+
+    # Move past the end of the current object, assuming its values are plain scalars (as in a column object)
+    def skip_object(self):
+        while True:
+            self.pos = _SKIP.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer) and self.buffer[self.pos] == '}':
+                self.pos += 1
+                return
+            # The closing brace, or the end of a string, is in a block that hasn't been read yet
+            if not self._fill():
+                raise ValueError("Unexpected end of file inside an object")
+
+
+# Yield the rows of a columnar JSON file as dictionaries
+# A first pass notes where each column's object starts, then one scanner per column walks all the columns in lockstep,
+# so only a single row of each column is held in memory at a time
+def iter_columnar(path):
+    columns = []
+    with open(path, 'rb') as file:
+        scanner = _JsonScanner(file)
+        scanner.expect('{')
+        first = True
+        while scanner.peek() != '}':
+            if not first:
+                scanner.expect(',')
+            name = scanner.value()
+            scanner.expect(':')
+            if scanner.peek() != '{':
+                raise ValueError(f"Column '{name}' is not an object of row values")
+            columns.append((name, scanner.offset()))
+            # Skip over the column's values
+            scanner.expect('{')
+            scanner.skip_object()
+            first = False
+
+    if not columns:
+        return
+    files = [open(path, 'rb') for _ in columns]
+    try:
+        scanners = []
+        for file, (_, offset) in zip(files, columns):
+            scanner = _JsonScanner(file, offset)
+            scanner.expect('{')
+            scanners.append(scanner)
+        first = True
+        while True:
+            items = [scanner.next_item(first) for scanner in scanners]
+            first = False
+            if all(item is None for item in items):
+                return
+            if any(item is None for item in items):
+                raise ValueError("Columns have different numbers of rows")
+            row_key = items[0][0]
+            if any(item[0] != row_key for item in items):
+                raise ValueError(f"Columns are not in the same row order at row '{row_key}'")
+            yield {name: item[1] for (name, _), item in zip(columns, items)}
+    finally:
+        for file in files:
+            file.close()
+
+
+# Yield the rows of an NDJSON file as dictionaries, skipping blank lines
+def iter_ndjson(path):
+    with open(path, 'r', encoding='utf-8') as file:
+        for line_number, line in enumerate(file, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            row = json.loads(line)
+            if not isinstance(row, dict):
+                raise ValueError(f"Line {line_number} is not a JSON object")
+            yield row
+
+
+# Split an NDJSON file into byte ranges of roughly rows_per_range lines each, so the ranges can be parsed in parallel
+# The average line length is estimated from the start of the file, and every boundary is moved to the next line break
+def ndjson_ranges(path, rows_per_range):
+    size = os.path.getsize(path)
+    with open(path, 'rb') as file:
+        sample = file.read(1 << 16)
+        line_length = max(1, len(sample) // max(1, sample.count(b'\n')))
+        step = max(1, rows_per_range * line_length)
+        ranges = []
+        start = 0
+        while start < size:
+            end = min(size, start + step)
+            if end < size:
+                file.seek(end)
+                file.readline()
+                end = file.tell()
+            ranges.append((start, end))
+            start = end
+    return ranges
+
+
+# Yield the rows of one byte range of an NDJSON file, as produced by ndjson_ranges
+def iter_ndjson_range(path, start, end):
+    with open(path, 'rb') as file:
+        file.seek(start)
+        data = file.read(end - start)
+    for line in data.decode('utf-8').splitlines():
+        line = line.strip()
+        if line:
+            row = json.loads(line)
+            if not isinstance(row, dict):
+                raise ValueError(f"A line in bytes {start}-{end} is not a JSON object")
+            yield row
+
+
+# Pick the reader from the file extension - .ndjson/.jsonl are row-oriented, anything else is columnar JSON
+def is_ndjson(path):
+    return str(path).lower().endswith(('.ndjson', '.jsonl'))
+
+def iter_rows(path):
+    if is_ndjson(path):
+        return iter_ndjson(path)
+    return iter_columnar(path)
+
+
+# Group rows into lists of at most chunk_size rows
+def iter_chunks(rows, chunk_size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
@@ -0,0 +1,156 @@
+import asyncio
+import threading
+import time
+import pytest
+from unittest.mock import patch
+from werkzeug.datastructures import MultiDict
+from admission import ConcurrencyLimit, Rejected, admission_settings, request_class
+from api import app, response_cache
+from test_asgi import call
+
+ROWS = ([{"rowid": 1, "id": "001", "title": "Test Song", "rating": 4.0}], 1)
+
+
+# Flask test client with the admission settings given as the fixture's parameter, over mocked database calls
+@pytest.fixture
+def admitted(request):
+    config = {"snapshot": {"enabled": False}, "admission": {"enabled": True, **request.param}}
+    response_cache.clear()
+    with patch('api.get_config', return_value=config), \
+            patch('api.get_data_version', side_effect=lambda: time.monotonic_ns()), \
+            patch('api.fetch_songs', return_value=ROWS), \
+            patch('api.count_songs', return_value=1), \
+            patch('api.fetch_song_by_id', return_value=[{"id": "001", "title": "Test Song"}]), \
+            patch('api.update_rating', return_value=1), \
+            app.test_client() as client:
+        yield client
+
+
+# ---------------------------------------
+# 1. Test requests are classified by their estimated cost
+# ---------------------------------------
+def test_request_class():
+    settings = admission_settings({})
+
+    def classify(rule, query="", method="GET", **values):
+        return request_class(settings, rule, method, MultiDict([item.split("=") for item in query.split("&") if item]),
+                             values)
+
+    assert classify("/songs") == "read"
+    assert classify("/songs", "limit=100") == "read"
+    assert classify("/songs", "limit=101") == "expensive"
+    assert classify("/songs", "limit=bad") == "read"
+    assert classify("/songs", "page=2000&limit=10") == "expensive"
+    assert classify("/songs", "page=2000&limit=10&after=abc") == "read"
+    assert classify("/songs", "sort=-tempo,energy&energy_gte=0.5&rating_lt=4") == "read"
+    assert classify("/songs", "sort=title") == "expensive"
+    assert classify("/songs", "sort=-tempo,-speechiness") == "expensive"
+    assert classify("/songs", "key_gte=3") == "expensive"
+    assert classify("/export/songs") == "expensive"
+    assert classify("/songs/<string:song_name>", song_name="Love Song") == "read"
+    assert classify("/songs/<string:song_name>", song_name="Lo") == "expensive"
+    assert classify("/songs/<string:song_name>", song_name="%") == "expensive"
+    assert classify("/songs/<string:song_name>", "match=exact", song_name="Lo") == "read"
+    assert classify("/songs/<song_id>/similar", "exact=true", song_id="001") == "expensive"
+    assert classify("/songs/<song_id>/rate", method="POST", song_id="001") == "write"
+
+
+# ---------------------------------------
+# 2. Test every client gets its own token bucket, and expensive requests cost more
+# ---------------------------------------
+@pytest.mark.parametrize("admitted", [{"rate": 0.5, "burst": 4, "costs": {"expensive": 3},
+                                       "client_header": "X-Forwarded-For"}], indirect=True)
+def test_rate_limit(admitted):
+    assert admitted.get('/songs?limit=500').status_code == 200
+    assert admitted.get('/songs').status_code == 200
+    response = admitted.get('/songs')
+    assert response.status_code == 429
+    assert response.get_json() == {"error": "Too many requests, slow down"}
+    # One token is missing, and the bucket gains one every 2 seconds
+    assert response.headers["Retry-After"] == "2"
+    # Other clients, and the exempt endpoints, are not affected
+    assert admitted.get('/songs', headers={"X-Forwarded-For": "10.0.0.2, 10.0.0.1"}).status_code == 200
+    assert admitted.get('/metrics').status_code == 200
+
+    # The ASGI app applies the same limits
+    client = [("X-Forwarded-For", "10.0.0.3")]
+    assert [call("GET", "/songs", headers=client)[0] for _ in range(4)] == [200] * 4
+    status, headers, _ = call("GET", "/songs", headers=client)
+    assert status == 429 and headers["retry-after"] == "2"
+
+
+# ---------------------------------------
+# 3. Test the concurrency limit queues requests in order, up to its queue size and timeout
+# ---------------------------------------
+def test_concurrency_limit():
+    limit = ConcurrencyLimit(1, 1, timeout=5)
+    limit.acquire()
+    admitted = threading.Event()
+
+    def wait():
+        limit.acquire()
+        admitted.set()
+
+    waiter = threading.Thread(target=wait)
+    waiter.start()
+    while limit.stats()["waiting"] == 0:
+        time.sleep(0.001)
+    # The queue is full, so the next request is turned away straight away
+    with pytest.raises(Rejected) as rejected:
+        limit.acquire()
+    assert rejected.value.status == 503
+    # Releasing the slot hands it to the waiting request
+    limit.release()
+    waiter.join()
+    assert admitted.is_set()
+    assert limit.stats() == {"active": 1, "waiting": 0, "limit": 1, "queue": 1}
+
+    # A request that waits longer than the timeout gives up its place in the queue
+    limit.timeout = 0.01
+    with pytest.raises(Rejected):
+        limit.acquire()
+    assert limit.stats()["waiting"] == 0
+
+    async def queued():
+        task = asyncio.ensure_future(limit.acquire_async())
+        await asyncio.sleep(0)
+        assert limit.stats()["waiting"] == 1
+        limit.release()
+        await task
+
+    limit.timeout = 5
+    asyncio.run(queued())
+    limit.release()
+    assert limit.stats()["active"] == 0
+
+
+# ---------------------------------------
+# 4. Test expensive requests are shed while writes and cheap reads keep going
+# ---------------------------------------
+@pytest.mark.parametrize("admitted", [{"concurrency": {"expensive": {"limit": 1, "queue": 0}}, "retry_after": 3}],
+                         indirect=True)
+def test_load_shedding(admitted):
+    started, finish = threading.Event(), threading.Event()
+
+    def slow_page(*args, **kwargs):
+        started.set()
+        finish.wait(5)
+        return ROWS
+
+    statuses = []
+    with patch('api.fetch_songs', side_effect=slow_page):
+        other = app.test_client()
+        thread = threading.Thread(target=lambda: statuses.append(other.get('/songs?limit=1000').status_code))
+        thread.start()
+        started.wait(5)
+        response = admitted.get('/songs?limit=500')
+        assert response.status_code == 503
+        assert response.headers["Retry-After"] == "3"
+        assert call("GET", "/export/songs")[0] == 503
+        assert admitted.get('/songs/Test%20Song').status_code == 200
+        assert admitted.post('/songs/001/rate', json={"rating": 4}).status_code == 200
+        finish.set()
+        thread.join()
+    assert statuses == [200]
+    # The slot was given back once the slow request finished
+    assert admitted.get('/songs?limit=500').status_code == 200
@@ -1,23 +1,34 @@
 import pytest
-from api import app
-from unittest.mock import patch
+import sqlite3
+import time
+import pandas as pd
+import db
+from api import app, encode_cursor, decode_cursor, response_cache
+from unittest.mock import patch, MagicMock
+from writer import WriterBusy
+from dataParsing import save_to_db
+from test_dataParsing import valid_song_data
 
 @pytest.fixture
 #Flask test client
 def client():
     app.config['TESTING'] = True
-    with app.test_client() as client:
+    # Every test starts with an empty response cache and a fixed data version
+    response_cache.clear()
+    with patch('api.get_data_version', return_value=1), app.test_client() as client:
         yield client
 
 # ----------------------------
 # 1. Test GET /songs
 # ----------------------------
-@patch('api.fetch_all_songs') # Mocking the fetch_all_songs function
-def test_get_all_songs(mock_fetch_all, client):
-    # Simulating data returned from database
-    mock_fetch_all.return_value = [
-        {"id": "001", "title": "Test Song", "rating": 4.0}
-    ]
+@patch('api.count_songs') # Mocking the count_songs function
+@patch('api.fetch_songs') # Mocking the fetch_songs function
+def test_get_all_songs(mock_fetch, mock_count, client):
+    # Simulating data returned from database - one page of rows and no next page
+    mock_fetch.return_value = (
+        [{"rowid": 1, "id": "001", "title": "Test Song", "rating": 4.0}], None
+    )
+    mock_count.return_value = 1
     # Making a GET request to the /songs endpoint
     response = client.get('/songs?page=1&limit=10')
     # Checking if the response is successful and contains the expected data structure
@@ -30,9 +41,43 @@ def test_get_all_songs(mock_fetch_all, client):
     # Checking if the data is a list and contains the expected song
     assert isinstance(data["data"], list)
     assert data["data"][0]["title"] == "Test Song"
+    assert "rowid" not in data["data"][0]
+    # Songs without ratings still get an empty ratings summary
+    assert data["data"][0]["ratings"] == {"count": 0, "mean": None, "histogram": [0, 0, 0, 0, 0, 0]}
     assert data["page"] == 1
     assert data["limit"] == 10
     assert data["total"] == 1
+    assert data["next"] is None
+    # Checking that the pagination was pushed down to the database
+    mock_fetch.assert_called_once_with(10, offset=0, after=None, filters=(), sort=(), fragments=True)
+
+# ----------------------------------------
+# 1a. Test GET /songs with a keyset cursor
+# ----------------------------------------
+@patch('api.count_songs')
+@patch('api.fetch_songs')
+def test_get_all_songs_cursor(mock_fetch, mock_count, client):
+    mock_fetch.return_value = (
+        [{"rowid": 7, "id": "007", "title": "Next Song", "rating": None}], 7
+    )
+    mock_count.return_value = 20
+    # The cursor returned in "next" is fed back through ?after=
+    cursor = encode_cursor(6)
+    response = client.get(f'/songs?limit=1&after={cursor}')
+    assert response.status_code == 200
+    data = response.get_json()
+    mock_fetch.assert_called_once_with(1, offset=0, after=6, filters=(), sort=(), fragments=True)
+    assert decode_cursor(data["next"]) == 7
+
+# ----------------------------------------
+# 1b. Test GET /songs with an invalid cursor
+# ----------------------------------------
+@patch('api.fetch_songs')
+def test_get_all_songs_invalid_cursor(mock_fetch, client):
+    response = client.get('/songs?after=not-a-cursor')
+    assert response.status_code == 400
+    assert "error" in response.json
+    mock_fetch.assert_not_called()
 
 # ------------------------------------
 # 2. Test GET /songs/<song_id> success
@@ -40,12 +85,26 @@ def test_get_all_songs(mock_fetch_all, client):
 @patch('api.fetch_song_by_id') # Mocking the fetch_song_by_id function
 def test_get_song_by_id_found(mock_fetch, client):
     # Simulating data returned from database
-    mock_fetch.return_value = {"id": "001", "title": "Test Song", "rating": 4.0}
+    mock_fetch.return_value = [{"id": "001", "title": "Test Song", "rating": 4.0}]
     # Making a GET request to the /songs/<song_id> endpoint
-    response = client.get('/songs/001')
+    response = client.get('/songs/Test')
     # Checking if the response is successful and contains the expected song data
     assert response.status_code == 200
-    assert response.json['title'] == "Test Song"
+    assert response.json[0]['title'] == "Test Song"
+    mock_fetch.assert_called_once_with("Test", exact=False, fragments=True)
+
+# ------------------------------------------
+# 2a. Test GET /songs/<song_id> exact match
+# ------------------------------------------
+@patch('api.fetch_song_by_id')
+def test_get_song_by_id_exact(mock_fetch, client):
+    mock_fetch.return_value = [{"id": "001", "title": "Test Song", "rating": 4.0}]
+    response = client.get('/songs/Test Song?match=exact')
+    assert response.status_code == 200
+    mock_fetch.assert_called_once_with("Test Song", exact=True, fragments=True)
+    # Unknown match modes are rejected
+    response = client.get('/songs/Test?match=fuzzy')
+    assert response.status_code == 400
 
 # ------------------------------------
 # 3. Test GET /songs/<song_id> failure
@@ -112,3 +171,188 @@ def test_rate_song_non_json(client):
     response = client.post('/songs/001/rate', data="not-json")
     assert response.status_code == 400
     assert "error" in response.json
+
+
+# ------------------------------------------------------
+# 9. Test response caching and ETags
+# ------------------------------------------------------
+@patch('api.count_songs')
+@patch('api.fetch_songs')
+def test_get_all_songs_cached(mock_fetch, mock_count, client):
+    mock_fetch.return_value = ([{"rowid": 1, "id": "001", "title": "Test Song", "rating": 4.0}], None)
+    mock_count.return_value = 1
+    before = client.get('/cache/stats').get_json()
+    first = client.get('/songs?page=1&limit=10')
+    assert first.headers['X-Cache'] == 'MISS'
+    # The same query (spelled differently) is answered from the cache
+    second = client.get('/songs?limit=10')
+    assert second.headers['X-Cache'] == 'HIT'
+    assert second.get_data() == first.get_data()
+    assert mock_fetch.call_count == 1
+    # A client that already has the body gets a 304 without it
+    revalidated = client.get('/songs?limit=10', headers={'If-None-Match': first.headers['ETag']})
+    assert revalidated.status_code == 304
+    assert revalidated.get_data() == b""
+    # A write moves the data version on, so the page is rebuilt
+    with patch('api.get_data_version', return_value=2):
+        third = client.get('/songs?limit=10')
+    assert third.headers['X-Cache'] == 'MISS'
+    assert mock_fetch.call_count == 2
+    stats = client.get('/cache/stats').get_json()
+    assert stats["hits"] - before["hits"] == 2
+    assert stats["misses"] - before["misses"] == 2
+
+
+@patch('api.fetch_song_by_id')
+def test_get_song_not_found_cached(mock_fetch, client):
+    mock_fetch.return_value = []
+    assert client.get('/songs/missing').status_code == 404
+    response = client.get('/songs/missing')
+    assert response.status_code == 404
+    assert response.headers['X-Cache'] == 'HIT'
+    assert "ETag" not in response.headers
+
+
+# ------------------------------------------------------
+# 10. Test POST /songs/rate with per-item results
+# ------------------------------------------------------
+@patch('api.update_ratings')
+def test_rate_songs_bulk(mock_update, client):
+    # Only the valid items reach the database, in one call
+    mock_update.return_value = [1, 0]
+    response = client.post('/songs/rate', json=[
+        {"id": "001", "rating": 4.5},
+        {"id": "002", "rating": 9},
+        {"id": "999", "rating": 1},
+        {"rating": 2},
+    ])
+    assert response.status_code == 200
+    data = response.get_json()
+    mock_update.assert_called_once_with([("001", 4.5), ("999", 1.0)])
+    assert data["updated"] == 1
+    assert [result["status"] for result in data["results"]] == [200, 400, 404, 400]
+    assert data["results"][1]["error"] == "Rating must be between 0 and 5"
+    assert data["results"][2]["error"] == "Song not found"
+
+
+@patch('api.update_ratings')
+def test_rate_songs_bulk_invalid_body(mock_update, client):
+    assert client.post('/songs/rate', json={"id": "001", "rating": 4}).status_code == 400
+    assert client.post('/songs/rate', data="not-json").status_code == 400
+    with patch('api.get_config', return_value={"max_bulk_ratings": 2}):
+        response = client.post('/songs/rate', json=[{"id": "001", "rating": 1}] * 3)
+    assert response.status_code == 400
+    mock_update.assert_not_called()
+
+
+# ------------------------------------------------------
+# 11. Test POST /songs/<song_id>/rate through the background writer
+# ------------------------------------------------------
+@patch('api.update_rating')
+def test_rate_song_through_writer(mock_update, client):
+    writer = MagicMock()
+    writer.update_rating.return_value = 1
+    with patch('api.get_rating_writer', return_value=writer):
+        assert client.post('/songs/001/rate', json={"rating": 2}).status_code == 200
+        writer.update_rating.return_value = 0
+        assert client.post('/songs/999/rate', json={"rating": 2}).status_code == 404
+        # A full queue is reported as 503 so clients back off
+        writer.update_rating.side_effect = WriterBusy()
+        response = client.post('/songs/001/rate', json={"rating": 2})
+    assert response.status_code == 503
+    assert "error" in response.json
+    mock_update.assert_not_called()
+
+
+# ------------------------------------------------------
+# 12. Test GET /songs exposes the rating stats
+# ------------------------------------------------------
+@patch('api.count_songs')
+@patch('api.fetch_songs')
+def test_get_all_songs_rating_stats(mock_fetch, mock_count, client):
+    row = {"rowid": 1, "id": "001", "title": "Test Song", "rating": 3.5, "rating_count": 2, "rating_mean": 3.5,
+           "rating_hist_0": 0, "rating_hist_1": 0, "rating_hist_2": 1, "rating_hist_3": 0, "rating_hist_4": 0,
+           "rating_hist_5": 1}
+    mock_fetch.return_value = ([row], None)
+    mock_count.return_value = 1
+    song = client.get('/songs').get_json()["data"][0]
+    assert song["ratings"] == {"count": 2, "mean": 3.5, "histogram": [0, 0, 1, 0, 0, 1]}
+    assert not any(key.startswith("rating_") for key in song)
+
+
+# ------------------------------------------------------
+# 13. Test GET /songs range filters and sorting
+# ------------------------------------------------------
+@patch('api.count_songs')
+@patch('api.fetch_songs')
+def test_get_all_songs_filtered_sorted(mock_fetch, mock_count, client):
+    mock_fetch.return_value = ([{"rowid": 9, "id": "009", "tempo": 150.0, "energy": 0.8}], [150.0, 0.8, 9])
+    mock_count.return_value = 40
+    response = client.get('/songs?energy_gte=0.7&tempo_lt=180&sort=-tempo,energy&limit=1')
+    assert response.status_code == 200
+    filters = (("energy", "gte", 0.7), ("tempo", "lt", 180.0))
+    sort = (("tempo", True), ("energy", False))
+    mock_fetch.assert_called_once_with(1, offset=0, after=None, filters=filters, sort=sort, fragments=True)
+    mock_count.assert_called_once_with(filters)
+    data = response.get_json()
+    assert data["total"] == 40
+    # The cursor carries the sort values of the last song and only works with the same number of sort keys
+    assert decode_cursor(data["next"]) == [150.0, 0.8, 9]
+    client.get(f'/songs?energy_gte=0.7&tempo_lt=180&sort=-tempo,energy&limit=1&after={data["next"]}')
+    assert mock_fetch.call_args.kwargs["after"] == (150.0, 0.8, 9)
+    assert client.get(f'/songs?after={data["next"]}').status_code == 400
+    assert client.get(f'/songs?sort=-tempo&after={encode_cursor(9)}').status_code == 400
+
+
+@patch('api.fetch_songs')
+def test_get_all_songs_invalid_filters(mock_fetch, client):
+    for query in ('title_gte=a', 'energy_gte=high', 'energy_lt=nan', 'sort=bogus', 'sort=tempo,-tempo',
+                  'sort=tempo,energy,valence,key'):
+        response = client.get(f'/songs?{query}')
+        assert response.status_code == 400, query
+        assert "error" in response.json
+    mock_fetch.assert_not_called()
+
+
+# ------------------------------------------------------
+# 14. Test listings rebuilt after writes by another process have the right total
+# ------------------------------------------------------
+def test_listing_total_after_external_write(tmp_path):
+    db_path = str(tmp_path / "playlist.db")
+    df = pd.DataFrame(valid_song_data(5))
+    df["rating"] = None
+    with patch('dataParsing.get_config', return_value={}):
+        save_to_db(df, db_path)
+    config = {"db_path": db_path, "snapshot": {"enabled": False}}
+    response_cache.clear()
+    db.invalidate_count_cache()
+    with patch('db.get_config', return_value=config), patch('api.get_config', return_value=config), \
+            app.test_client() as client:
+        first = client.get('/songs?rating_gte=3')
+        assert first.get_json()["total"] == 0
+        listing = client.get('/songs')
+        assert listing.get_json()["total"] == 5
+        # A rating written by another process only moves the data version on in the database
+        conn = sqlite3.connect(db_path)
+        db._insert_rating(conn, "001", 4.0, time.time())
+        db.bump_data_version(conn)
+        conn.commit()
+        conn.close()
+        second = client.get('/songs?rating_gte=3')
+        assert second.headers["ETag"] != first.headers["ETag"]
+        assert second.get_json()["total"] == 1
+        # The unfiltered listing is rebuilt with the new rating, but its total is still served from the count cache
+        with patch.object(db.logger, 'info', wraps=db.logger.info) as log:
+            rebuilt = client.get('/songs')
+        assert rebuilt.headers["ETag"] != listing.headers["ETag"]
+        assert rebuilt.get_json()["total"] == 5
+        assert not any("Counting songs" in call.args[0] for call in log.call_args_list)
+        # An ingestion by another process moves the catalog version on, and the total is counted again
+        conn = sqlite3.connect(db_path)
+        conn.execute("INSERT INTO songs (id, title) VALUES ('006', 'Song 6')")
+        db.bump_data_version(conn, catalog=True)
+        conn.commit()
+        conn.close()
+        assert client.get('/songs').get_json()["total"] == 6
+    db.pool.close_all()
+    db.invalidate_count_cache()
@@ -0,0 +1,135 @@
+import asyncio
+import json
+import pytest
+from api import app, response_cache
+from asgi import application, DatabaseExecutor
+from unittest.mock import patch
+
+ROWS = ([{"rowid": 1, "id": "001", "title": "Test Song", "rating": 4.0}], 1)
+
+@pytest.fixture
+# Flask test client, to compare the ASGI responses against
+def client():
+    app.config['TESTING'] = True
+    response_cache.clear()
+    with patch('api.get_data_version', return_value=1), \
+            patch('api.fetch_songs', return_value=ROWS), \
+            patch('api.count_songs', return_value=1), \
+            patch('api.fetch_song_by_id', return_value=[{"id": "001", "title": "Test Song"}]), \
+            app.test_client() as client:
+        yield client
+
+# Send one request to the ASGI app and return (status, headers, body)
+def call(method, path, query="", headers=(), body=b""):
+    scope = {"type": "http", "method": method, "path": path, "query_string": query.encode(),
+             "headers": [(key.lower().encode(), value.encode()) for key, value in headers]}
+    messages = [{"type": "http.request", "body": body, "more_body": False}]
+    sent = []
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(application(scope, receive, send))
+    headers = {key.decode(): value.decode() for key, value in sent[0]["headers"]}
+    return sent[0]["status"], headers, sent[1]["body"]
+
+# -------------------------------------------------
+# 1. Test GET /songs matches the Flask app byte for byte
+# -------------------------------------------------
+def test_asgi_get_all_matches_flask(client):
+    expected = client.get('/songs?page=1&limit=10')
+    response_cache.clear()
+    status, headers, body = call("GET", "/songs", "page=1&limit=10")
+    assert status == 200
+    assert body == expected.get_data()
+    assert headers["content-type"] == "application/json"
+    assert headers["x-cache"] == "MISS"
+    assert headers["etag"] == expected.headers["ETag"]
+
+# -------------------------------------------------
+# 2. Test GET /songs validation errors
+# -------------------------------------------------
+def test_asgi_get_all_invalid(client):
+    expected = client.get('/songs?page=0')
+    status, _, body = call("GET", "/songs", "page=0")
+    assert status == 400
+    assert body == expected.get_data()
+    status, _, body = call("GET", "/songs", "after=!!")
+    assert status == 400
+    assert json.loads(body) == {"error": "Invalid cursor"}
+
+# -------------------------------------------------
+# 3. Test the response cache and conditional requests
+# -------------------------------------------------
+def test_asgi_cache_and_etag(client):
+    status, headers, _ = call("GET", "/songs/Test")
+    assert status == 200 and headers["x-cache"] == "MISS"
+    status, headers, _ = call("GET", "/songs/Test")
+    assert headers["x-cache"] == "HIT"
+    status, _, body = call("GET", "/songs/Test", headers=[("If-None-Match", headers["etag"])])
+    assert status == 304
+    assert body == b""
+    # The Flask app shares the same cache
+    assert client.get('/songs/Test').headers["X-Cache"] == "HIT"
+
+# -------------------------------------------------
+# 4. Test POST /songs/<id>/rate
+# -------------------------------------------------
+@patch('api.update_rating')
+def test_asgi_rate(mock_update, client):
+    mock_update.return_value = 1
+    status, _, body = call("POST", "/songs/001/rate", headers=[("Content-Type", "application/json")],
+                           body=b'{"rating": 4.5}')
+    assert status == 200
+    assert body == client.post('/songs/001/rate', json={"rating": 4.5}).get_data()
+    mock_update.assert_called_with("001", 4.5)
+
+    mock_update.return_value = 0
+    status, _, body = call("POST", "/songs/999/rate", headers=[("Content-Type", "application/json")],
+                           body=b'{"rating": 4.5}')
+    assert status == 404
+    assert json.loads(body) == {"error": "Song not found"}
+
+    status, _, body = call("POST", "/songs/001/rate", body=b'rating=4')
+    assert status == 400
+    assert json.loads(body) == {"error": "Request must be JSON"}
+
+    status, _, _ = call("POST", "/songs/001/rate", headers=[("Content-Type", "application/json")], body=b'{')
+    assert status == 400
+
+# -------------------------------------------------
+# 5. Test unknown URLs and methods
+# -------------------------------------------------
+def test_asgi_not_found(client):
+    status, _, body = call("GET", "/nothing")
+    assert status == 404
+    assert body == client.get('/nothing').get_data()
+    status, headers, _ = call("DELETE", "/songs")
+    assert status == 405
+    assert "GET" in headers["allow"]
+
+# -------------------------------------------------
+# 6. Test the executor never runs more than max_pending jobs at once
+# -------------------------------------------------
+def test_database_executor_bounded():
+    executor = DatabaseExecutor(threads=4, max_pending=2)
+    running = []
+    peak = []
+
+    def job():
+        import time
+        running.append(1)
+        peak.append(len(running))
+        time.sleep(0.02)
+        running.pop()
+        return 1
+
+    async def main():
+        return await asyncio.gather(*(executor.run(job) for _ in range(8)))
+
+    assert asyncio.run(main()) == [1] * 8
+    assert max(peak) <= 2
+    executor.shutdown()
@@ -0,0 +1,69 @@
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks"))
+
+from dataParsing import load_data, validate_frame
+from generate import COLUMNS, generate
+from suite import compare, flatten
+
+
+# ---------------------------------------
+# 1. Test the generated catalog has the input file layout
+# ---------------------------------------
+def test_generate_columnar(tmp_path):
+    path = str(tmp_path / "songs.json")
+    assert generate(path, 500, invalid_fraction=0.0) == 0
+    with open(path) as file:
+        data = json.load(file)
+    assert list(data) == COLUMNS
+    assert list(data["id"])[:3] == ["0", "1", "2"]
+    assert len(data["title"]) == 500
+    validated, rejected = validate_frame(load_data(path))
+    assert len(validated) == 500 and rejected == []
+    assert validated["id"].str.len().eq(22).all()
+
+
+# ---------------------------------------
+# 2. Test the fraction of invalid rows is rejected by validation
+# ---------------------------------------
+def test_generate_invalid_rows(tmp_path):
+    path = str(tmp_path / "songs.json")
+    assert generate(path, 1000, invalid_fraction=0.05, seed=7) == 50
+    validated, rejected = validate_frame(load_data(path))
+    assert len(validated) == 950
+    assert len(rejected) == 50
+
+
+# ---------------------------------------
+# 3. Test the same seed gives the same songs in both formats
+# ---------------------------------------
+def test_generate_ndjson_matches(tmp_path):
+    columnar, ndjson = str(tmp_path / "songs.json"), str(tmp_path / "songs.ndjson")
+    generate(columnar, 300, invalid_fraction=0.1, seed=1)
+    generate(ndjson, 300, invalid_fraction=0.1, seed=1)
+    with open(ndjson) as file:
+        rows = [json.loads(line) for line in file]
+    with open(columnar) as file:
+        data = json.load(file)
+    assert rows == [{column: data[column][str(index)] for column in COLUMNS} for index in range(300)]
+
+
+# ---------------------------------------
+# 4. Test comparing two results files
+# ---------------------------------------
+def test_compare():
+    before = {"results": {"1000": {"save_to_db": {"seconds": 1.0, "rows": 1000, "rows_per_sec": 1000},
+                                   "api": {"wsgi": {"p99_ms": 10.0, "requests_per_sec": 500.0}}}}}
+    after = {"results": {"1000": {"save_to_db": {"seconds": 1.05, "rows": 1000, "rows_per_sec": 952},
+                                  "api": {"wsgi": {"p99_ms": 20.0, "requests_per_sec": 300.0}}}}}
+    assert flatten(before["results"])["1000.api.wsgi.p99_ms"] == 10.0
+    rows = {metric: worse for metric, _, _, _, worse in compare(before, after, threshold=0.1)}
+    # Row counts aren't compared; a 5% slowdown is within the threshold, a doubled p99 and a 40% drop in throughput are not
+    assert rows == {
+        "1000.save_to_db.seconds": False,
+        "1000.save_to_db.rows_per_sec": False,
+        "1000.api.wsgi.p99_ms": True,
+        "1000.api.wsgi.requests_per_sec": True,
+    }
@@ -0,0 +1,48 @@
+import pytest
+from unittest.mock import patch
+from cache import ResponseCache
+
+
+# ----------------------------
+# 1. Test LRU eviction
+# ----------------------------
+def test_cache_evicts_least_recently_used():
+    cache = ResponseCache(max_entries=2, max_bytes=1000, ttl=60)
+    cache.put("a", 200, b"a", "etag-a")
+    cache.put("b", 200, b"b", "etag-b")
+    # Reading "a" makes "b" the least recently used entry
+    assert cache.get("a").body == b"a"
+    cache.put("c", 200, b"c", "etag-c")
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+    assert cache.stats()["evictions"] == 1
+
+
+# ----------------------------
+# 2. Test the byte budget
+# ----------------------------
+def test_cache_bounded_by_bytes():
+    cache = ResponseCache(max_entries=10, max_bytes=10, ttl=60)
+    cache.put("a", 200, b"123456", "a")
+    cache.put("b", 200, b"123456", "b")
+    assert cache.get("a") is None
+    assert cache.stats()["bytes"] == 6
+    # A body bigger than the whole budget is not cached
+    cache.put("c", 200, b"x" * 11, "c")
+    assert cache.get("c") is None
+
+
+# ----------------------------
+# 3. Test expiry
+# ----------------------------
+def test_cache_ttl():
+    cache = ResponseCache(ttl=5)
+    with patch('cache.time.monotonic', return_value=100.0):
+        cache.put("a", 200, b"a", "a")
+    with patch('cache.time.monotonic', return_value=104.0):
+        assert cache.get("a") is not None
+    with patch('cache.time.monotonic', return_value=106.0):
+        assert cache.get("a") is None
+    assert cache.stats() == {
+        "hits": 1, "misses": 1, "hit_ratio": 0.5, "evictions": 0, "entries": 0, "bytes": 0,
+    }
@@ -1,9 +1,11 @@
 import pytest
-from dataParsing import Song, load_config, load_data, validate_songs
+from unittest.mock import patch
+from dataParsing import Song, SONG_COLUMNS, load_config, load_data, validate_songs, validate_frame, ingest_stream, save_to_db, upsert_songs
 import pandas as pd
 from pydantic import ValidationError
 import json
 import logging
+import sqlite3
 
 # Set up logging for testing
 logging.basicConfig(level=logging.INFO,
@@ -139,4 +141,197 @@ def test_validate_songs_invalid():
     df = pd.DataFrame(data)
     validated = validate_songs(df)
     # Check if the validation catches the error and returns no valid songs
-    assert len(validated) == 0
\ No newline at end of file
+    assert len(validated) == 0
+
+# -----------------------------
+# 4a. Test Column-wise Validation
+# -----------------------------
+def valid_song_data(rows=3):
+    return {
+        "id": [f"{i:03d}" for i in range(rows)],
+        "title": [f"Song {i}" for i in range(rows)],
+        "danceability": [0.7] * rows,
+        "energy": [0.8] * rows,
+        "key": [5] * rows,
+        "loudness": [-5.2] * rows,
+        "mode": [1] * rows,
+        "acousticness": [0.2] * rows,
+        "instrumentalness": [0.1] * rows,
+        "liveness": [0.15] * rows,
+        "valence": [0.6] * rows,
+        "tempo": [120.0] * rows,
+        "duration_ms": [210000] * rows,
+        "time_signature": [4] * rows,
+        "num_bars": [80] * rows,
+        "num_sections": [10] * rows,
+        "num_segments": [240] * rows,
+        "class": [1] * rows,
+    }
+
+def test_validate_frame_valid():
+    df = pd.DataFrame(valid_song_data())
+    validated, rejected = validate_frame(df)
+    # Every row passes, in the songs table layout, without going through the model
+    assert rejected == []
+    assert list(validated.columns) == SONG_COLUMNS
+    assert validated["title"].tolist() == ["Song 0", "Song 1", "Song 2"]
+    assert validated["rating"].isna().all()
+
+def test_validate_frame_matches_model():
+    data = valid_song_data(6)
+    data["key"] = [5, "7", "x", 5, 5, 5]  # "7" is coerced by the model, "x" is rejected
+    data["mode"] = [1.0, 1.0, 1.0, 1.5, 1.0, 1.0]  # whole floats are accepted for int fields
+    data["title"] = ["A", "B", "C", "D", None, "F"]
+    data["class_"] = data.pop("class")  # the attribute name is accepted as well as the alias
+    df = pd.DataFrame(data, index=[10, 11, 12, 13, 14, 15])
+    validated, rejected = validate_frame(df)
+    # Rejected rows are reported by their index, with the model's error message
+    assert [index for index, _ in rejected] == [12, 13, 14]
+    assert "key" in rejected[0][1]
+    # The valid rows and their values are the same as validating one model per row
+    expected = pd.DataFrame([song.model_dump(by_alias=True) for song in validate_songs(df)])
+    assert validated["id"].tolist() == expected["id"].tolist()
+    assert validated["key"].tolist() == [5, 7, 5]
+    assert validated["mode"].dtype == "int64"
+    assert validated["class"].tolist() == expected["class"].tolist()
+
+def test_validate_frame_missing_column():
+    data = valid_song_data(2)
+    del data["title"]
+    validated, rejected = validate_frame(pd.DataFrame(data))
+    assert validated.empty
+    assert len(rejected) == 2
+    assert "title" in rejected[0][1]
+
+def test_validate_frame_one_bad_value():
+    data = valid_song_data(1000)
+    data["tempo"][5] = "n/a"
+    data["rating"] = [None] * 999 + ["bad"]
+    # A single bad value only sends its own row to the model, not the whole column
+    with patch('dataParsing.Song', wraps=Song) as model:
+        validated, rejected = validate_frame(pd.DataFrame(data))
+    assert model.call_count == 2
+    assert [index for index, _ in rejected] == [5, 999]
+    assert len(validated) == 998
+    assert validated["tempo"].dtype == "float64"
+
+# -----------------------------
+# 5. Test Streaming Ingestion
+# -----------------------------
+def test_ingest_stream(tmp_path):
+    # Three rows in the columnar layout, the second one with an invalid key
+    row = {
+        "id": "001", "title": "Valid Song", "danceability": 0.7, "energy": 0.8, "key": 5,
+        "loudness": -5.2, "mode": 1, "acousticness": 0.2, "instrumentalness": 0.1, "liveness": 0.15,
+        "valence": 0.6, "tempo": 120.0, "duration_ms": 210000, "time_signature": 4, "num_bars": 80,
+        "num_sections": 10, "num_segments": 240, "class": 1,
+    }
+    rows = [dict(row, id="001"), dict(row, id="002", key="not a number"), dict(row, id="003", title="Other Song")]
+    columnar = {column: {str(i): r[column] for i, r in enumerate(rows)} for column in row}
+    input_path = tmp_path / "playlist.json"
+    input_path.write_text(json.dumps(columnar))
+    db_path = tmp_path / "playlist.db"
+    # A chunk size of 2 makes the rows go through two separate chunks
+    assert ingest_stream(str(input_path), str(db_path), chunk_size=2) == 2
+    conn = sqlite3.connect(db_path)
+    ids = [r[0] for r in conn.execute("SELECT id FROM songs ORDER BY rowid")]
+    # The title search index is built once the load has finished
+    found = conn.execute("SELECT rowid FROM songs_fts WHERE songs_fts MATCH 'other'").fetchall()
+    conn.close()
+    assert ids == ["001", "003"]
+    assert len(found) == 1
+
+
+# -----------------------------
+# 6. Test Parallel Ingestion
+# -----------------------------
+@pytest.mark.parametrize("extension", ["json", "ndjson"])
+def test_ingest_stream_workers(tmp_path, extension):
+    data = pd.DataFrame({
+        "id": [f"{i:03d}" for i in range(50)], "title": [f"Song {i}" for i in range(50)], "danceability": 0.7,
+        "energy": 0.8, "key": 5, "loudness": -5.2, "mode": 1, "acousticness": 0.2, "instrumentalness": 0.1,
+        "liveness": 0.15, "valence": 0.6, "tempo": 120.0, "duration_ms": 210000, "time_signature": 4,
+        "num_bars": 80, "num_sections": 10, "num_segments": 240, "class": 1,
+    })
+    data.loc[7, "title"] = None  # one invalid row
+    input_path = tmp_path / f"playlist.{extension}"
+    if extension == "ndjson":
+        data.to_json(input_path, orient="records", lines=True)
+    else:
+        data.to_json(input_path)
+    db_path = tmp_path / "playlist.db"
+    # Small chunks spread the input over several tasks on the process pool
+    assert ingest_stream(str(input_path), str(db_path), chunk_size=8, workers=2) == 49
+    conn = sqlite3.connect(db_path)
+    ids = [r[0] for r in conn.execute("SELECT id FROM songs ORDER BY rowid")]
+    column_types = {r[1]: r[2] for r in conn.execute("PRAGMA table_info(songs)")}
+    indexes = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    conn.close()
+    # The single writer keeps the rows in input order
+    assert ids == [f"{i:03d}" for i in range(50) if i != 7]
+    assert column_types["rating"] == "REAL"
+    assert column_types["key"] == "INTEGER"
+    assert {"idx_songs_id", "idx_songs_title"} <= indexes
+
+
+# -----------------------------
+# 7. Test Incremental Ingestion
+# -----------------------------
+def test_upsert_songs_keeps_ratings(tmp_path):
+    db_path = str(tmp_path / "playlist.db")
+    songs, _ = validate_frame(pd.DataFrame(valid_song_data(4)))
+    songs["rating"] = None
+    save_to_db(songs, db_path)
+    # A user rates two songs through the API
+    conn = sqlite3.connect(db_path)
+    conn.execute("UPDATE songs SET rating = 4.5 WHERE id IN ('000', '001')")
+    conn.commit()
+    conn.close()
+
+    # The next input changes song 001, drops song 002 and adds song 004
+    refreshed = valid_song_data(5)
+    refreshed["title"][1] = "Renamed Song"
+    for column in refreshed:
+        del refreshed[column][2]
+    songs, _ = validate_frame(pd.DataFrame(refreshed))
+    songs["rating"] = None
+    counts, _ = upsert_songs(db_path, [songs], delete_missing=True)
+    assert counts == {"inserted": 1, "updated": 1, "deleted": 1, "unchanged": 2}
+
+    conn = sqlite3.connect(db_path)
+    rows = conn.execute("SELECT id, title, rating FROM songs ORDER BY id").fetchall()
+    found = conn.execute("SELECT rowid FROM songs_fts WHERE songs_fts MATCH 'renamed'").fetchall()
+    conn.close()
+    # Ratings survive, including on the changed song, and the search index follows the new title
+    assert rows == [
+        ("000", "Song 0", 4.5),
+        ("001", "Renamed Song", 4.5),
+        ("003", "Song 3", None),
+        ("004", "Song 4", None),
+    ]
+    assert len(found) == 1
+
+    # Running the same input again changes nothing
+    counts, _ = upsert_songs(db_path, [songs])
+    assert counts == {"inserted": 0, "updated": 0, "deleted": 0, "unchanged": 4}
+
+
+# ----------------------------
+# 8. Test Ratings Survive a Full Ingestion
+# ----------------------------
+def test_full_ingestion_restores_ratings(tmp_path):
+    db_path = str(tmp_path / "playlist.db")
+    songs, _ = validate_frame(pd.DataFrame(valid_song_data(3)))
+    songs["rating"] = None
+    save_to_db(songs, db_path)
+    conn = sqlite3.connect(db_path)
+    conn.execute("INSERT INTO ratings (song_id, rating) VALUES ('001', 2.0), ('001', 3.0)")
+    conn.commit()
+    conn.close()
+
+    # Rebuilding the songs table keeps the ratings log, and the averages are copied back
+    save_to_db(songs, db_path)
+    conn = sqlite3.connect(db_path)
+    rows = conn.execute("SELECT id, rating FROM songs ORDER BY id").fetchall()
+    conn.close()
+    assert rows == [("000", None), ("001", 2.5), ("002", None)]
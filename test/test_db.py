@@ -0,0 +1,311 @@
+import pytest
+import sqlite3
+import os
+import time
+from unittest.mock import patch
+import db
+
+
+# Build a small songs table in a temporary database and point db.py at it
+@pytest.fixture
+def db_path(tmp_path):
+    path = tmp_path / "test.db"
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE songs (id TEXT, title TEXT, rating REAL)")
+    conn.executemany(
+        "INSERT INTO songs VALUES (?, ?, ?)",
+        [(f"{i:03d}", f"Song {i}", None) for i in range(1, 26)],
+    )
+    conn.commit()
+    conn.close()
+    db.invalidate_count_cache()
+    with patch('db.get_config', return_value={"db_path": str(path)}):
+        yield path
+    db.pool.close_all()
+    db.invalidate_count_cache()
+
+
+# ----------------------------
+# 1. Test offset pagination
+# ----------------------------
+def test_fetch_songs_offset(db_path):
+    rows, next_after = db.fetch_songs(10, offset=20)
+    # Only the last 5 songs are left, so there is no next page
+    assert [row["id"] for row in rows] == ["021", "022", "023", "024", "025"]
+    assert next_after is None
+
+
+# ----------------------------
+# 2. Test keyset pagination
+# ----------------------------
+def test_fetch_songs_keyset(db_path):
+    # Walking the table page by page with the returned cursor visits every song once
+    seen = []
+    after = None
+    while True:
+        rows, after = db.fetch_songs(10, after=after)
+        seen.extend(row["id"] for row in rows)
+        if after is None:
+            break
+    assert seen == [f"{i:03d}" for i in range(1, 26)]
+
+
+# ----------------------------
+# 3. Test cached song count
+# ----------------------------
+def test_count_songs_cached(db_path):
+    assert db.count_songs() == 25
+    # New rows are not visible until the cache is invalidated
+    conn = sqlite3.connect(db_path)
+    conn.execute("INSERT INTO songs VALUES ('026', 'Song 26', NULL)")
+    conn.commit()
+    conn.close()
+    assert db.count_songs() == 25
+    db.invalidate_count_cache()
+    assert db.count_songs() == 26
+    # An ingestion that moves the catalog version on, made by another process, starts a fresh count without invalidating
+    conn = sqlite3.connect(db_path)
+    conn.execute("INSERT INTO songs VALUES ('027', 'Song 27', NULL)")
+    db.bump_data_version(conn, catalog=True)
+    conn.commit()
+    conn.close()
+    assert db.count_songs() == 27
+    rated = (("rating", "gte", 3.0),)
+    assert db.count_songs(rated) == 0
+
+    # A rating only moves the data version on: the unfiltered total isn't counted again (so the row slipped in
+    # without an ingestion stays unseen), while a count filtered on the rating is
+    conn = sqlite3.connect(db_path)
+    conn.execute("UPDATE songs SET rating = 4.0 WHERE id = '001'")
+    conn.execute("INSERT INTO songs VALUES ('028', 'Song 28', NULL)")
+    db.bump_data_version(conn)
+    conn.commit()
+    conn.close()
+    assert db.count_songs() == 27
+    assert db.count_songs(rated) == 1
+
+
+# ----------------------------
+# 4. Test connection pooling
+# ----------------------------
+def test_connection_pool_reuses_connections(db_path):
+    # A connection handed back to the pool is reused by the next caller
+    with db.connection() as first:
+        pass
+    with db.connection() as second:
+        pass
+    assert first is second
+    # Startup PRAGMAs are applied to pooled connections
+    with db.connection() as conn:
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+        assert conn.execute("PRAGMA synchronous").fetchone()[0] == 1 # NORMAL
+
+
+def test_connection_pool_recycles_on_config_change(db_path, tmp_path):
+    with db.connection() as first:
+        pass
+    # Pointing db_path somewhere else retires the pooled connections
+    other = tmp_path / "other.db"
+    with patch('db.get_config', return_value={"db_path": str(other)}):
+        with db.connection() as second:
+            assert second is not first
+            assert second.execute("PRAGMA database_list").fetchone()[2] == str(other)
+
+
+def test_connection_pool_disabled(db_path):
+    # pool_size 0 opens a fresh connection for every call
+    with patch('db.get_config', return_value={"db_path": str(db_path), "pool_size": 0}):
+        with db.connection() as first:
+            pass
+        with db.connection() as second:
+            pass
+    assert first is not second
+
+
+# ----------------------------
+# 5. Test config caching
+# ----------------------------
+def test_get_config_reloads_on_change(tmp_path):
+    config_path = tmp_path / "config.json"
+    config_path.write_text('{"db_path": "a.db"}')
+    assert db.get_config(str(config_path))["db_path"] == "a.db"
+    # Rewriting the file with a newer modification time is picked up once the recheck interval passes
+    config_path.write_text('{"db_path": "b.db"}')
+    os.utime(config_path, (time.time() + 5, time.time() + 5))
+    db._config_cache["checked"] = 0.0
+    assert db.get_config(str(config_path))["db_path"] == "b.db"
+
+
+# ----------------------------
+# 6. Test title search
+# ----------------------------
+@pytest.fixture
+def search_db(db_path):
+    conn = sqlite3.connect(db_path)
+    conn.executemany(
+        "UPDATE songs SET title = ? WHERE id = ?",
+        [("Love Story", "001"), ("Lovely", "002"), ("Story of My Life", "003"), ("love", "004")],
+    )
+    db.build_indexes(conn)
+    conn.close()
+    return db_path
+
+
+def test_fetch_song_by_title_search(search_db):
+    # Prefix matching on every word
+    titles = [row["title"] for row in db.fetch_song_by_id("lov")]
+    assert sorted(titles) == ["Love Story", "Lovely", "love"]
+    titles = [row["title"] for row in db.fetch_song_by_id("story lo")]
+    assert titles == ["Love Story"]
+    # FTS syntax in the search term is treated as plain text
+    assert db.fetch_song_by_id('"') == []
+
+
+def test_fetch_song_by_title_exact(search_db):
+    titles = [row["title"] for row in db.fetch_song_by_id("LOVE", exact=True)]
+    assert titles == ["love"]
+
+
+def test_search_index_follows_updates(search_db):
+    # Changing a title through SQL keeps the full-text index in sync
+    conn = sqlite3.connect(search_db)
+    conn.execute("UPDATE songs SET title = 'Yesterday' WHERE id = '002'")
+    conn.execute("INSERT INTO songs VALUES ('099', 'Lovesong', NULL)")
+    conn.commit()
+    conn.close()
+    titles = [row["title"] for row in db.fetch_song_by_id("lov")]
+    assert sorted(titles) == ["Love Story", "Lovesong", "love"]
+    assert [row["id"] for row in db.fetch_song_by_id("yesterday")] == ["002"]
+
+
+def test_search_falls_back_without_index(db_path):
+    # Databases without songs_fts still answer searches with LIKE
+    assert [row["id"] for row in db.fetch_song_by_id("Song 25")] == ["025"]
+
+
+# ----------------------------
+# 7. Test the data version
+# ----------------------------
+def test_update_rating_bumps_data_version(db_path):
+    # Databases without the counter report version 0
+    assert db.get_data_version() == 0
+    assert db.update_rating("001", 4.0) == 1
+    assert db.get_data_version() == 1
+    # Rating a song that doesn't exist changes nothing
+    assert db.update_rating("999", 4.0) == 0
+    assert db.get_data_version() == 1
+
+
+# ----------------------------
+# 8. Test batched rating updates
+# ----------------------------
+def test_update_ratings_one_transaction(db_path):
+    assert db.update_ratings([("001", 1.0), ("999", 2.0), ("002", 3.0)]) == [1, 0, 1]
+    # The whole batch moves the data version on once
+    assert db.get_data_version() == 1
+    rows = {row["id"]: row["rating"] for row in db.fetch_songs(3)[0]}
+    assert rows["001"] == 1.0 and rows["002"] == 3.0
+    # A batch that matches nothing leaves the version alone
+    assert db.update_ratings([("999", 2.0)]) == [0]
+    assert db.get_data_version() == 1
+
+
+# ----------------------------
+# 9. Test the ratings log and running stats
+# ----------------------------
+def test_ratings_are_aggregated(db_path):
+    for rating in (5, 4.5, 1.0, 4.0):
+        assert db.update_rating("001", rating) == 1
+    db.update_ratings([("001", 0.5), ("002", 3.0)])
+    # Every rating is kept, and the song's rating is the running mean
+    with db.connection() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM ratings WHERE song_id = '001'").fetchone()[0] == 5
+        stats = dict(conn.execute("SELECT * FROM rating_stats WHERE song_id = '001'").fetchone())
+    assert stats["count"] == 5
+    assert stats["sum"] == 15.0
+    assert stats["mean"] == 3.0
+    assert [stats[f"hist_{bucket}"] for bucket in range(6)] == [1, 1, 0, 0, 2, 1]
+    # The stats come with the songs page
+    rows, _ = db.fetch_songs(3)
+    assert rows[0]["rating"] == 3.0
+    assert rows[0]["rating_count"] == 5
+    assert rows[1]["rating_count"] == 1
+    assert rows[2]["rating_count"] is None
+
+
+def test_rebuild_rating_stats(db_path):
+    db.update_rating("001", 2.0)
+    db.update_rating("001", 4.0)
+    with db.connection() as conn:
+        # A rating set before the log existed, and stats that have drifted from the log
+        conn.execute("UPDATE songs SET rating = 5.0 WHERE id = '003'")
+        conn.execute("UPDATE rating_stats SET count = 99")
+        conn.commit()
+    assert db.rebuild_rating_stats() == 2
+    with db.connection() as conn:
+        stats = {row["song_id"]: (row["count"], row["mean"]) for row in conn.execute("SELECT * FROM rating_stats")}
+    assert stats == {"001": (2, 3.0), "003": (1, 5.0)}
+
+
+# ----------------------------
+# 10. Test range filters and sorting
+# ----------------------------
+@pytest.fixture
+def feature_db(db_path):
+    conn = sqlite3.connect(db_path)
+    conn.execute("ALTER TABLE songs ADD COLUMN energy REAL")
+    conn.execute("ALTER TABLE songs ADD COLUMN tempo REAL")
+    # Energy 0.04 to 1.0, tempo repeating 100/110/120, and a few ratings with the rest left NULL
+    conn.executemany(
+        "UPDATE songs SET energy = ?, tempo = ?, rating = ? WHERE id = ?",
+        [(i / 25, 100 + 10 * (i % 3), (i % 5) if i % 4 == 0 else None, f"{i:03d}") for i in range(1, 26)],
+    )
+    db.build_indexes(conn)
+    conn.close()
+    return db_path
+
+
+# Walk every page of a listing through its cursors
+def walk(limit, **kwargs):
+    ids = []
+    after = None
+    while True:
+        rows, after = db.fetch_songs(limit, after=after, **kwargs)
+        ids.extend(row["id"] for row in rows)
+        if after is None:
+            return ids
+
+
+def test_fetch_songs_filters(feature_db):
+    filters = (("energy", "gte", 0.5), ("tempo", "lt", 120))
+    rows, _ = db.fetch_songs(100, filters=filters)
+    assert [row["id"] for row in rows] == [f"{i:03d}" for i in range(13, 26) if i % 3 != 2]
+    assert db.count_songs(filters) == len(rows)
+    assert db.count_songs() == 25
+
+
+def test_fetch_songs_sorted_keyset(feature_db):
+    conn = sqlite3.connect(feature_db)
+    expected = {}
+    for sort in [(("tempo", True), ("energy", False)), (("rating", False),), (("rating", True), ("tempo", False))]:
+        order = ", ".join(f"{column} {'DESC' if descending else 'ASC'}" for column, descending in sort)
+        expected[sort] = [row[0] for row in conn.execute(f"SELECT id FROM songs ORDER BY {order}, rowid {'DESC' if sort[-1][1] else 'ASC'}")]
+    conn.close()
+    # Paging through the cursors gives the same order as one big query, including over NULL ratings
+    for sort, ids in expected.items():
+        assert walk(4, sort=sort) == ids
+        assert [row["id"] for row in db.fetch_songs(4, offset=8, sort=sort)[0]] == ids[8:12]
+    assert walk(3, sort=(("energy", True),), filters=(("energy", "lte", 0.5),)) == [f"{i:03d}" for i in range(12, 0, -1)]
+
+
+def test_filtered_queries_use_indexes(feature_db):
+    conn = sqlite3.connect(feature_db)
+    indexes = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    assert {"idx_songs_energy", "idx_songs_tempo", "idx_songs_rating"} <= indexes
+    # A filtered listing sorted on the filtered column, and the filtered count, are answered from the index
+    plans = [" ".join(row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {query}", (0.9,))) for query in (
+        'SELECT * FROM songs WHERE songs."energy" >= ? ORDER BY songs."energy" DESC, songs.rowid DESC LIMIT 10',
+        'SELECT COUNT(*) FROM songs WHERE songs."energy" >= ?',
+    )]
+    conn.close()
+    assert all("idx_songs_energy" in plan for plan in plans)
@@ -0,0 +1,103 @@
+import json
+import sqlite3
+import pandas as pd
+import pytest
+from unittest.mock import patch
+import db
+from api import app, response_cache, catalog_snapshot
+from dataParsing import save_to_db, upsert_songs
+from encoding import get_encoder
+from test_dataParsing import valid_song_data
+
+
+# Songs with non-ASCII titles, missing values and numbers that json writes with an exponent
+def songs(rows, title="Song"):
+    data = valid_song_data(rows)
+    data["title"] = [f"{title} {i} - café ♫ 日本 \"quoted\"" if i % 3 == 0 else f"{title} {i}" for i in range(rows)]
+    data["instrumentalness"] = [1.5e-05 * i for i in range(rows)]
+    data["tempo"] = [None if i == 4 else 120.0 + i for i in range(rows)]
+    df = pd.DataFrame(data)
+    df["rating"] = None
+    return df
+
+
+@pytest.fixture
+def catalog(tmp_path):
+    db_path = str(tmp_path / "playlist.db")
+    with patch('dataParsing.get_config', return_value={"snapshot": {"enabled": False}}):
+        save_to_db(songs(12), db_path)
+    config = {"db_path": db_path}
+    db.pool.close_all()
+    with patch('db.get_config', return_value=config), patch('api.get_config', return_value=config):
+        yield db_path
+        db.pool.close_all()
+
+
+# The bodies of a set of listings and searches, built from the stored song JSON or (stored=False) from dicts
+def bodies(stored=True):
+    response_cache.clear()
+    catalog_snapshot.clear()
+    db.invalidate_count_cache()
+    urls = ['/songs?limit=5', '/songs?limit=5&page=3', '/songs?energy_gte=0.5&sort=-instrumentalness&limit=20',
+            '/songs?sort=tempo', '/songs/Song', '/songs/caf%C3%A9', '/songs/Song%201?match=exact']
+    with patch('db.has_song_json', return_value=stored), app.test_client() as client:
+        return [client.get(url).get_data() for url in urls]
+
+
+def stored_json(db_path):
+    conn = sqlite3.connect(db_path)
+    rows = {rowid: head + tail for rowid, head, tail in conn.execute("SELECT * FROM song_json")}
+    conn.close()
+    return rows
+
+
+# ---------------------------------------
+# 1. Test responses built from the stored JSON match the dict path byte for byte
+# ---------------------------------------
+def test_stored_json_matches(catalog):
+    db.update_rating("001", 4.5)
+    db.update_rating("001", 2.0)
+    assert bodies() == bodies(stored=False)
+    song = json.loads(bodies()[0])["data"][1]
+    assert song["rating"] == 3.25
+    assert song["ratings"] == {"count": 2, "mean": 3.25, "histogram": [0, 0, 1, 0, 1, 0]}
+
+    # A song whose stored JSON is missing is read in full instead
+    conn = sqlite3.connect(catalog)
+    conn.execute("DELETE FROM song_json WHERE song_rowid IN (1, 2)")
+    conn.commit()
+    conn.close()
+    assert bodies() == bodies(stored=False)
+
+
+# ---------------------------------------
+# 2. Test incremental ingestion re-encodes only the changed songs
+# ---------------------------------------
+def test_stored_json_upsert(catalog):
+    before = stored_json(catalog)
+    changed = songs(12)
+    changed.loc[3, "title"] = "Renamed"
+    with patch('dataParsing.get_config', return_value={"snapshot": {"enabled": False}}):
+        upsert_songs(catalog, [changed.drop(index=[5])], delete_missing=True)
+    after = stored_json(catalog)
+    assert 6 not in after
+    assert b'"title":"Renamed"' in after[4]
+    assert {rowid: text for rowid, text in after.items() if rowid != 4} == {
+        rowid: text for rowid, text in before.items() if rowid not in (4, 6)
+    }
+    # Ratings don't touch the stored JSON
+    db.update_rating("000", 5.0)
+    assert stored_json(catalog) == after
+    assert bodies() == bodies(stored=False)
+
+
+# ---------------------------------------
+# 3. Test the pluggable response encoders
+# ---------------------------------------
+def test_encoders():
+    payload = {"data": [{"title": "café", "x": 1.5e-05, "n": None}], "page": 1}
+    assert get_encoder("json")(payload) == app.json.response(payload).get_data()
+    assert json.loads(get_encoder("orjson")(payload)) == payload
+    assert get_encoder("orjson")(payload).endswith(b"}\n")
+    # Unknown encoders fall back to the standard library one
+    assert get_encoder("fast")(payload) == get_encoder("json")(payload)
@@ -0,0 +1,175 @@
+import asyncio
+import csv
+import gzip
+import io
+import json
+import sqlite3
+import pandas as pd
+import pytest
+from unittest.mock import patch
+import db
+import main
+from api import app, catalog_snapshot, encode_cursor
+from asgi import application
+from dataParsing import save_to_db
+from export import export_to_file
+from schema import SONG_COLUMNS
+from test_dataParsing import valid_song_data
+
+
+@pytest.fixture
+def catalog(tmp_path):
+    db_path = str(tmp_path / "playlist.db")
+    data = valid_song_data(50)
+    data["title"] = [f"Song {i}, \"quoted\" ♫" if i % 7 == 0 else f"Song {i}" for i in range(50)]
+    data["energy"] = [i / 50 for i in range(50)]
+    df = pd.DataFrame(data)
+    df["rating"] = None
+    with patch('dataParsing.get_config', return_value={}):
+        save_to_db(df, db_path)
+    config = {"db_path": db_path, "export_batch_size": 8}
+    catalog_snapshot.clear()
+    with patch('db.get_config', return_value=config), patch('api.get_config', return_value=config):
+        yield db_path
+        db.pool.close_all()
+    catalog_snapshot.clear()
+
+
+# The songs table as dictionaries, in insertion order
+def table(db_path, where=""):
+    conn = sqlite3.connect(db_path)
+    conn.row_factory = sqlite3.Row
+    rows = [dict(row) for row in conn.execute(f"SELECT * FROM songs {where} ORDER BY rowid")]
+    conn.close()
+    return rows
+
+
+def ndjson(body):
+    return [json.loads(line) for line in body.decode("utf-8").splitlines()]
+
+
+# ---------------------------------------
+# 1. Test the NDJSON export streams the whole table
+# ---------------------------------------
+def test_export_ndjson(catalog):
+    with app.test_client() as client:
+        response = client.get('/export/songs')
+        assert response.status_code == 200
+        assert response.is_streamed
+        assert response.headers["Content-Type"] == "application/x-ndjson"
+        assert response.headers["Accept-Ranges"] == "rows"
+        songs = ndjson(response.get_data())
+    assert songs == table(catalog)
+    assert list(songs[0]) == SONG_COLUMNS
+
+    # The export doesn't take a path under /songs/, so a song titled "export" can still be looked up
+    conn = sqlite3.connect(catalog)
+    conn.execute("UPDATE songs SET title = 'export' WHERE rowid = 1")
+    conn.commit()
+    conn.close()
+    with app.test_client() as client:
+        response = client.get('/songs/export?match=exact')
+    assert response.status_code == 200
+    assert [song["title"] for song in response.get_json()] == ["export"]
+
+
+# ---------------------------------------
+# 2. Test the filtered CSV export
+# ---------------------------------------
+def test_export_csv_filtered(catalog):
+    with app.test_client() as client:
+        response = client.get('/export/songs?format=csv&energy_gte=0.5')
+        assert response.headers["Content-Type"].startswith("text/csv")
+        rows = list(csv.DictReader(io.StringIO(response.get_data(as_text=True))))
+        assert client.get('/export/songs?format=xml').status_code == 400
+        assert client.get('/export/songs?title_gte=1').status_code == 400
+    expected = table(catalog, "WHERE energy >= 0.5")
+    assert [row["id"] for row in rows] == [song["id"] for song in expected]
+    assert rows[0]["title"] == expected[0]["title"]
+    assert float(rows[0]["energy"]) == expected[0]["energy"]
+    assert rows[0]["rating"] == ""
+
+
+# ---------------------------------------
+# 3. Test the gzip export
+# ---------------------------------------
+def test_export_gzip(catalog):
+    with app.test_client() as client:
+        plain = client.get('/export/songs').get_data()
+        response = client.get('/export/songs', headers={"Accept-Encoding": "gzip, deflate"})
+        assert response.headers["Content-Encoding"] == "gzip"
+        assert gzip.decompress(response.get_data()) == plain
+        response = client.get('/export/songs', headers={"Accept-Encoding": "gzip;q=0"})
+        assert "Content-Encoding" not in response.headers
+
+
+# ---------------------------------------
+# 4. Test resuming an export
+# ---------------------------------------
+@pytest.mark.parametrize("query", ["", "format=csv", "energy_lt=0.6"])
+def test_export_resume(catalog, query):
+    with app.test_client() as client:
+        full = client.get(f'/export/songs?{query}').get_data().splitlines(keepends=True)
+        # The CSV header line isn't a row
+        header = 1 if "csv" in query else 0
+        response = client.get(f'/export/songs?{query}', headers={"Range": "rows=17-"})
+        assert response.status_code == 206
+        assert response.headers["Content-Range"] == "rows 17-*/*"
+        assert full[:17 + header] + response.get_data().splitlines(keepends=True) == full
+        # Resuming a complete export sends nothing more, and resuming past its end is an error
+        rows = len(full) - header
+        assert client.get(f'/export/songs?{query}', headers={"Range": f"rows={rows}-"}).get_data() == b""
+        assert client.get(f'/export/songs?{query}', headers={"Range": f"rows={rows + 1}-"}).status_code == 416
+        # Other range units are ignored
+        assert client.get(f'/export/songs?{query}', headers={"Range": "bytes=0-10"}).get_data() == b"".join(full)
+
+
+# ---------------------------------------
+# 5. Test resuming from a GET /songs cursor
+# ---------------------------------------
+def test_export_after_cursor(catalog):
+    with app.test_client() as client:
+        cursor = client.get('/songs?limit=10').get_json()["next"]
+        songs = ndjson(client.get(f'/export/songs?after={cursor}').get_data())
+        assert client.get(f'/export/songs?after={encode_cursor([1.0, 3])}').status_code == 400
+    assert songs == table(catalog)[10:]
+
+
+# ---------------------------------------
+# 6. Test the ASGI app streams the same export
+# ---------------------------------------
+def test_asgi_export(catalog):
+    with app.test_client() as client:
+        expected = client.get('/export/songs?format=csv', headers={"Range": "rows=5-"}).get_data()
+    scope = {"type": "http", "method": "GET", "path": "/export/songs", "query_string": b"format=csv",
+             "headers": [(b"range", b"rows=5-"), (b"accept-encoding", b"gzip")]}
+    sent = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(application(scope, receive, send))
+    assert sent[0]["status"] == 206
+    assert (b"content-encoding", b"gzip") in sent[0]["headers"]
+    # One message per batch of rows, then the end of the body
+    assert len(sent) > 3 and sent[-1] == {"type": "http.response.body", "body": b""}
+    assert gzip.decompress(b"".join(message["body"] for message in sent[1:])) == expected
+
+
+# ---------------------------------------
+# 7. Test the CLI export
+# ---------------------------------------
+def test_cli_export(catalog, tmp_path, capsys):
+    output = str(tmp_path / "songs.csv.gz")
+    main.main(["export", "--output", output, "--where", "energy_gte=0.9"])
+    assert "Exported 5 songs" in capsys.readouterr().out
+    with gzip.open(output, "rt", encoding="utf-8") as file:
+        rows = list(csv.DictReader(file))
+    assert [row["id"] for row in rows] == ["045", "046", "047", "048", "049"]
+    rows, size = export_to_file(str(tmp_path / "songs.ndjson"))
+    assert rows == 50
+    with open(tmp_path / "songs.ndjson", "rb") as file:
+        assert ndjson(file.read()) == table(catalog)
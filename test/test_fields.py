@@ -0,0 +1,123 @@
+import gzip
+import sqlite3
+import zlib
+import pandas as pd
+import pytest
+from unittest.mock import patch
+import db
+from api import app, response_cache
+from dataParsing import save_to_db
+from db import covering_index_name
+from test_asgi import call
+from test_dataParsing import valid_song_data
+
+
+# A catalog of 30 songs, served with or without the columnar snapshot
+@pytest.fixture(params=[True, False], ids=["snapshot", "sqlite"])
+def client(request, tmp_path):
+    config = {"db_path": str(tmp_path / "playlist.db"), "snapshot": {"enabled": request.param},
+              "compression": {"min_size": 200}}
+    df = pd.DataFrame(valid_song_data(30))
+    df["rating"] = None
+    db.pool.close_all()
+    db.invalidate_count_cache()
+    response_cache.clear()
+    with patch('dataParsing.get_config', return_value=config), patch('db.get_config', return_value=config), \
+            patch('api.get_config', return_value=config):
+        save_to_db(df, config["db_path"])
+        with app.test_client() as client:
+            yield client
+    db.pool.close_all()
+
+
+# ---------------------------------------
+# 1. Test a listing returns only the requested fields, the same values as the full listing
+# ---------------------------------------
+def test_listing_fields(client):
+    assert client.post('/songs/000/rate', json={"rating": 4}).status_code == 200
+    full = client.get('/songs?limit=7&page=2').get_json()
+    projected = client.get('/songs?limit=7&page=2&fields=title,id,ratings').get_json()
+    assert projected["total"] == full["total"]
+    assert projected["data"] == [{"id": song["id"], "title": song["title"], "ratings": song["ratings"]}
+                                 for song in full["data"]]
+    rated = client.get('/songs?limit=1&fields=ratings').get_json()["data"][0]
+    assert set(rated) == {"ratings"} and rated["ratings"]["count"] == 1
+
+    # Projected pages follow the same cursors as full ones
+    url, seen = '/songs?sort=-energy&limit=8&fields=id,energy', []
+    while url:
+        page = client.get(url).get_json()
+        assert all(set(song) == {"id", "energy"} for song in page["data"])
+        seen.extend(song["id"] for song in page["data"])
+        url = f'/songs?sort=-energy&limit=8&fields=id,energy&after={page["next"]}' if page["next"] else None
+    assert seen == [song["id"] for song in client.get('/songs?sort=-energy&limit=30').get_json()["data"]]
+
+
+# ---------------------------------------
+# 2. Test a search returns only the requested fields, and unknown fields are rejected
+# ---------------------------------------
+def test_search_fields(client):
+    assert client.get('/songs/Song%203?match=exact&fields=rating,id').get_json() == [{"id": "003", "rating": None}]
+    assert client.get('/songs/zzz?fields=id').status_code == 404
+    for url in ['/songs?fields=id,password', '/songs?fields=,', '/songs/Song%203?fields=ratings']:
+        response = client.get(url)
+        assert response.status_code == 400
+        assert "error" in response.get_json()
+
+
+# ---------------------------------------
+# 3. Test responses are compressed for clients that accept it, above the size threshold only
+# ---------------------------------------
+def test_compression(client):
+    plain = client.get('/songs?limit=10')
+    assert plain.headers.get('Content-Encoding') is None
+    assert plain.headers['Vary'] == 'Accept-Encoding'
+
+    compressed = client.get('/songs?limit=10', headers={'Accept-Encoding': 'gzip, deflate'})
+    assert compressed.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(compressed.get_data()) == plain.get_data()
+    assert compressed.headers['ETag'] != plain.headers['ETag']
+    assert compressed.headers['X-Cache'] == 'HIT'
+
+    deflated = client.get('/songs?limit=10', headers={'Accept-Encoding': 'gzip;q=0.5, deflate'})
+    assert deflated.headers['Content-Encoding'] == 'deflate'
+    assert zlib.decompress(deflated.get_data()) == plain.get_data()
+
+    # A matching ETag still gets a 304
+    again = client.get('/songs?limit=10', headers={'Accept-Encoding': 'gzip', 'If-None-Match': compressed.headers['ETag']})
+    assert again.status_code == 304
+
+    # Bodies below the threshold, and clients refusing both encodings, get the body as it is
+    small = client.get('/songs?limit=1&fields=id', headers={'Accept-Encoding': 'gzip'})
+    assert small.headers.get('Content-Encoding') is None
+    assert small.get_json()["data"] == [{"id": "000"}]
+    refused = client.get('/songs?limit=10', headers={'Accept-Encoding': 'gzip;q=0, br'})
+    assert refused.headers.get('Content-Encoding') is None
+
+
+# ---------------------------------------
+# 4. Test the covering index answers an exact title search with projected fields
+# ---------------------------------------
+def test_covering_index(client, tmp_path):
+    conn = sqlite3.connect(tmp_path / "playlist.db")
+    names = [row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")]
+    assert covering_index_name(["title", "id", "rating"]) in names
+    plan = " ".join(row[-1] for row in conn.execute(
+        'EXPLAIN QUERY PLAN SELECT songs.rowid, songs."id", songs."rating" FROM songs WHERE title = ? COLLATE NOCASE',
+        ("Song 3",)))
+    conn.close()
+    assert "COVERING INDEX" in plan
+
+
+# ---------------------------------------
+# 5. Test the ASGI app serves the same projected, compressed responses
+# ---------------------------------------
+def test_asgi_fields_and_compression(client):
+    expected = client.get('/songs?limit=10&fields=id,title,energy', headers={'Accept-Encoding': 'gzip'})
+    status, headers, body = call("GET", "/songs", "limit=10&fields=id,title,energy", [("Accept-Encoding", "gzip")])
+    assert status == 200
+    assert headers["content-encoding"] == "gzip" and headers["vary"] == "Accept-Encoding"
+    assert body == expected.get_data()
+    assert headers["etag"] == expected.headers["ETag"]
+    status, _, body = call("GET", "/songs/Song 3", "fields=title,nope")
+    assert status == 400
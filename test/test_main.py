@@ -0,0 +1,55 @@
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import pytest
+import main
+from test_dataParsing import valid_song_data
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+# Run Python code in a fresh interpreter, in 'cwd', with the project importable
+def run_python(code, cwd):
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    return subprocess.run([sys.executable, "-c", code], cwd=cwd, env=env, capture_output=True, text=True, check=True)
+
+
+# ---------------------------------------
+# 1. Test the modules behind "serve" don't import pandas, and importing opens no log files
+# ---------------------------------------
+def test_serve_imports(tmp_path):
+    code = (
+        "import logging, sys, main, api, asgi\n"
+        "print('pandas' in sys.modules, [logging.getLogger(name).handlers for name in ('api_logger', 'db_logger')])\n"
+    )
+    result = run_python(code, tmp_path)
+    assert result.stdout.strip() == "False [[], []]"
+    assert not os.path.exists(tmp_path / "logs")
+
+
+# ---------------------------------------
+# 2. Test "main.py ingest" runs in the same process
+# ---------------------------------------
+def test_cli_ingest(tmp_path, monkeypatch):
+    with open(tmp_path / "songs.json", "w") as file:
+        json.dump({column: dict(enumerate(values)) for column, values in valid_song_data(4).items()}, file)
+    with open(tmp_path / "config.json", "w") as file:
+        json.dump({"input_path": "songs.json", "db_path": "playlist.db", "snapshot": {"enabled": False}}, file)
+    monkeypatch.chdir(tmp_path)
+    main.main(["ingest"])
+    conn = sqlite3.connect(tmp_path / "playlist.db")
+    assert conn.execute("SELECT COUNT(*) FROM songs").fetchone()[0] == 4
+    conn.close()
+
+
+# ---------------------------------------
+# 3. Test running without a command outside a terminal fails instead of waiting for input
+# ---------------------------------------
+def test_no_command_without_terminal(monkeypatch, capsys):
+    monkeypatch.setattr(sys.stdin, "isatty", lambda: False, raising=False)
+    with pytest.raises(SystemExit) as error:
+        main.main([])
+    assert error.value.code == "A command is required when not running in a terminal"
+    assert "usage:" in capsys.readouterr().err
@@ -0,0 +1,175 @@
+import asyncio
+import logging
+import logging.handlers
+import math
+import os
+import time
+import pandas as pd
+import pytest
+from unittest.mock import patch
+import db
+from api import app, response_cache, catalog_snapshot
+from asgi import application
+from dataParsing import save_to_db
+from logsetup import get_logger
+from metrics import Histogram, Metrics, SamplingProfiler, metrics, timed
+from test_dataParsing import valid_song_data
+
+
+@pytest.fixture
+def catalog(tmp_path):
+    db_path = str(tmp_path / "playlist.db")
+    df = pd.DataFrame(valid_song_data(20))
+    df["rating"] = None
+    with patch('dataParsing.get_config', return_value={"snapshot": {"enabled": False}}):
+        save_to_db(df, db_path)
+    config = {"db_path": db_path, "metrics": {"profiling": True, "profile_dir": str(tmp_path / "profiles")}}
+    response_cache.clear()
+    catalog_snapshot.clear()
+    db.pool.close_all()
+    metrics.clear()
+    with patch('db.get_config', return_value=config), patch('api.get_config', return_value=config):
+        yield config
+        db.pool.close_all()
+
+
+# ---------------------------------------
+# 1. Test histogram quantiles and buckets
+# ---------------------------------------
+def test_histogram():
+    histogram = Histogram(buckets=(0.1, 1.0), samples=100)
+    assert math.isnan(histogram.quantile(0.5))
+    for value in range(1, 201):
+        histogram.observe(value / 100)
+    # Only the latest 100 samples (1.01 to 2.0) count towards the quantiles
+    assert histogram.quantile(0.5) == 1.5
+    assert histogram.quantile(0.99) == 1.99
+    assert histogram.counts == [10, 90, 100]
+    assert histogram.count == 200
+
+
+# ---------------------------------------
+# 2. Test the Prometheus text format
+# ---------------------------------------
+def test_render():
+    registry = Metrics()
+    registry.describe("jobs", "Jobs run")
+    registry.inc("jobs", kind='say "hi"')
+    registry.inc("jobs", 2, kind='say "hi"')
+    registry.observe("job_seconds", 0.003, kind="a")
+    text = registry.render()
+    assert '# HELP jobs_total Jobs run\n# TYPE jobs_total counter\njobs_total{kind="say \\"hi\\""} 3\n' in text
+    assert '# TYPE job_seconds histogram\n' in text
+    assert 'job_seconds_bucket{kind="a",le="0.0025"} 0\n' in text
+    assert 'job_seconds_bucket{kind="a",le="0.005"} 1\n' in text
+    assert 'job_seconds_bucket{kind="a",le="+Inf"} 1\n' in text
+    assert 'job_seconds_count{kind="a"} 1\n' in text
+    assert 'job_seconds_quantile{kind="a",quantile="0.99"} 0.003\n' in text
+
+
+# ---------------------------------------
+# 3. Test database timings
+# ---------------------------------------
+def test_timed():
+    before = metrics.value("db_rows", function="listing")
+
+    @timed(rows=len)
+    def listing():
+        return [1, 2, 3]
+
+    assert listing() == [1, 2, 3]
+    assert listing.__name__ == "listing"
+    assert metrics.value("db_rows", function="listing") == before + 3
+    assert metrics.histogram("db_query_seconds", function="listing").count >= 1
+
+
+# ---------------------------------------
+# 4. Test GET /metrics after some requests
+# ---------------------------------------
+def test_metrics_endpoint(catalog):
+    with app.test_client() as client:
+        body = client.get('/songs?limit=5').get_data()
+        client.get('/songs/Song 1')
+        client.get('/songs?page=0')
+        export = client.get('/export/songs').get_data()
+        response = client.get('/metrics')
+    assert response.headers["Content-Type"] == "text/plain; version=0.0.4; charset=utf-8"
+    text = response.get_data(as_text=True)
+    assert 'http_requests_total{endpoint="/songs",method="GET",status="200"} 1' in text
+    assert 'http_requests_total{endpoint="/songs",method="GET",status="400"} 1' in text
+    assert 'http_requests_total{endpoint="/songs/<string:song_name>",method="GET",status="200"} 1' in text
+    assert f'http_response_bytes_total{{endpoint="/export/songs"}} {len(export)}' in text
+    error = b'{"error":"Page and limit must be positive integers"}\n'
+    assert metrics.value("http_response_bytes", endpoint="/songs") == len(body) + len(error)
+    assert 'http_request_seconds_quantile{endpoint="/songs",quantile="0.95"}' in text
+    assert 'db_query_seconds_count{function="fetch_songs"} 1' in text
+    assert 'db_rows_total{function="fetch_songs"} 5' in text
+    assert 'db_rows_total{function="iter_songs"} 20' in text
+    assert 'db_connections_opened_total 1' in text
+
+
+# ---------------------------------------
+# 5. Test the per-request profiler
+# ---------------------------------------
+def test_profiled_request(catalog):
+    with app.test_client() as client:
+        assert "X-Profile" not in client.get('/songs').headers
+        response = client.get('/export/songs?profile=1')
+        response.get_data()
+        name = response.headers["X-Profile"]
+        with patch.dict(catalog["metrics"], profiling=False):
+            assert "X-Profile" not in client.get('/songs', headers={"X-Profile": "1"}).headers
+    assert os.path.exists(os.path.join(catalog["metrics"]["profile_dir"], name))
+
+    # The profiler counts the stacks of the thread it watches
+    def busy():
+        end = time.perf_counter() + 0.05
+        while time.perf_counter() < end:
+            pass
+
+    profiler = SamplingProfiler(interval=0.001).start()
+    busy()
+    profiler.stop()
+    assert profiler.samples > 0
+    assert "busy (test_metrics.py:" in profiler.collapsed()
+
+
+# ---------------------------------------
+# 6. Test the ASGI app records and serves the same metrics
+# ---------------------------------------
+def test_asgi_metrics(catalog):
+    sent = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        sent.append(message)
+
+    for path in ("/songs", "/missing", "/metrics"):
+        scope = {"type": "http", "method": "GET", "path": path, "query_string": b"", "headers": []}
+        asyncio.run(application(scope, receive, send))
+    assert (b"content-type", b"text/plain; version=0.0.4; charset=utf-8") in sent[-2]["headers"]
+    text = sent[-1]["body"].decode()
+    assert 'http_requests_total{endpoint="/songs",method="GET",status="200"} 1' in text
+    assert 'http_requests_total{endpoint="unmatched",method="GET",status="404"} 1' in text
+
+
+# ---------------------------------------
+# 7. Test loggers write through a queue
+# ---------------------------------------
+def test_queue_logging():
+    logger = get_logger("api_logger", "api.log")
+    # pytest attaches its own capture handler to loggers that don't propagate while a test runs
+    handlers = [handler for handler in logger.handlers if not type(handler).__module__.startswith("_pytest")]
+    assert [type(handler) for handler in handlers] == [logging.handlers.QueueHandler]
+    # Configuring the same logger again doesn't add handlers
+    assert get_logger("api_logger", "api.log").handlers == logger.handlers
+    # Records only go out through the queue, never again through the root logger
+    assert not logger.propagate
+    root_handlers = list(logging.getLogger().handlers)
+    with patch.object(logging.getLogger(), 'handlers', []):
+        db.load_config("missing.json")
+        # Loading the config doesn't give the root logger a console handler of its own
+        assert logging.getLogger().handlers == []
+    assert logging.getLogger().handlers == root_handlers
@@ -0,0 +1,132 @@
+import os
+import sqlite3
+import pandas as pd
+import pytest
+from unittest.mock import patch
+import db
+import dataParsing
+from dataParsing import ingest_stream, save_to_db, validate_frame
+from shadow import ShadowBuildError, RETIRED_MESSAGE, version_path, versions_root
+from test_dataParsing import valid_song_data
+
+
+def songs(rows, title="Song"):
+    data = valid_song_data(rows)
+    data["title"] = [f"{title} {i}" for i in range(rows)]
+    df, _ = validate_frame(pd.DataFrame(data))
+    df["rating"] = None
+    return df
+
+
+def query(db_path, sql):
+    conn = sqlite3.connect(db_path)
+    try:
+        return conn.execute(sql).fetchall()
+    finally:
+        conn.close()
+
+
+# Run a function with db_path as the configured catalog, starting from an empty connection pool
+def using(db_path, function):
+    config = {"db_path": db_path, "snapshot": {"enabled": False}}
+    db.pool.close_all()
+    with patch('db.get_config', return_value=config), patch('dataParsing.get_config', return_value=config):
+        return function()
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    yield str(tmp_path / "playlist.db")
+    db.pool.close_all()
+
+
+# ---------------------------------------
+# 1. Test every full ingestion builds a new version and swaps the link
+# ---------------------------------------
+def test_versions_swap(db_path):
+    # A catalog from before versions existed is a plain file, which the first build replaces with the link
+    conn = sqlite3.connect(db_path)
+    conn.execute("CREATE TABLE songs (id TEXT)")
+    conn.close()
+    using(db_path, lambda: save_to_db(songs(5), db_path))
+    assert os.path.islink(db_path)
+    assert os.path.realpath(db_path) == os.path.realpath(version_path(db_path, 1))
+    using(db_path, lambda: db.update_rating("001", 4.0))
+    version = query(db_path, "SELECT value FROM catalog_meta WHERE key = 'data_version'")[0][0]
+
+    using(db_path, lambda: save_to_db(songs(5, "Renamed"), db_path))
+    using(db_path, lambda: save_to_db(songs(6, "Renamed"), db_path))
+    assert os.path.realpath(db_path) == os.path.realpath(version_path(db_path, 3))
+    # The version before the live one is kept for readers that resolved the link just before the swap
+    assert sorted(name for name in os.listdir(versions_root(db_path)) if name.endswith(".db")) == ["v2.db", "v3.db"]
+    # The ratings given through the API are carried into every new version
+    assert query(db_path, "SELECT id, rating FROM songs WHERE rating IS NOT NULL") == [("001", 4.0)]
+    assert query(db_path, "SELECT COUNT(*) FROM songs WHERE title LIKE 'Renamed%'") == [(6,)]
+    assert query(db_path, "SELECT value FROM catalog_meta WHERE key = 'data_version'")[0][0] > version
+
+
+# ---------------------------------------
+# 2. Test an interrupted ingestion resumes after its last committed chunk
+# ---------------------------------------
+def test_resume_interrupted_ingestion(db_path, tmp_path):
+    input_path = tmp_path / "playlist.ndjson"
+    songs(20).drop(columns=["rating"]).to_json(input_path, orient="records", lines=True)
+    insert_frame = dataParsing.insert_frame
+    calls = []
+
+    def failing(conn, df, rowids=None):
+        calls.append(list(df["id"]))
+        if len(calls) == 3:
+            raise RuntimeError("interrupted")
+        insert_frame(conn, df, rowids)
+
+    with patch('dataParsing.insert_frame', side_effect=failing):
+        with pytest.raises(RuntimeError):
+            using(db_path, lambda: ingest_stream(str(input_path), db_path, chunk_size=5))
+    # Nothing went live, and the first two chunks are in the build
+    assert not os.path.lexists(db_path)
+    assert query(version_path(db_path, 1), "SELECT chunks, rows FROM ingest_progress") == [(2, 10)]
+
+    with patch('dataParsing.insert_frame', side_effect=insert_frame) as resumed:
+        assert using(db_path, lambda: ingest_stream(str(input_path), db_path, chunk_size=5)) == 20
+    # Only the last two chunks were written the second time
+    assert resumed.call_count == 2
+    assert os.path.realpath(db_path) == os.path.realpath(version_path(db_path, 1))
+    assert query(db_path, "SELECT id FROM songs ORDER BY rowid") == [(f"{i:03d}",) for i in range(20)]
+    assert query(db_path, "SELECT name FROM sqlite_master WHERE name = 'ingest_progress'") == []
+
+
+# ---------------------------------------
+# 3. Test writes to a replaced version are refused and go to the new one
+# ---------------------------------------
+def test_retired_version(db_path):
+    using(db_path, lambda: save_to_db(songs(5), db_path))
+    # A connection opened before the swap keeps the old version open
+    conn = sqlite3.connect(db_path)
+    using(db_path, lambda: save_to_db(songs(5), db_path))
+    with pytest.raises(sqlite3.DatabaseError, match=RETIRED_MESSAGE):
+        conn.execute("INSERT INTO ratings (song_id, rating) VALUES ('001', 1.0)")
+    conn.close()
+    assert db._retired(sqlite3.IntegrityError(RETIRED_MESSAGE))
+
+    assert using(db_path, lambda: db.update_ratings([("002", 3.0)])) == [1]
+    assert query(db_path, "SELECT rating FROM songs WHERE id = '002'") == [(3.0,)]
+    assert query(version_path(db_path, 1), "SELECT COUNT(*) FROM ratings") == [(0,)]
+
+
+# ---------------------------------------
+# 4. Test a build that fails its checks leaves the live version in place
+# ---------------------------------------
+def test_failed_validation(db_path):
+    using(db_path, lambda: save_to_db(songs(5), db_path))
+    with patch('dataParsing.ensure_index', return_value="missing.similar"):
+        with pytest.raises(ShadowBuildError, match="was not built"):
+            using(db_path, lambda: save_to_db(songs(8), db_path))
+    assert os.path.realpath(db_path) == os.path.realpath(version_path(db_path, 1))
+    assert query(db_path, "SELECT COUNT(*) FROM songs") == [(5,)]
+
+    # The next ingestion deletes the failed build and builds the version after it
+    using(db_path, lambda: save_to_db(songs(8), db_path))
+    assert not os.path.exists(version_path(db_path, 2))
+    assert os.path.realpath(db_path) == os.path.realpath(version_path(db_path, 3))
+    assert query(db_path, "SELECT COUNT(*) FROM songs") == [(8,)]
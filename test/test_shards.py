@@ -0,0 +1,141 @@
+import json
+import sqlite3
+import pandas as pd
+import pytest
+from unittest.mock import patch
+import db
+from api import app, response_cache
+from dataParsing import save_to_db, upsert_songs
+from export import export_to_file
+from shards import shard_of, shard_paths, fan_out
+from test_dataParsing import valid_song_data
+
+
+def songs(rows):
+    data = valid_song_data(rows)
+    data["title"] = [f"Love Song {i}" if i % 4 == 0 else f"Song {i}" for i in range(rows)]
+    data["tempo"] = [None if i % 7 == 0 else 100.0 + (i * 37) % 50 for i in range(rows)]
+    df = pd.DataFrame(data)
+    df["rating"] = None
+    return df
+
+
+# A catalog ingested into one file and the same catalog ingested into three shards
+@pytest.fixture
+def catalogs(tmp_path):
+    single = {"db_path": str(tmp_path / "single.db"), "snapshot": {"enabled": False}}
+    sharded = {"db_path": str(tmp_path / "sharded.db"), "snapshot": {"enabled": False}, "shards": {"count": 3}}
+    for config in (single, sharded):
+        with patch('dataParsing.get_config', return_value=config), patch('db.get_config', return_value=config):
+            save_to_db(songs(40), config["db_path"])
+    yield single, sharded
+    db.pool.close_all()
+
+
+# Run a function with the given configuration in place, starting from empty caches
+def using(config, function):
+    db.pool.close_all()
+    db.invalidate_count_cache()
+    response_cache.clear()
+    with patch('db.get_config', return_value=config), patch('api.get_config', return_value=config), \
+            patch('dataParsing.get_config', return_value=config):
+        return function()
+
+
+def bodies():
+    urls = ['/songs?limit=7', '/songs?limit=7&page=4', '/songs?energy_gte=0.5&sort=-tempo&limit=6',
+            '/songs?sort=tempo,-id&limit=9&page=2', '/songs/Song%203?match=exact', '/songs/zzz']
+    with app.test_client() as client:
+        responses = [client.get(url).get_data() for url in urls]
+        # Follow the cursors of a sorted listing to the end
+        url = '/songs?sort=-tempo&limit=6'
+        while url:
+            page = client.get(url).get_json()
+            responses.append(json.dumps(page["data"]).encode())
+            url = f'/songs?sort=-tempo&limit=6&after={page["next"]}' if page["next"] else None
+        # Full-text matches are ranked per shard, so only the set of matches has to be the same
+        responses.append(sorted(song["id"] for song in client.get('/songs/love').get_json()))
+    return responses
+
+
+# ---------------------------------------
+# 1. Test the shards hold every song once and answer like a single database
+# ---------------------------------------
+def test_sharded_reads(catalogs, tmp_path):
+    single, sharded = catalogs
+    paths = shard_paths(sharded["db_path"], 3)
+    held = {}
+    for index, path in enumerate(paths):
+        conn = sqlite3.connect(path)
+        rows = conn.execute("SELECT rowid, id FROM songs").fetchall()
+        conn.close()
+        assert rows and all(shard_of(song_id, 3) == index for _, song_id in rows)
+        held.update(rows)
+    # Every song keeps its position in the input as its rowid
+    assert held == {position + 1: song_id for position, song_id in enumerate(songs(40)["id"])}
+
+    assert using(sharded, bodies) == using(single, bodies)
+    assert using(sharded, lambda: db.rowid_at(25, (("energy", "gte", 0.1),))) == \
+        using(single, lambda: db.rowid_at(25, (("energy", "gte", 0.1),)))
+    for config in (single, sharded):
+        using(config, lambda: export_to_file(str(tmp_path / f"{config['db_path']}.ndjson")))
+    assert (tmp_path / f"{sharded['db_path']}.ndjson").read_bytes() == (tmp_path / f"{single['db_path']}.ndjson").read_bytes()
+
+
+# ---------------------------------------
+# 2. Test ratings are written to the shard that holds the song
+# ---------------------------------------
+def test_sharded_ratings(catalogs):
+    _, sharded = catalogs
+    paths = shard_paths(sharded["db_path"], 3)
+    song_ids = list(songs(40)["id"])
+
+    def rate():
+        version = db.get_data_version()
+        assert db.update_rating(song_ids[0], 4.0) == 1
+        assert db.update_ratings([(song_ids[1], 2.0), ("missing", 3.0), (song_ids[2], 5.0), (song_ids[1], 4.0)]) == [1, 0, 1, 1]
+        assert db.get_data_version() > version
+        return db.fetch_songs(40)[0]
+
+    rows = using(sharded, rate)
+    ratings = {row["id"]: (row["rating"], row["rating_count"]) for row in rows}
+    assert ratings[song_ids[0]] == (4.0, 1)
+    assert ratings[song_ids[1]] == (3.0, 2)
+    for song_id in song_ids[:3]:
+        owner = paths[shard_of(song_id, 3)]
+        for path in paths:
+            conn = sqlite3.connect(path)
+            logged = conn.execute("SELECT COUNT(*) FROM ratings WHERE song_id = ?", (song_id,)).fetchone()[0]
+            conn.close()
+            assert bool(logged) == (path == owner)
+    assert using(sharded, db.rebuild_rating_stats) == 3
+
+
+# ---------------------------------------
+# 3. Test incremental ingestion into shards
+# ---------------------------------------
+def test_sharded_upsert(catalogs):
+    single, sharded = catalogs
+    changed = songs(40)
+    changed.loc[5, "title"] = "Renamed"
+    added = songs(44).iloc[40:].copy()
+    added["id"] = [f"new-{i}" for i in range(4)]
+    frames = [pd.concat([added.iloc[:2], changed.drop(index=[9])]), added.iloc[2:]]
+    results = [using(config, lambda: upsert_songs(config["db_path"], frames, delete_missing=True)[0])
+               for config in (single, sharded)]
+    assert results[0] == results[1] == {"inserted": 4, "updated": 1, "deleted": 1, "unchanged": 38}
+    listing = lambda: [(row["id"], row["title"]) for row in db.fetch_songs(100)[0]]
+    assert using(sharded, listing) == using(single, listing)
+    assert using(sharded, lambda: db.fetch_song_by_id("Renamed", exact=True))[0]["id"] == changed.loc[5, "id"]
+
+
+# ---------------------------------------
+# 4. Test the fan-out keeps the order of its items and raises their errors
+# ---------------------------------------
+def test_fan_out():
+    config = {"shards": {"count": 4}}
+    assert fan_out(lambda item: item * 2, range(10), config) == [item * 2 for item in range(10)]
+    with pytest.raises(ZeroDivisionError):
+        fan_out(lambda item: 1 / item, [2, 1, 0], config)
+    # The shard of a song doesn't depend on the process
+    assert shard_of("001", 4) == 3
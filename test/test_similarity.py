@@ -0,0 +1,145 @@
+import os
+import numpy as np
+import pandas as pd
+import pytest
+import sqlite3
+from unittest.mock import patch
+import db
+from api import app, response_cache, similarity_index
+from dataParsing import save_to_db, upsert_songs
+from similarity import DEFAULT_FEATURES, DEFAULT_SETTINGS, IndexManager, ensure_index, index_root, similarity_settings
+from test_dataParsing import valid_song_data
+
+
+# Random songs, so every song has a different feature vector
+def random_songs(rows, seed=0):
+    rng = np.random.default_rng(seed)
+    data = valid_song_data(rows)
+    for column in DEFAULT_FEATURES:
+        data[column] = rng.random(rows).tolist()
+    data["tempo"] = (60 + 140 * rng.random(rows)).tolist()
+    df = pd.DataFrame(data)
+    df["rating"] = None
+    return df
+
+
+# The k nearest song ids by brute force, over the same standardized features
+def brute_force(df, song_id, k):
+    features = df[DEFAULT_FEATURES].to_numpy(dtype=np.float64)
+    features = (features - features.mean(axis=0)) / features.std(axis=0)
+    position = df.index[df["id"] == song_id][0]
+    distances = np.sqrt(((features - features[position]) ** 2).sum(axis=1))
+    distances[position] = np.inf
+    return [df["id"][i] for i in np.argsort(distances, kind="stable")[:k]]
+
+
+# The rowid of a song, which the index looks songs up by
+def rowid_of(db_path, song_id):
+    conn = sqlite3.connect(db_path)
+    rowid = conn.execute("SELECT rowid FROM songs WHERE id = ?", (song_id,)).fetchone()[0]
+    conn.close()
+    return rowid
+
+
+@pytest.fixture
+def catalog(tmp_path):
+    db_path = str(tmp_path / "playlist.db")
+    df = random_songs(500)
+    with patch('dataParsing.get_config', return_value={}):
+        save_to_db(df, db_path)
+    return db_path, df
+
+
+# ---------------------------------------
+# 1. Test the index is built at ingestion
+# ---------------------------------------
+def test_index_built_at_ingestion(catalog):
+    db_path, _ = catalog
+    assert os.listdir(index_root(db_path)) == ["v1"]
+    features = np.load(os.path.join(index_root(db_path), "v1", "features.npy"), mmap_mode="r")
+    assert features.shape == (500, len(DEFAULT_FEATURES))
+    assert features.dtype == np.float32
+    # Songs are found by rowid, so no padded array of id strings is written
+    arrays = [np.load(os.path.join(index_root(db_path), "v1", name), mmap_mode="r")
+              for name in os.listdir(os.path.join(index_root(db_path), "v1")) if name.endswith(".npy")]
+    assert all(array.dtype.kind in "if" for array in arrays)
+
+
+# ---------------------------------------
+# 2. Test exact nearest neighbours
+# ---------------------------------------
+def test_nearest_matches_brute_force(catalog):
+    db_path, df = catalog
+    index = IndexManager().current(db_path, 1, similarity_settings({}))
+    for song_id in ("000", "123", "499"):
+        matches = index.nearest(rowid_of(db_path, song_id), 5)
+        conn = sqlite3.connect(db_path)
+        ids = [conn.execute("SELECT id FROM songs WHERE rowid = ?", (rowid,)).fetchone()[0] for rowid, _ in matches]
+        conn.close()
+        assert ids == brute_force(df, song_id, 5)
+        distances = [distance for _, distance in matches]
+        assert distances == sorted(distances)
+    assert index.nearest(10 ** 6, 5) is None
+
+
+# ---------------------------------------
+# 3. Test the partitioned (approximate) index
+# ---------------------------------------
+def test_partitioned_index(catalog):
+    db_path, df = catalog
+    settings = dict(DEFAULT_SETTINGS, partition_min_rows=100, partitions=20)
+    ensure_index(db_path, settings, rebuild=True)
+    index = IndexManager().current(db_path, 1, settings)
+    assert len(index.centroids) == 20
+    assert index.offsets[-1] == 500
+    recall = []
+    for song_id in ("000", "042", "250", "499"):
+        rowid = rowid_of(db_path, song_id)
+        exact = index.nearest(rowid, 10, exact=True)
+        # Probing every partition is the same as an exact search
+        assert index.nearest(rowid, 10, probe=20) == exact
+        approximate = index.nearest(rowid, 10, probe=4)
+        assert len(approximate) == 10
+        recall.append(len(set(approximate) & set(exact)) / 10)
+    assert np.mean(recall) >= 0.5
+
+
+# ---------------------------------------
+# 4. Test the index follows the catalog version
+# ---------------------------------------
+def test_index_reloads_on_new_catalog_version(catalog):
+    db_path, df = catalog
+    manager = IndexManager()
+    first = manager.current(db_path, 1, similarity_settings({}))
+    assert manager.current(db_path, 1, similarity_settings({})) is first
+    # An incremental ingestion that changes songs writes the index of the next version
+    changed = random_songs(500, seed=1)
+    with patch('dataParsing.get_config', return_value={}):
+        upsert_songs(db_path, [changed])
+    assert os.listdir(index_root(db_path)) == ["v2"]
+    second = manager.current(db_path, 2, similarity_settings({}))
+    assert second is not first
+    assert second.version == 2
+
+
+# ---------------------------------------
+# 5. Test GET /songs/<id>/similar
+# ---------------------------------------
+def test_similar_endpoint(catalog):
+    db_path, df = catalog
+    response_cache.clear()
+    similarity_index.clear()
+    config = {"db_path": db_path}
+    with patch('db.get_config', return_value=config), patch('api.get_config', return_value=config), \
+            app.test_client() as client:
+        response = client.get('/songs/123/similar?k=3')
+        assert response.status_code == 200
+        data = response.get_json()
+        assert data["id"] == "123" and data["k"] == 3
+        assert [song["id"] for song in data["similar"]] == brute_force(df, "123", 3)
+        assert all("distance" in song and "rowid" not in song for song in data["similar"])
+        assert client.get('/songs/missing/similar').status_code == 404
+        assert client.get('/songs/123/similar?k=0').status_code == 400
+        assert client.get('/songs/123/similar?k=1000').status_code == 400
+        db.pool.close_all()
+    similarity_index.clear()
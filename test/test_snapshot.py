@@ -0,0 +1,147 @@
+import os
+import sqlite3
+import pandas as pd
+import pytest
+from unittest.mock import patch
+import db
+from api import app, response_cache, catalog_snapshot
+from dataParsing import save_to_db, upsert_songs
+from snapshot import SnapshotManager, ensure_snapshot, snapshot_root, write_snapshot
+from test_dataParsing import valid_song_data
+
+
+# Songs with a mix of plain and non-ASCII titles
+def songs(rows, title="Song"):
+    data = valid_song_data(rows)
+    data["title"] = [f"{title} {i} - café ♫ 日本" if i % 3 == 0 else f"{title} {i}" for i in range(rows)]
+    data["danceability"] = [i / rows for i in range(rows)]
+    df = pd.DataFrame(data)
+    df["rating"] = None
+    return df
+
+
+@pytest.fixture
+def catalog(tmp_path):
+    db_path = str(tmp_path / "playlist.db")
+    with patch('dataParsing.get_config', return_value={}):
+        save_to_db(songs(25), db_path)
+    return db_path
+
+
+# Every page of GET /songs, following the cursors, with the snapshot turned on or off
+def all_pages(client, query):
+    pages = []
+    url = f'/songs?{query}'
+    while url:
+        response = client.get(url)
+        assert response.status_code == 200
+        pages.append(response.get_data())
+        cursor = response.get_json()["next"]
+        url = f'/songs?limit=4&after={cursor}' if cursor else None
+    return pages
+
+
+def serve(db_path, enabled=True):
+    response_cache.clear()
+    catalog_snapshot.clear()
+    db.invalidate_count_cache()
+    config = {"db_path": db_path, "snapshot": {"enabled": enabled}}
+    return patch('db.get_config', return_value=config), patch('api.get_config', return_value=config)
+
+
+# ---------------------------------------
+# 1. Test the snapshot is written at ingestion
+# ---------------------------------------
+def test_snapshot_written_at_ingestion(catalog):
+    assert os.listdir(snapshot_root(catalog)) == ["v1"]
+    snapshot = SnapshotManager().current(catalog, 1)
+    assert snapshot.rows == 25
+    rows = snapshot.rows_between(0, 25)
+    conn = sqlite3.connect(catalog)
+    conn.row_factory = sqlite3.Row
+    expected = [dict(row) for row in conn.execute("SELECT rowid, * FROM songs ORDER BY rowid")]
+    conn.close()
+    for row in expected:
+        del row["rating"]
+    assert rows == expected
+    assert rows[0]["title"] == "Song 0 - café ♫ 日本"
+    assert snapshot.rows_between(20, 100) == expected[20:]
+    assert snapshot.rows_between(30, 40) == []
+
+
+# ---------------------------------------
+# 2. Test missing values survive the snapshot
+# ---------------------------------------
+def test_snapshot_nulls(catalog):
+    conn = sqlite3.connect(catalog)
+    conn.execute("UPDATE songs SET title = NULL, tempo = NULL, key = NULL WHERE id = '003'")
+    conn.commit()
+    conn.close()
+    write_snapshot(catalog, 1)
+    row = SnapshotManager().current(catalog, 1).rows_between(3, 4)[0]
+    assert row["title"] is None and row["tempo"] is None and row["key"] is None
+    assert row["energy"] == 0.8
+
+
+# ---------------------------------------
+# 3. Test GET /songs from the snapshot matches SQLite byte for byte
+# ---------------------------------------
+def test_snapshot_pages_match_sqlite(catalog):
+    # A rated song, so the rating overlay is exercised
+    with patch('db.get_config', return_value={"db_path": catalog}):
+        db.update_rating("002", 4.5)
+        db.pool.close_all()
+    patches = serve(catalog, enabled=False)
+    with patches[0], patches[1], app.test_client() as client:
+        expected = [all_pages(client, 'limit=4'), client.get('/songs?page=3&limit=5').get_data()]
+        db.pool.close_all()
+    patches = serve(catalog)
+    with patches[0], patches[1], patch('api.fetch_songs') as fetch_songs, app.test_client() as client:
+        assert [all_pages(client, 'limit=4'), client.get('/songs?page=3&limit=5').get_data()] == expected
+        # Nothing was read through the SQLite listing query
+        fetch_songs.assert_not_called()
+        db.pool.close_all()
+    catalog_snapshot.clear()
+
+
+# ---------------------------------------
+# 4. Test rating writes are served fresh from the snapshot
+# ---------------------------------------
+def test_snapshot_serves_new_ratings(catalog):
+    patches = serve(catalog)
+    with patches[0], patches[1], app.test_client() as client:
+        assert client.get('/songs?limit=3').get_json()["data"][1]["rating"] is None
+        assert client.post('/songs/001/rate', json={"rating": 3}).status_code == 200
+        song = client.get('/songs?limit=3').get_json()["data"][1]
+        assert song["rating"] == 3.0
+        assert song["ratings"] == {"count": 1, "mean": 3.0, "histogram": [0, 0, 0, 1, 0, 0]}
+        db.pool.close_all()
+    catalog_snapshot.clear()
+
+
+# ---------------------------------------
+# 5. Test a stale or missing snapshot falls back to SQLite
+# ---------------------------------------
+def test_stale_snapshot_falls_back(catalog):
+    # A re-ingestion moves the catalog version on; without its snapshot the API reads SQLite
+    with patch('dataParsing.get_config', return_value={"snapshot": {"enabled": False}}):
+        upsert_songs(catalog, [songs(30, title="Track")])
+    assert os.listdir(snapshot_root(catalog)) == ["v1"]
+    patches = serve(catalog)
+    with patches[0], patches[1], app.test_client() as client:
+        data = client.get('/songs?limit=30').get_json()
+        assert data["total"] == 30
+        assert data["data"][0]["title"] == "Track 0 - café ♫ 日本"
+        assert catalog_snapshot.current(catalog, 2) is None
+        # Once the new version's snapshot exists it is picked up
+        ensure_snapshot(catalog)
+        catalog_snapshot.clear()
+        response_cache.clear()
+        assert client.get('/songs?limit=30').get_data() == encoded(data)
+        assert catalog_snapshot.current(catalog, 2).rows == 30
+        db.pool.close_all()
+    catalog_snapshot.clear()
+
+
+def encoded(payload):
+    return app.json.response(payload).get_data()
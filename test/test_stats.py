@@ -0,0 +1,146 @@
+import os
+import sqlite3
+import numpy as np
+import pandas as pd
+import pytest
+from unittest.mock import patch
+import db
+from api import app, response_cache, column_stats
+from dataParsing import save_to_db, upsert_songs
+from schema import NUMERIC_COLUMNS
+from stats import stats_path
+from test_dataParsing import valid_song_data
+
+
+def songs(rows):
+    data = valid_song_data(rows)
+    data["energy"] = [(i * 37 % 100) / 100 for i in range(rows)]
+    data["tempo"] = [None if i % 5 == 0 else 80.0 + i for i in range(rows)]
+    df = pd.DataFrame(data)
+    df["rating"] = [None if i % 3 else (i % 11) / 2 for i in range(rows)]
+    return df
+
+
+# Run a function with the configuration of a catalog in place, starting from empty caches
+def using(config, function):
+    db.pool.close_all()
+    db.invalidate_count_cache()
+    response_cache.clear()
+    column_stats.clear()
+    with patch('db.get_config', return_value=config), patch('api.get_config', return_value=config), \
+            patch('dataParsing.get_config', return_value=config):
+        return function()
+
+
+# A catalog of 40 songs in one file
+@pytest.fixture
+def catalog(tmp_path):
+    config = {"db_path": str(tmp_path / "playlist.db"), "snapshot": {"enabled": False}}
+    using(config, lambda: save_to_db(songs(40), config["db_path"]))
+    yield config
+    db.pool.close_all()
+
+
+def get_stats():
+    with app.test_client() as client:
+        return client.get('/stats/songs').get_json()
+
+
+# The rating summary recomputed from scratch, to compare the running totals against
+def recomputed(config):
+    conn = sqlite3.connect(config["db_path"])
+    db.refresh_rating_summary(conn)
+    rows = {row[0]: list(row[1:]) for row in conn.execute("SELECT * FROM rating_summary")}
+    conn.rollback()
+    conn.close()
+    return rows
+
+
+# ---------------------------------------
+# 1. Test the ingestion summarizes every numeric column
+# ---------------------------------------
+def test_column_stats(catalog):
+    assert os.path.exists(stats_path(catalog["db_path"]))
+    stats = using(catalog, get_stats)
+    df = songs(40)
+    assert stats["songs"] == 40
+    assert set(stats["columns"]) == set(NUMERIC_COLUMNS)
+    energy = stats["columns"]["energy"]
+    assert energy["count"] == 40 and energy["nulls"] == 0
+    assert energy["min"] == df["energy"].min() and energy["max"] == df["energy"].max()
+    assert energy["mean"] == pytest.approx(df["energy"].mean())
+    assert energy["percentiles"]["p50"] == pytest.approx(np.percentile(df["energy"], 50))
+    assert energy["histogram"]["counts"] == np.histogram(df["energy"], bins=20)[0].tolist()
+    assert stats["columns"]["tempo"]["nulls"] == 8
+    rating = stats["columns"]["rating"]
+    assert rating["count"] == 14 and rating["nulls"] == 26
+    assert (rating["min"], rating["max"]) == (df["rating"].min(), df["rating"].max())
+    assert rating["mean"] == pytest.approx(df["rating"].mean())
+    assert sum(rating["histogram"]["counts"]) == 14
+    assert stats["ratings"]["count"] == 0
+
+    # The stats don't take a path under /songs/, so a song titled "stats" can still be looked up
+    conn = sqlite3.connect(catalog["db_path"])
+    conn.execute("UPDATE songs SET title = 'stats' WHERE rowid = 1")
+    conn.commit()
+    conn.close()
+    with app.test_client() as client:
+        response = using(catalog, lambda: client.get('/songs/stats?match=exact'))
+    assert response.status_code == 200
+    assert [song["title"] for song in response.get_json()] == ["stats"]
+
+
+# ---------------------------------------
+# 2. Test ratings update the rating stats in place
+# ---------------------------------------
+def test_rating_stats_follow_ratings(catalog):
+    def rate():
+        before = get_stats()
+        with app.test_client() as client:
+            assert client.post('/songs/001/rate', json={"rating": 5}).status_code == 200
+            assert client.post('/songs/rate', json=[{"id": "000", "rating": 1}, {"id": "001", "rating": 2},
+                                                        {"id": "033", "rating": 1}]).status_code == 200
+        return before, get_stats()
+
+    before, after = using(catalog, rate)
+    # Song 001 had no rating and now has a mean of 3.5; songs 000 and 033 had 0.0 and now have 1.0
+    assert after["columns"]["rating"]["count"] == before["columns"]["rating"]["count"] + 1
+    assert after["columns"]["rating"]["mean"] == pytest.approx(
+        (before["columns"]["rating"]["mean"] * 14 + 3.5 + 1.0 + 1.0) / 15)
+    assert after["columns"]["rating"]["min"] == 0.5
+    assert after["ratings"]["count"] == 4
+    assert after["ratings"]["mean"] == pytest.approx(9 / 4)
+    assert after["ratings"]["histogram"]["counts"] == [0, 0, 2, 0, 1, 0, 0, 0, 0, 1]
+    assert after["columns"]["energy"] == before["columns"]["energy"]
+
+    # The running totals match the ones recomputed from the tables
+    assert using(catalog, db.fetch_rating_summary)["songs"] == pytest.approx(recomputed(catalog)["songs"])
+    assert using(catalog, db.fetch_rating_summary)["ratings"] == pytest.approx(recomputed(catalog)["ratings"])
+
+
+# ---------------------------------------
+# 3. Test incremental ingestion, sharded catalogs and databases without the summary table
+# ---------------------------------------
+def test_rating_stats_layouts(catalog, tmp_path):
+    df = songs(40)
+    added = songs(44).iloc[40:].copy()
+    added["id"] = [f"new-{i}" for i in range(4)]
+    frames = [pd.concat([df.drop(index=[0, 3]), added])]
+    using(catalog, lambda: upsert_songs(catalog["db_path"], frames, delete_missing=True))
+    stats = using(catalog, get_stats)
+    assert stats["songs"] == 42
+    assert using(catalog, db.fetch_rating_summary)["songs"] == pytest.approx(recomputed(catalog)["songs"])
+
+    sharded = {"db_path": str(tmp_path / "sharded.db"), "snapshot": {"enabled": False}, "shards": {"count": 3}}
+    using(sharded, lambda: save_to_db(songs(40), sharded["db_path"]))
+    using(sharded, lambda: upsert_songs(sharded["db_path"], frames, delete_missing=True))
+    assert using(sharded, get_stats) == stats
+
+    # Databases ingested before the summary table existed have it aggregated on the fly
+    conn = sqlite3.connect(catalog["db_path"])
+    conn.execute("DROP TABLE rating_summary")
+    conn.execute("DROP TRIGGER ratings_summary_insert")
+    conn.execute("DROP TRIGGER songs_rating_summary")
+    conn.commit()
+    conn.close()
+    assert using(catalog, get_stats) == stats
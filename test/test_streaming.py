@@ -0,0 +1,78 @@
+import pytest
+import json
+from streaming import iter_columnar, iter_ndjson, iter_rows, iter_chunks, _JsonScanner
+
+# Columnar data in the same layout as input/playlist.json, with some awkward values
+COLUMNAR = {
+    "id": {"0": "001", "1": "002", "2": "003"},
+    "title": {"0": "Café ü 로꼬", "1": "Quote \" and } brace", "2": None},
+    "tempo": {"0": 120.5, "1": -3, "2": 1.5e3},
+}
+EXPECTED = [
+    {"id": "001", "title": "Café ü 로꼬", "tempo": 120.5},
+    {"id": "002", "title": "Quote \" and } brace", "tempo": -3},
+    {"id": "003", "title": None, "tempo": 1500.0},
+]
+
+
+# ----------------------------------
+# 1. Test columnar JSON streaming
+# ----------------------------------
+@pytest.mark.parametrize("ensure_ascii", [True, False])
+@pytest.mark.parametrize("block_size", [1, 3, 64, 1 << 16])
+def test_iter_columnar(tmp_path, monkeypatch, ensure_ascii, block_size):
+    path = tmp_path / "playlist.json"
+    path.write_text(json.dumps(COLUMNAR, ensure_ascii=ensure_ascii), encoding="utf-8")
+    # Tiny blocks force values, keys and numbers to be split across reads
+    original_init = _JsonScanner.__init__
+    monkeypatch.setattr(
+        _JsonScanner, "__init__",
+        lambda self, file, offset=0, block_size_=None: original_init(self, file, offset, block_size),
+    )
+    assert list(iter_columnar(path)) == EXPECTED
+
+
+def test_iter_columnar_mismatched_columns(tmp_path):
+    path = tmp_path / "playlist.json"
+    path.write_text(json.dumps({"id": {"0": "001", "1": "002"}, "title": {"0": "Song"}}))
+    with pytest.raises(ValueError):
+        list(iter_columnar(path))
+
+
+# ----------------------------------
+# 2. Test NDJSON streaming
+# ----------------------------------
+def test_iter_ndjson(tmp_path):
+    path = tmp_path / "playlist.ndjson"
+    path.write_text("\n".join(json.dumps(row) for row in EXPECTED) + "\n\n", encoding="utf-8")
+    assert list(iter_ndjson(path)) == EXPECTED
+    # The reader is picked from the file extension
+    assert list(iter_rows(str(path))) == EXPECTED
+
+
+# ----------------------------------
+# 3. Test chunking
+# ----------------------------------
+def test_iter_chunks():
+    assert list(iter_chunks(iter(range(5)), 2)) == [[0, 1], [2, 3], [4]]
+
+
+# ----------------------------------
+# 4. Test escaped non-ASCII text is read as written, like json.load
+# ----------------------------------
+@pytest.mark.parametrize("block_size", [1, 5, 1 << 16])
+def test_iter_columnar_escaped_text(tmp_path, monkeypatch, block_size):
+    path = tmp_path / "playlist.json"
+    # "Ã©" is the two characters "Ã©", not the UTF-8 bytes of "é", and raw UTF-8 sits next to escapes
+    path.write_bytes('{"id": {"0": "001", "1": "002"}, "t\\u00eftle": {"0": "\\u00c3\\u00a9", "1": "café \\u00e9 Ã©"},'
+                     ' "genre": {"0": ["\\u00c3\\u00a9", "ü"], "1": {"ü": "\\u00fc"}}}'.encode("utf-8"))
+    original_init = _JsonScanner.__init__
+    monkeypatch.setattr(
+        _JsonScanner, "__init__",
+        lambda self, file, offset=0, block_size_=None: original_init(self, file, offset, block_size),
+    )
+    with open(path, encoding="utf-8") as file:
+        columns = json.load(file)
+    expected = [{name: values[row] for name, values in columns.items()} for row in ("0", "1")]
+    assert expected[0]["tïtle"] == "Ã©"
+    assert list(iter_columnar(path)) == expected
@@ -0,0 +1,79 @@
+import pytest
+import sqlite3
+import threading
+import time
+from unittest.mock import patch
+import db
+from writer import RatingWriter, WriterBusy
+
+
+# Build a small songs table in a temporary database and point db.py at it
+@pytest.fixture
+def db_path(tmp_path):
+    path = tmp_path / "test.db"
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE songs (id TEXT, title TEXT, rating REAL)")
+    conn.executemany("INSERT INTO songs VALUES (?, ?, ?)", [(f"{i:03d}", f"Song {i}", None) for i in range(1, 11)])
+    conn.commit()
+    conn.close()
+    with patch('db.get_config', return_value={"db_path": str(path)}):
+        yield path
+    db.pool.close_all()
+
+
+# ----------------------------------------------
+# 1. Test concurrent updates are grouped into few commits
+# ----------------------------------------------
+def test_writer_coalesces_updates(db_path):
+    writer = RatingWriter(flush_interval=0.05)
+    results = {}
+
+    def rate(song_id):
+        results[song_id] = writer.update_rating(song_id, 4.0)
+
+    threads = [threading.Thread(target=rate, args=(f"{i:03d}",)) for i in range(1, 13)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    writer.close()
+    # Songs 011 and 012 don't exist, so they report 0 rows like update_rating does
+    assert results == {f"{i:03d}": (1 if i <= 10 else 0) for i in range(1, 13)}
+    assert writer.written == 12
+    assert writer.batches < 12
+    assert db.get_data_version() == writer.batches
+
+
+# ----------------------------------------------
+# 2. Test the bounded queue pushes back
+# ----------------------------------------------
+def test_writer_backpressure(db_path):
+    release = threading.Event()
+
+    # Hold the writer thread inside its first batch so the queue fills up
+    def slow_update(ratings):
+        release.wait()
+        return [1] * len(ratings)
+
+    with patch('writer.update_ratings', side_effect=slow_update):
+        writer = RatingWriter(flush_interval=0, max_batch=1, max_queue=1, enqueue_timeout=0.05)
+        first = writer.submit("001", 1.0)
+        time.sleep(0.05)
+        second = writer.submit("002", 1.0)
+        with pytest.raises(WriterBusy):
+            writer.submit("003", 1.0)
+        release.set()
+        assert first.result(timeout=5) == 1
+        assert second.result(timeout=5) == 1
+        writer.close()
+
+
+# ----------------------------------------------
+# 3. Test database errors reach every waiting caller
+# ----------------------------------------------
+def test_writer_propagates_errors(db_path):
+    with patch('writer.update_ratings', side_effect=sqlite3.OperationalError("database is locked")):
+        writer = RatingWriter(flush_interval=0)
+        with pytest.raises(sqlite3.OperationalError):
+            writer.update_rating("001", 1.0)
+        writer.close()
@@ -0,0 +1,101 @@
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from db import update_ratings
+
+'''
+Background writer that coalesces rating updates into grouped commits.
+Request threads hand their update to the writer and wait on a future for the result, while a single thread drains
+the queue and applies everything that arrived within the flush interval in one transaction. A burst of ratings
+then costs one commit per batch instead of one per request, and only one connection ever writes, so the requests
+no longer fight over the database lock. The queue is bounded: when it is full, submit waits up to enqueue_timeout
+and then raises WriterBusy, which the API turns into a 503.
+'''
+
+'''
+The comments are in greater detail to explain each step of the code
+'''
+
+logger = logging.getLogger("db_logger")
+
+
+# Raised when the writer's queue stays full for longer than the enqueue timeout
+class WriterBusy(Exception):
+    pass
+
+
+class RatingWriter:
+    def __init__(self, flush_interval=0.005, max_batch=500, max_queue=10000, enqueue_timeout=1.0):
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.enqueue_timeout = enqueue_timeout
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._closed = False
+        self.batches = 0
+        self.written = 0
+        self._thread = threading.Thread(target=self._run, name="rating-writer", daemon=True)
+        self._thread.start()
+
+    # Queue a rating update and return a future for the number of rows it updated
+    def submit(self, song_id, rating):
+        if self._closed:
+            raise RuntimeError("Rating writer is closed")
+        future = Future()
+        try:
+            self._queue.put((song_id, rating, future), timeout=self.enqueue_timeout)
+        except queue.Full:
+            raise WriterBusy("Too many pending rating updates")
+        return future
+
+    # Queue a rating update and wait for it to be committed
+    def update_rating(self, song_id, rating):
+        return self.submit(song_id, rating).result()
+
+    # Collect the next batch: block for the first update, then take whatever else arrives within the flush interval
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            # None is the stop marker queued by close(), after every update submitted before it
+            stop = any(item is None for item in batch)
+            updates = [item for item in batch if item is not None]
+            if updates:
+                self._write(updates)
+            if stop:
+                return
+
+    # Apply one batch in a single transaction and resolve its futures
+    def _write(self, updates):
+        try:
+            counts = update_ratings([(song_id, rating) for song_id, rating, _ in updates])
+        except Exception as e:
+            for _, _, future in updates:
+                future.set_exception(e)
+            return
+        for (_, _, future), count in zip(updates, counts):
+            future.set_result(count)
+        self.batches += 1
+        self.written += len(updates)
+
+    # Write everything still queued and stop the writer thread
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join()
+        logger.info(f"Rating writer stopped after {self.written} updates in {self.batches} commits")